@@ -40,3 +40,31 @@ CREATE TABLE IF NOT EXISTS reviewer_corrections (
     notes TEXT,
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
+
+-- Normalized columns written directly by the kimi-vl persistence sink
+-- (services/kimi-vl/persistence.py keeps an identical idempotent copy)
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS invoice_number TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS po_number TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS seller_name TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS buyer_name TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS invoice_date TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS total_amount NUMERIC;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS total_currency TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS confidence NUMERIC;
+CREATE INDEX IF NOT EXISTS idx_processed_documents_invoice_number ON processed_documents (invoice_number);
+CREATE INDEX IF NOT EXISTS idx_processed_documents_seller_name ON processed_documents (seller_name);
+
+-- line_items: one row per extracted invoice line (no JSONB unnesting needed)
+CREATE TABLE IF NOT EXISTS line_items (
+    id BIGSERIAL PRIMARY KEY,
+    processed_document_id BIGINT NOT NULL REFERENCES processed_documents(id) ON DELETE CASCADE,
+    line_no INTEGER NOT NULL,
+    model_code TEXT,
+    goods_description TEXT,
+    quantity NUMERIC,
+    unit_price NUMERIC,
+    amount NUMERIC
+);
+
+CREATE INDEX IF NOT EXISTS idx_line_items_document ON line_items (processed_document_id);
+CREATE INDEX IF NOT EXISTS idx_line_items_model_code ON line_items (model_code);
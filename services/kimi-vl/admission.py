@@ -0,0 +1,220 @@
+"""
+Admission control for /process and /orchestrate.
+
+A bounded number of pages may be in flight per worker. Requests beyond that
+wait in per-class queues served by weighted fair queuing (WFQ): each request
+gets a virtual finish tag ``start + pages / weight`` and the smallest tag is
+admitted next, so a burst of bulk PDFs cannot starve interactive uploads.
+
+If the estimated queue wait (pages ahead x observed seconds per page) already
+exceeds the class deadline, the request is rejected immediately with a
+Retry-After hint instead of timing out upstream after minutes.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PriorityClass:
+    def __init__(self, name: str, weight: float, max_wait_s: float):
+        self.name = name
+        self.weight = max(0.01, weight)
+        self.max_wait_s = max_wait_s
+        self.last_finish = 0.0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "max_wait_s": self.max_wait_s,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.wait_total / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 1),
+        }
+
+
+def parse_classes(spec: str) -> Dict[str, PriorityClass]:
+    """Parse ``name:weight:max_wait_s`` entries separated by commas."""
+    classes: Dict[str, PriorityClass] = {}
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        parts = entry.split(":")
+        name = parts[0]
+        weight = float(parts[1]) if len(parts) > 1 else 1.0
+        max_wait = float(parts[2]) if len(parts) > 2 else 60.0
+        classes[name] = PriorityClass(name, weight, max_wait)
+    if not classes:
+        raise ValueError("no admission classes configured")
+    return classes
+
+
+def parse_api_keys(spec: str) -> Dict[str, str]:
+    """Parse ``api_key:class`` entries separated by commas."""
+    out: Dict[str, str] = {}
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        key, _, cls = entry.rpartition(":")
+        if key:
+            out[key] = cls
+    return out
+
+
+class Ticket:
+    __slots__ = ("cls", "cost", "start_tag", "finish_tag", "enqueued_at", "admitted_at", "future")
+
+    def __init__(self, cls: PriorityClass, cost: int, start_tag: float, finish_tag: float):
+        self.cls = cls
+        self.cost = cost
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.enqueued_at = time.perf_counter()
+        self.admitted_at: Optional[float] = None
+        self.future: Optional[asyncio.Future] = None
+
+
+class AdmissionController:
+    """Per-worker page budget with WFQ between priority classes."""
+
+    def __init__(
+        self,
+        max_inflight_pages: int,
+        classes: Dict[str, PriorityClass],
+        default_class: str,
+        api_keys: Optional[Dict[str, str]] = None,
+        initial_seconds_per_page: float = 3.0,
+    ):
+        if default_class not in classes:
+            raise ValueError(f"default admission class '{default_class}' is not configured")
+        self.capacity = max(1, max_inflight_pages)
+        self.classes = classes
+        self.default_class = default_class
+        self.api_keys = api_keys or {}
+        self.inflight = 0
+        self.virtual_time = 0.0
+        self._heap: List[Tuple[float, int, Ticket]] = []
+        self._seq = itertools.count()
+        # EWMA of service seconds per page, used to estimate queue wait
+        self.seconds_per_page = initial_seconds_per_page
+
+    def classify(self, priority: Optional[str], api_key: Optional[str]) -> PriorityClass:
+        """The API key mapping (else the default class) decides; the header may only lower it."""
+        if api_key and self.api_keys.get(api_key) in self.classes:
+            base = self.classes[self.api_keys[api_key]]
+        else:
+            base = self.classes[self.default_class]
+        requested = self.classes.get(priority) if priority else None
+        if requested is not None and requested.weight <= base.weight:
+            return requested
+        return base
+
+    def _pages_ahead(self, finish_tag: float) -> int:
+        return sum(t.cost for _, _, t in self._heap if t.finish_tag <= finish_tag and not t.future.done())
+
+    def estimate_wait(self, cost: int, finish_tag: float) -> float:
+        backlog = self._pages_ahead(finish_tag) + max(0, self.inflight + cost - self.capacity)
+        if self.inflight + cost <= self.capacity and not self._heap:
+            return 0.0
+        return backlog * self.seconds_per_page / self.capacity
+
+    def _dispatch(self) -> None:
+        while self._heap:
+            _, _, ticket = self._heap[0]
+            if ticket.future.done():  # timed out / cancelled while queued
+                heapq.heappop(self._heap)
+                continue
+            # An oversized request is admitted alone once everything else drained.
+            if self.inflight + ticket.cost > self.capacity and self.inflight > 0:
+                return
+            heapq.heappop(self._heap)
+            self._grant(ticket)
+            self.virtual_time = max(self.virtual_time, ticket.start_tag)
+            ticket.future.set_result(None)
+
+    def _grant(self, ticket: Ticket) -> None:
+        self.inflight += ticket.cost
+        ticket.admitted_at = time.perf_counter()
+        wait = ticket.admitted_at - ticket.enqueued_at
+        cls = ticket.cls
+        cls.admitted += 1
+        cls.wait_total += wait
+        cls.wait_max = max(cls.wait_max, wait)
+
+    async def acquire(self, cls: PriorityClass, pages: int) -> Ticket:
+        cost = max(1, min(int(pages), self.capacity))
+        # A class with nothing queued starts at the current virtual time;
+        # carrying last_finish over would bank up its quiet traffic
+        start = max(self.virtual_time, cls.last_finish) if cls.queued else self.virtual_time
+        finish = start + cost / cls.weight
+        estimate = self.estimate_wait(cost, finish)
+        if estimate > cls.max_wait_s:
+            cls.rejected += 1
+            raise AdmissionRejected(
+                f"estimated queue wait {estimate:.1f}s exceeds {cls.max_wait_s:.0f}s for class '{cls.name}'",
+                retry_after=max(1, math.ceil(estimate - cls.max_wait_s)),
+            )
+        cls.last_finish = finish
+        ticket = Ticket(cls, cost, start, finish)
+        if not self._heap and self.inflight + cost <= self.capacity:
+            self._grant(ticket)
+            self.virtual_time = max(self.virtual_time, start)
+            return ticket
+
+        ticket.future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (finish, next(self._seq), ticket))
+        cls.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=cls.max_wait_s)
+        except asyncio.TimeoutError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                return ticket  # admitted just as the deadline fired
+            ticket.future.cancel()
+            cls.rejected += 1
+            self._dispatch()
+            raise AdmissionRejected(
+                f"queued longer than {cls.max_wait_s:.0f}s for class '{cls.name}'",
+                retry_after=max(1, math.ceil(self.seconds_per_page)),
+            )
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                self.release(ticket)
+            else:
+                ticket.future.cancel()
+            raise
+        finally:
+            cls.queued -= 1
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        self.inflight = max(0, self.inflight - ticket.cost)
+        if ticket.admitted_at is not None:
+            per_page = (time.perf_counter() - ticket.admitted_at) / ticket.cost
+            self.seconds_per_page = 0.8 * self.seconds_per_page + 0.2 * per_page
+        self._dispatch()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "max_inflight_pages": self.capacity,
+            "inflight_pages": self.inflight,
+            "queued_requests": sum(1 for _, _, t in self._heap if not t.future.done()),
+            "queued_pages": sum(t.cost for _, _, t in self._heap if not t.future.done()),
+            "seconds_per_page": round(self.seconds_per_page, 3),
+            "default_class": self.default_class,
+            "classes": {name: c.describe() for name, c in self.classes.items()},
+        }
@@ -0,0 +1,161 @@
+"""
+Dynamic micro-batching for local model inference.
+
+Page requests from concurrent /process and /orchestrate calls are queued and
+grouped into batches of up to ``max_batch_size`` (or whatever arrived within
+``max_wait_ms`` of the first page), run as a single forward pass and fanned
+back out to the waiting callers. With ``max_inflight`` > 1 several batches
+run at once, for models that serve batches in parallel (``InferencePool``).
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Protocol, Set
+
+logger = logging.getLogger(__name__)
+
+
+class PageRequest:
+    """One page waiting for inference.
+
+    In inference worker processes ``image`` is a memoryview of shared memory
+    and ``future`` is None; use ``bytes(image)`` if the model needs a copy.
+    """
+    __slots__ = ("image", "filename", "enqueued_at", "future")
+
+    def __init__(self, image: bytes, filename: str, future: "asyncio.Future[Dict[str, Any]]"):
+        self.image = image
+        self.filename = filename
+        self.enqueued_at = time.perf_counter()
+        self.future = future
+
+
+class BatchModel(Protocol):
+    """Anything that can run one forward pass over a list of pages."""
+    def predict_batch(self, pages: List[PageRequest]) -> List[Dict[str, Any]]:
+        ...  # pragma: no cover
+
+
+class MicroBatcher:
+    """Collects PageRequests into batches and runs them on a BatchModel.
+
+    ``predict_batch`` is blocking (CPU inference), so it runs in a worker
+    thread and the event loop keeps accepting requests meanwhile. At most
+    ``max_inflight`` batches run at once; while all are busy, waiting pages
+    accumulate into the next (fuller) batch.
+    """
+
+    def __init__(self, model: BatchModel, max_batch_size: int = 4, max_wait_ms: float = 20.0, max_inflight: int = 1):
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_inflight = max(1, int(max_inflight))
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+        # metrics
+        self._batches = 0
+        self._items = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+        self._infer_total = 0.0
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._inflight = asyncio.Semaphore(self.max_inflight)
+            self._worker = asyncio.create_task(self._run())
+        return self._queue
+
+    async def submit(self, image: bytes, filename: str) -> Dict[str, Any]:
+        """Queue one page and wait for its result."""
+        queue = self._ensure_worker()
+        fut: "asyncio.Future[Dict[str, Any]]" = asyncio.get_running_loop().create_future()
+        await queue.put(PageRequest(image, filename, fut))
+        return await fut
+
+    async def _collect(self, queue: asyncio.Queue) -> List[PageRequest]:
+        first = await queue.get()
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                # Take whatever is already waiting, but don't wait for more.
+                while len(batch) < self.max_batch_size and not queue.empty():
+                    batch.append(queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        queue, inflight = self._queue, self._inflight
+        while True:
+            await inflight.acquire()
+            try:
+                batch = await self._collect(queue)
+            except BaseException:
+                inflight.release()
+                raise
+            task = asyncio.create_task(self._infer(batch, inflight))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _infer(self, batch: List[PageRequest], inflight: asyncio.Semaphore) -> None:
+        started = time.perf_counter()
+        for req in batch:
+            wait = started - req.enqueued_at
+            self._queue_wait_total += wait
+            self._queue_wait_max = max(self._queue_wait_max, wait)
+        try:
+            results = await asyncio.to_thread(self.model.predict_batch, batch)
+            if len(results) != len(batch):
+                raise RuntimeError(f"model returned {len(results)} results for {len(batch)} pages")
+        except Exception as e:
+            logger.error(f"Batch inference failed for {len(batch)} pages: {e}")
+            for req in batch:
+                if not req.future.done():
+                    req.future.set_exception(e)
+        else:
+            for req, res in zip(batch, results):
+                if not req.future.done():
+                    req.future.set_result(res)
+        finally:
+            inflight.release()
+        self._infer_total += time.perf_counter() - started
+        self._batches += 1
+        self._items += len(batch)
+
+    async def close(self) -> None:
+        for task in [self._worker, *self._tasks]:
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+
+    def stats(self) -> Dict[str, Any]:
+        batches = self._batches or 1
+        items = self._items or 1
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "max_inflight": self.max_inflight,
+            "inflight": len(self._tasks),
+            "batches": self._batches,
+            "pages": self._items,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "avg_batch_size": round(self._items / batches, 2),
+            "batch_fill_rate": round(self._items / (batches * self.max_batch_size), 3),
+            "avg_queue_wait_ms": round(self._queue_wait_total / items * 1000, 2),
+            "max_queue_wait_ms": round(self._queue_wait_max * 1000, 2),
+            "avg_batch_latency_ms": round(self._infer_total / batches * 1000, 2),
+        }
@@ -0,0 +1,163 @@
+"""
+Local document-type classifier.
+
+Labels a document as invoice, packing list or certificate from its text
+layer in a few milliseconds, with no model or network call. Each type has
+weighted key phrases; phrases in the title zone (the first lines of page 1)
+count triple, because trade documents copy each other's body text (an
+invoice mentions weights and cartons, a packing list quotes the invoice
+number) but the title says what the document is.
+
+Confidence is the winning score's share of all scores plus a fixed prior
+for "other", so a document with only weak or mixed signals gets a low
+confidence rather than a wrong certain label.
+
+Scans and photos have no text layer. The method is then "no_text_layer" and
+callers keep their default; ``classify_text`` also works on text a model
+has already produced for the document.
+
+    python classifier.py sample_docs/*.pdf
+"""
+
+import argparse
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from decoding import FITZ_LOCK
+
+DOC_TYPES = ("invoice", "packing_list", "certificate")
+OTHER = "other"
+
+# (phrase, weight). Phrases are matched on word boundaries, case-insensitive.
+KEYWORDS: Dict[str, List[Tuple[str, float]]] = {
+    "invoice": [
+        ("commercial invoice", 6), ("sales invoice", 6), ("tax invoice", 6), ("proforma invoice", 5),
+        ("invoice", 3), ("fatura", 3), ("rechnung", 3), ("facture", 3),
+        ("unit price", 2), ("amount due", 2), ("total amount", 2), ("invoice no", 2), ("invoice number", 2),
+        ("vat", 1), ("iban", 1), ("swift", 1), ("payment", 1), ("due date", 1), ("subtotal", 1),
+    ],
+    "packing_list": [
+        ("packing list", 7), ("packing slip", 6), ("ceki listesi", 5), ("packliste", 5),
+        ("gross weight", 2), ("net weight", 2), ("g.w", 1), ("n.w", 1), ("cbm", 1), ("measurement", 1),
+        ("carton", 1), ("cartons", 1), ("ctns", 1), ("pallet", 1), ("packages", 1), ("package no", 2),
+    ],
+    "certificate": [
+        ("certificate of origin", 8), ("certificate of analysis", 8), ("certificate of conformity", 8),
+        ("eur.1", 6), ("movement certificate", 6), ("menşe şahadetnamesi", 6),
+        ("certificate", 4), ("certify", 2), ("certified", 2), ("hereby", 2), ("chamber of commerce", 3),
+        ("issuing authority", 2), ("country of origin", 1), ("conformity", 1), ("declaration", 1),
+    ],
+}
+
+TITLE_LINES = 8            # non-empty lines of page 1 that count as the title zone
+TITLE_BOOST = 3.0
+MAX_HITS = 3               # per phrase, so long tables don't drown the title
+OTHER_PRIOR = 4.0          # pseudo-score for "none of the above"
+MIN_SCORE = 4.0            # below this the document is "other"
+MIN_TEXT_CHARS = 80        # less text than this means a scan
+MAX_PAGES = 1              # page 1 carries the title and most header text
+
+# One alternation over all phrases, longest first, so the text is scanned
+# once and "commercial invoice" is not also counted as "invoice"
+_PHRASES: Dict[str, List[Tuple[str, float]]] = {}
+for _doc_type, _phrases in KEYWORDS.items():
+    for _phrase, _weight in _phrases:
+        _PHRASES.setdefault(_phrase, []).append((_doc_type, _weight))
+_PATTERN = re.compile(
+    r"(?<!\w)(" + "|".join(re.escape(p) for p in sorted(_PHRASES, key=len, reverse=True)) + r")(?!\w)"
+)
+
+
+def _hits(text: str) -> Dict[str, int]:
+    counts: Dict[str, int] = {}
+    for phrase in _PATTERN.findall(text):
+        counts[phrase] = counts.get(phrase, 0) + 1
+    return counts
+
+
+def classify_text(text: str) -> Dict[str, Any]:
+    """Score ``text`` against every document type; no I/O."""
+    lowered = text.lower()
+    title = "\n".join([ln for ln in lowered.splitlines() if ln.strip()][:TITLE_LINES])
+    in_title = _hits(title)
+    scores: Dict[str, float] = {t: 0.0 for t in KEYWORDS}
+    signals: Dict[str, List[str]] = {t: [] for t in KEYWORDS}
+    for phrase, n in _hits(lowered).items():
+        n = min(MAX_HITS, n) + (TITLE_BOOST - 1 if phrase in in_title else 0)
+        for doc_type, weight in _PHRASES[phrase]:
+            scores[doc_type] += weight * n
+            signals[doc_type].append(f"title:{phrase}" if phrase in in_title else phrase)
+    scores = {t: round(v, 2) for t, v in scores.items()}
+    best = max(scores, key=scores.get)
+    top = scores[best]
+    if top < MIN_SCORE:
+        return {"doc_type": OTHER, "confidence": round(OTHER_PRIOR / (OTHER_PRIOR + sum(scores.values())), 3),
+                "scores": scores, "signals": []}
+    return {
+        "doc_type": best,
+        "confidence": round(top / (sum(scores.values()) + OTHER_PRIOR), 3),
+        "scores": scores,
+        "signals": signals[best],
+    }
+
+
+def document_text(data: bytes, max_pages: int = MAX_PAGES) -> Optional[str]:
+    """Text layer of the first pages of a PDF; None for images and scans."""
+    if not data.startswith(b"%PDF"):
+        return None
+    with FITZ_LOCK, fitz.open(stream=data, filetype="pdf") as doc:
+        text = "\n".join(doc[i].get_text() for i in range(min(max_pages, len(doc))))
+    return text if len(text.strip()) >= MIN_TEXT_CHARS else None
+
+
+def classify_document(data: bytes) -> Dict[str, Any]:
+    """Classify raw upload bytes. ``method`` says what the label is based on."""
+    started = time.perf_counter()
+    try:
+        text = document_text(data)
+    except Exception:
+        text = None
+    if text is None:
+        result = {"doc_type": OTHER, "confidence": 0.0, "scores": {}, "signals": [], "method": "no_text_layer"}
+    else:
+        result = {**classify_text(text), "method": "text_layer"}
+    result["ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+class ClassifierStats:
+    """Per-label counts and latency for /health."""
+
+    def __init__(self) -> None:
+        self.by_type: Dict[str, int] = {}
+        self.by_method: Dict[str, int] = {}
+        self.total_ms = 0.0
+        self.count = 0
+
+    def add(self, result: Dict[str, Any]) -> None:
+        self.by_type[result["doc_type"]] = self.by_type.get(result["doc_type"], 0) + 1
+        self.by_method[result["method"]] = self.by_method.get(result["method"], 0) + 1
+        self.total_ms += result.get("ms", 0.0)
+        self.count += 1
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "classified": self.count,
+            "by_type": self.by_type,
+            "by_method": self.by_method,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify documents by type from their text layer.")
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args()
+    for path in args.files:
+        with open(path, "rb") as f:
+            res = classify_document(f.read())
+        print(f"{path}: {json.dumps(res, ensure_ascii=False)}")
@@ -0,0 +1,209 @@
+"""
+Unified input decoding for /process and /orchestrate.
+
+Uploads are identified by their magic bytes rather than the filename, then
+turned into normalized page images:
+
+- PDF: each page rasterized lazily with PyMuPDF
+- JPEG: decoded at a reduced DCT scale (``draft``) when larger than
+  ``max_side``, so a 12 MP phone photo never materializes at full size
+- TIFF: every frame of a multi-page fax becomes its own page
+- EXIF orientation is applied; images that need no change are passed
+  through as the original bytes (no re-encode, no copy)
+
+Page sources share the (page_count, render, encode, close) shape used by
+``pipeline.DocumentPipeline``; ``close`` releases the parsed document and
+may be called more than once.
+"""
+
+import base64
+import io
+import threading
+from typing import Any, Callable, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageOps
+
+RenderFn = Callable[[int], Any]
+EncodeFn = Callable[[Any], bytes]
+CloseFn = Callable[[], None]
+
+# (prefix, offset, mime)
+_MAGIC = [
+    (b"%PDF-", 0, "application/pdf"),
+    (b"\xff\xd8\xff", 0, "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", 0, "image/png"),
+    (b"II*\x00", 0, "image/tiff"),
+    (b"MM\x00*", 0, "image/tiff"),
+    (b"GIF87a", 0, "image/gif"),
+    (b"GIF89a", 0, "image/gif"),
+    (b"BM", 0, "image/bmp"),
+    (b"WEBP", 8, "image/webp"),
+]
+
+EXIF_ORIENTATION = 0x0112
+
+# PyMuPDF is not thread-safe: documents opened in different threads still
+# share MuPDF state. Every fitz call in the service (decoding, classifier,
+# features, templates) runs under this lock; reentrant so helpers can nest.
+FITZ_LOCK = threading.RLock()
+
+
+class UnsupportedFormat(ValueError):
+    """Unknown file type, or a known one the parser cannot read."""
+
+
+def sniff_mime(data: bytes) -> Optional[str]:
+    """Identify a file from its leading bytes; None when unknown."""
+    head = data[:16]
+    for magic, offset, mime in _MAGIC:
+        if head[offset:offset + len(magic)] == magic:
+            if mime == "image/webp" and head[:4] != b"RIFF":
+                continue
+            return mime
+    # Some PDFs carry junk (e.g. a BOM or mail header) before the marker.
+    if b"%PDF-" in data[:1024]:
+        return "application/pdf"
+    return None
+
+
+def data_url(image: bytes) -> str:
+    """base64 data URL labelled with the sniffed type (PNG if unknown)."""
+    mime = sniff_mime(image) or "image/png"
+    return f"data:{mime};base64,{base64.b64encode(image).decode('utf-8')}"
+
+
+def _open_pdf(data: bytes) -> "fitz.Document":
+    """Open a PDF; the caller holds FITZ_LOCK."""
+    try:
+        doc = fitz.open(stream=data, filetype="pdf")
+    except Exception as e:
+        raise UnsupportedFormat(f"unreadable PDF: {e}") from e
+    if doc.page_count < 1:
+        # MuPDF repairs truncated files rather than failing; nothing survived
+        doc.close()
+        raise UnsupportedFormat("PDF has no readable pages (damaged or truncated)")
+    return doc
+
+
+def _open_image(data: bytes, mime: str) -> Image.Image:
+    try:
+        return Image.open(io.BytesIO(data))
+    except Exception as e:
+        raise UnsupportedFormat(f"unreadable {mime} image: {e}") from e
+
+
+def _encode(img: Image.Image, mime: str) -> bytes:
+    buf = io.BytesIO()
+    if mime == "image/jpeg":
+        img.convert("RGB").save(buf, format="JPEG", quality=90, optimize=True)
+    else:
+        if img.mode not in ("1", "L", "RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        img.save(buf, format="PNG", optimize=False, compress_level=6)
+    return buf.getvalue()
+
+
+def _normalize(img: Image.Image, max_side: int) -> Tuple[Image.Image, bool]:
+    """Apply EXIF orientation and cap the long side. Returns (image, changed)."""
+    changed = False
+    if img.getexif().get(EXIF_ORIENTATION, 1) not in (None, 1):
+        img = ImageOps.exif_transpose(img)
+        changed = True
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        changed = True
+    return img, changed
+
+
+def _raster_source(data: bytes, mime: str, max_side: int) -> Tuple[int, RenderFn, EncodeFn, CloseFn]:
+    img = _open_image(data, mime)
+    frames = getattr(img, "n_frames", 1) if mime == "image/tiff" else 1
+    out_mime = "image/jpeg" if mime == "image/jpeg" else "image/png"
+
+    def render(index: int) -> Any:
+        if frames > 1:
+            img.seek(index)
+            frame = img.copy()
+        else:
+            frame = img
+            if mime == "image/jpeg" and max(frame.size) > max_side:
+                # Let libjpeg decode at 1/2, 1/4 or 1/8 scale; thumbnail finishes the job.
+                frame.draft("RGB", (max_side, max_side))
+        frame, changed = _normalize(frame, max_side)
+        if not changed and frames == 1 and mime in ("image/jpeg", "image/png"):
+            return data  # already a model-ready page; skip decode/re-encode
+        return frame
+
+    def encode(raster: Any) -> bytes:
+        if isinstance(raster, bytes):
+            return raster
+        return _encode(raster, out_mime)
+
+    def close() -> None:
+        # A single-frame page is the opened image itself and is encoded after
+        # rendering finishes; the upload bytes are already in memory, so there
+        # is no file handle to release early
+        pass
+
+    return frames, render, encode, close
+
+
+def _pdf_source(data: bytes, dpi: int) -> Tuple[int, RenderFn, EncodeFn, CloseFn]:
+    # The lock also orders close() against a page still rendering in another thread
+    with FITZ_LOCK:
+        doc = _open_pdf(data)
+        page_count = doc.page_count
+
+    def render(index: int) -> Any:
+        with FITZ_LOCK:
+            return doc[index].get_pixmap(dpi=dpi)
+
+    def encode(pix: Any) -> bytes:
+        # Pixmaps are standalone; encoding works after the document is closed
+        with FITZ_LOCK:
+            return pix.tobytes("png")
+
+    def close() -> None:
+        with FITZ_LOCK:
+            if not doc.is_closed:
+                doc.close()
+
+    return page_count, render, encode, close
+
+
+def document_page_source(
+    data: bytes, max_side: int = 2048, dpi: int = 200
+) -> Tuple[str, int, RenderFn, EncodeFn, CloseFn]:
+    """Return (mime, page_count, render, encode, close) for any supported upload."""
+    mime = sniff_mime(data)
+    if mime is None:
+        raise UnsupportedFormat("unrecognized file format (expected PDF, JPEG, PNG, TIFF, WebP, GIF or BMP)")
+    if mime == "application/pdf":
+        return (mime, *_pdf_source(data, dpi))
+    return (mime, *_raster_source(data, mime, max_side))
+
+
+def count_pages(data: bytes) -> int:
+    """Cheap page count (no rendering) for admission control.
+    Raises UnsupportedFormat for PDFs and TIFFs the parser cannot read."""
+    mime = sniff_mime(data)
+    if mime == "application/pdf":
+        with FITZ_LOCK, _open_pdf(data) as doc:
+            return doc.page_count
+    if mime == "image/tiff":
+        with _open_image(data, mime) as img:
+            return getattr(img, "n_frames", 1)
+    return 1
+
+
+def decode_pages(data: bytes, max_side: int = 2048, dpi: int = 200) -> Tuple[str, List[bytes]]:
+    """Eagerly decode every page (blocking); returns (source mime, page images).
+    A page the parser cannot decode (e.g. a truncated JPEG) raises UnsupportedFormat."""
+    mime, count, render, encode, close = document_page_source(data, max_side=max_side, dpi=dpi)
+    try:
+        return mime, [encode(render(i)) for i in range(count)]
+    except Exception as e:
+        raise UnsupportedFormat(f"could not decode {mime}: {e}") from e
+    finally:
+        close()
@@ -0,0 +1,268 @@
+"""
+Routing features estimated from the upload itself, in milliseconds.
+
+``config/routing.yml`` rules read ``size_bytes``, ``table_density`` and
+``expected_line_items``. They are estimated per page, without a model:
+
+- PDF pages with a text layer: words are grouped into visual rows; a row
+  with at least two numbers spread over three or more columns is a line-item
+  row (summary rows such as "Total" are not). Tables without numbers fall
+  back to counting horizontal rules in the page drawings.
+- Scanned pages and images: a grayscale thumbnail is cut into text bands
+  with a horizontal ink profile; a band whose ink falls into three or more
+  separated column groups is a table row. Wrapped description lines sit in
+  one column and are not counted; the first table band is taken to be the
+  column heading, so continuation pages come out one row low.
+
+``table_density`` is the share of a page's rows that lie inside its table
+(first to last table row). Pages after ``max_pages`` are not analysed; they
+get the average of the analysed pages.
+
+    python features.py sample_docs/*.pdf
+"""
+
+import argparse
+import io
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageOps
+
+from decoding import FITZ_LOCK, sniff_mime
+
+MAX_PAGES = 20              # pages analysed per document; the rest are extrapolated
+MIN_TEXT_WORDS = 10         # fewer words than this means a scanned page
+
+# Text layer (PDF points)
+ROW_TOLERANCE = 3.0         # words whose vertical centres are this close share a row
+COLUMN_GAP = 12.0           # white space that separates two cells
+MIN_NUMBERS = 2
+MIN_CELLS = 3
+RULE_MIN_WIDTH = 0.3        # horizontal rules must span this share of the page
+MIN_RULES = 4
+
+# Thumbnails (pixels)
+THUMB_HEIGHT = 1100         # ~95 dpi for A4, so 8 pt rows stay separable
+INK_LEVEL = 150             # gray values below this are ink
+ROW_INK = 0.01              # share of ink for a pixel row to belong to a text band
+RULE_INK = 0.5              # pixel rows this dark across are ruling lines
+MIN_BAND = 3
+MAX_BAND_SHARE = 0.04       # taller bands are logos or pictures, not text
+COLUMN_BINS = 96
+BIN_INK = 0.02
+MIN_BIN_GAP = 2             # empty bins between two cells
+
+_NUMBER = re.compile(r"^[(+\-]?\d[\d.,']*%?\)?$")
+_SUMMARY = re.compile(r"\b(total|subtotal|sub-total|toplam|gesamt|amount due|balance)\b", re.IGNORECASE)
+_INK_LUT = [255 if v < INK_LEVEL else 0 for v in range(256)]
+
+
+def _page_result(method: str, rows: int, table_rows: int, region_rows: int, expected: int) -> Dict[str, Any]:
+    return {
+        "method": method,
+        "rows": rows,
+        "table_rows": table_rows,
+        "table_density": round(region_rows / rows, 3) if rows else 0.0,
+        "expected_line_items": max(0, expected),
+    }
+
+
+def _visual_rows(words: List[Tuple]) -> List[List[Tuple]]:
+    rows: List[List[Tuple]] = []
+    centre = None
+    for w in sorted(words, key=lambda w: ((w[1] + w[3]) / 2, w[0])):
+        c = (w[1] + w[3]) / 2
+        if centre is not None and c - centre <= ROW_TOLERANCE:
+            rows[-1].append(w)
+        else:
+            rows.append([w])
+            centre = c
+    return rows
+
+
+def _is_table_row(row: List[Tuple]) -> bool:
+    row = sorted(row, key=lambda w: w[0])
+    numbers = sum(1 for w in row if _NUMBER.match(w[4]))
+    if numbers < MIN_NUMBERS:
+        return False
+    cells = 1 + sum(1 for a, b in zip(row, row[1:]) if b[0] - a[2] > COLUMN_GAP)
+    if cells < MIN_CELLS:
+        return False
+    return not _SUMMARY.search(" ".join(w[4] for w in row))
+
+
+def _horizontal_rules(page: "fitz.Page") -> List[int]:
+    min_width = page.rect.width * RULE_MIN_WIDTH
+    ys = set()
+    for path in page.get_drawings():
+        for item in path["items"]:
+            if item[0] == "l":
+                p1, p2 = item[1], item[2]
+                if abs(p1.y - p2.y) < 1 and abs(p1.x - p2.x) >= min_width:
+                    ys.add(round(p1.y))
+            elif item[0] == "re":
+                r = item[1]
+                if r.height < 2 and r.width >= min_width:
+                    ys.add(round(r.y0))
+    return sorted(ys)
+
+
+def _text_layer_page(page: "fitz.Page") -> Optional[Dict[str, Any]]:
+    words = page.get_text("words")
+    if len(words) < MIN_TEXT_WORDS:
+        return None
+    rows = _visual_rows(words)
+    flags = [_is_table_row(r) for r in rows]
+    table_rows = sum(flags)
+    if table_rows < MIN_NUMBERS:
+        # Tables of text (certificates, packing lists without weights) are
+        # usually ruled; n rules bound n - 1 rows, one of them the heading
+        rules = _horizontal_rules(page)
+        if len(rules) >= MIN_RULES:
+            inside = sum(1 for r in rows if rules[0] < (r[0][1] + r[0][3]) / 2 < rules[-1])
+            return _page_result("drawings", len(rows), len(rules) - 1, inside, len(rules) - 2)
+    region = flags.index(True) if table_rows else 0
+    region_rows = len(flags) - region - flags[::-1].index(True) if table_rows else 0
+    return _page_result("text_layer", len(rows), table_rows, region_rows, table_rows)
+
+
+def _thumbnail_page(img: Image.Image) -> Dict[str, Any]:
+    # Integer box reduction is several times cheaper than resampling; the
+    # thumbnail ends up between THUMB_HEIGHT and twice that
+    factor = img.height // THUMB_HEIGHT
+    if factor >= 2:
+        img = img.reduce(factor)
+    ink = img.convert("L").point(_INK_LUT)
+    width, height = ink.size
+    # Box-filtering to one column gives the ink share of every pixel row
+    profile = [v / 255 for v in ink.resize((1, height), Image.BOX).tobytes()]
+
+    bands: List[Tuple[int, int]] = []
+    start = None
+    for y, share in enumerate(profile + [0.0]):
+        text = ROW_INK < share < RULE_INK
+        if text and start is None:
+            start = y
+        elif not text and start is not None:
+            if MIN_BAND <= y - start <= height * MAX_BAND_SHARE:
+                bands.append((start, y))
+            start = None
+
+    flags = []
+    for y0, y1 in bands:
+        bins = ink.crop((0, y0, width, y1)).resize((COLUMN_BINS, 1), Image.BOX).tobytes()
+        cells, gap = 0, MIN_BIN_GAP
+        for v in bins:
+            if v / 255 > BIN_INK:
+                cells += gap >= MIN_BIN_GAP
+                gap = 0
+            else:
+                gap += 1
+        flags.append(cells >= MIN_CELLS)
+    table_rows = sum(flags)
+    region_rows = len(flags) - flags.index(True) - flags[::-1].index(True) if table_rows else 0
+    # The first table band is normally the column heading
+    return _page_result("thumbnail", len(bands), table_rows, region_rows, table_rows - 1)
+
+
+def _pdf_pages(data: bytes, max_pages: int) -> Tuple[int, List[Dict[str, Any]]]:
+    pages = []
+    with FITZ_LOCK, fitz.open(stream=data, filetype="pdf") as doc:
+        for index in range(min(len(doc), max_pages)):
+            page = doc[index]
+            result = _text_layer_page(page)
+            if result is None:
+                scale = THUMB_HEIGHT / max(1.0, page.rect.height)
+                pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY, alpha=False)
+                result = _thumbnail_page(Image.frombytes("L", (pix.width, pix.height), pix.samples))
+            pages.append(result)
+        return len(doc), pages
+
+
+def _image_pages(data: bytes, max_pages: int) -> Tuple[int, List[Dict[str, Any]]]:
+    pages = []
+    with Image.open(io.BytesIO(data)) as img:
+        count = getattr(img, "n_frames", 1)
+        for index in range(min(count, max_pages)):
+            img.seek(index)
+            if img.format == "JPEG":
+                img.draft("L", (max(1, img.width * THUMB_HEIGHT // max(1, img.height)), THUMB_HEIGHT))
+            pages.append(_thumbnail_page(ImageOps.exif_transpose(img)))
+    return count, pages
+
+
+def extract_features(data: bytes, max_pages: int = MAX_PAGES) -> Dict[str, Any]:
+    """Document and per-page routing features for raw upload bytes."""
+    started = time.perf_counter()
+    mime = sniff_mime(data)
+    try:
+        if mime == "application/pdf":
+            page_count, pages = _pdf_pages(data, max_pages)
+        elif mime is not None:
+            page_count, pages = _image_pages(data, max_pages)
+        else:
+            page_count, pages = 0, []
+    except Exception:
+        page_count, pages = 0, []
+
+    for number, page in enumerate(pages, start=1):
+        page["page"] = number
+    if pages and page_count > len(pages):
+        avg_items = round(sum(p["expected_line_items"] for p in pages) / len(pages))
+        avg_density = round(sum(p["table_density"] for p in pages) / len(pages), 3)
+        pages += [
+            {"page": n, "method": "extrapolated", "rows": None, "table_rows": None,
+             "table_density": avg_density, "expected_line_items": avg_items}
+            for n in range(len(pages) + 1, page_count + 1)
+        ]
+
+    rows = sum(p["rows"] or 0 for p in pages)
+    region = sum(p["table_density"] * (p["rows"] or 0) for p in pages)
+    analysed = [p for p in pages if p["method"] != "extrapolated"]
+    return {
+        "size_bytes": len(data),
+        "table_density": round(region / rows, 3) if rows else 0.0,
+        "expected_line_items": sum(p["expected_line_items"] for p in pages),
+        "pages": pages,
+        "analysed_pages": len(analysed),
+        "ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+
+
+class FeatureStats:
+    """Feature-extraction cost for /health."""
+
+    def __init__(self) -> None:
+        self.by_method: Dict[str, int] = {}
+        self.total_ms = 0.0
+        self.pages = 0
+        self.count = 0
+
+    def add(self, result: Dict[str, Any]) -> None:
+        for page in result["pages"]:
+            self.by_method[page["method"]] = self.by_method.get(page["method"], 0) + 1
+        self.total_ms += result.get("ms", 0.0)
+        self.pages += result["analysed_pages"]
+        self.count += 1
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "documents": self.count,
+            "pages_by_method": self.by_method,
+            "avg_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "avg_ms_per_page": round(self.total_ms / self.pages, 2) if self.pages else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimate routing features (size, table density, line items).")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--max-pages", type=int, default=MAX_PAGES)
+    args = parser.parse_args()
+    for path in args.files:
+        with open(path, "rb") as f:
+            res = extract_features(f.read(), args.max_pages)
+        print(f"{path}: {json.dumps(res, ensure_ascii=False)}")
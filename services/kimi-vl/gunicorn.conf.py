@@ -0,0 +1,53 @@
+# gunicorn settings for SERVER_MODE=production (see main.py __main__).
+# The app is imported once in the master (preload) and forked into workers.
+# The httpx and redis clients are constructed at import, in the master, but
+# open no connection until first use, which happens in a worker; batchers
+# and DB/trace writers start in each worker's startup hook. The local-model
+# InferencePool is per host: on_starting runs it as one separate process and
+# the workers attach to it through INFERENCE_SOCKET (see inference_pool.py).
+# The result cache, router stats, rate limits and the router config version
+# (POST /admin/router/reload) live in Redis.
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = f"{os.getenv('API_HOST', '0.0.0.0')}:{os.getenv('API_PORT', '8001')}"
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or multiprocessing.cpu_count()
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = int(os.getenv("WORKER_TIMEOUT", "180"))
+graceful_timeout = 30
+keepalive = 5
+loglevel = "info"
+accesslog = "-"
+
+# Read by main.py on import, which (preload) happens after this file runs
+_inference_workers = int(os.getenv("INFERENCE_WORKERS", "0"))
+if _inference_workers > 0 and os.getenv("PROCESSING_MODE", "openrouter") == "local":
+    os.environ.setdefault("INFERENCE_SOCKET", "/tmp/beyan-inference.sock")
+_inference_server = None
+
+
+def on_starting(server):
+    global _inference_server
+    if not os.getenv("INFERENCE_SOCKET"):
+        return
+    here = os.path.dirname(os.path.abspath(__file__))
+    _inference_server = subprocess.Popen([
+        sys.executable, os.path.join(here, "inference_pool.py"), "--serve",
+        "--socket", os.environ["INFERENCE_SOCKET"],
+        "--factory", os.getenv("INFERENCE_MODEL_FACTORY", "local_model:load_model"),
+        "--model-path", os.getenv("MODEL_PATH", "/models/kimi-vl"),
+        "--workers", str(_inference_workers),
+        "--slots", str(2 * int(os.getenv("MAX_BATCH_SIZE", "4"))),
+        "--slot-mb", os.getenv("INFERENCE_SLOT_MB", "8"),
+        "--timeout-s", os.getenv("INFERENCE_TIMEOUT_S", "120"),
+        "--health-interval-s", os.getenv("INFERENCE_HEALTH_INTERVAL_S", "5"),
+    ], cwd=here)
+
+
+def on_exit(server):
+    if _inference_server is not None and _inference_server.poll() is None:
+        _inference_server.terminate()
+        _inference_server.wait(timeout=30)
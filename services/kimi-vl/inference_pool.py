@@ -0,0 +1,585 @@
+"""
+Local model inference in dedicated worker processes.
+
+A model running inside the API process holds the GIL and the CPU while it
+works, which stalls the event loop for every other request. ``InferencePool``
+hosts the model in ``workers`` separate processes instead and is itself a
+``BatchModel``, so ``LocalProcessor``'s MicroBatcher feeds it unchanged.
+
+Page images are not pickled. Each worker owns a shared-memory arena of
+fixed-size slots; the API process writes a page into a free slot once, and
+only a small descriptor (slot offset, length, filename) crosses the worker's
+socket. The worker hands the model a memoryview of the slot, so the bytes
+are never copied again. Pages larger than a slot get a dedicated segment.
+
+Batches go to the alive worker with the fewest pages in flight. A monitor
+thread restarts workers that exit, stop answering pings while idle, or
+exceed ``timeout_s`` on a batch; a batch lost with its worker is retried once
+on another worker.
+
+Workers are plain subprocesses running this file, so they never import
+main.py. The model comes from ``factory`` ("module:callable", called with the
+model path), e.g. ``local_model:load_model``.
+
+Under gunicorn there is one pool per host, not per API worker: the master
+starts this file with ``--serve`` (see gunicorn.conf.py) and the API workers
+reach that ``PoolServer`` through a ``PoolClient`` on a Unix socket.
+``start()`` refuses a pool whose arenas do not fit in /dev/shm, since
+writing past a full tmpfs kills the writer with SIGBUS.
+"""
+
+import argparse
+import concurrent.futures
+import importlib
+import itertools
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple
+
+from batching import PageRequest
+
+logger = logging.getLogger(__name__)
+
+# (segment name or None for the arena, offset, length, filename)
+Descriptor = Tuple[Optional[str], int, int, str]
+
+
+class WorkerLost(RuntimeError):
+    """The worker serving a batch exited or was restarted."""
+
+
+def _attach(name: str) -> SharedMemory:
+    """Attach to a segment the API process owns.
+
+    Before Python 3.13 attaching registers the segment with this process's
+    resource tracker, which would unlink it when the worker exits.
+    """
+    shm = SharedMemory(name=name)
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore[attr-defined]
+    return shm
+
+
+def check_shm(required_bytes: int, path: str = "/dev/shm") -> None:
+    """Raise when ``required_bytes`` of arenas would not fit in ``path``."""
+    try:
+        st = os.statvfs(path)
+    except OSError:
+        return  # no /dev/shm on this platform; nothing to check against
+    available = st.f_bavail * st.f_frsize
+    if required_bytes > available:
+        raise RuntimeError(
+            f"inference pool needs {required_bytes >> 20} MiB of {path} but {available >> 20} MiB is free; "
+            "lower INFERENCE_WORKERS, MAX_BATCH_SIZE or INFERENCE_SLOT_MB, or raise KIMI_VL_SHM_SIZE"
+        )
+
+
+class _Worker:
+    """One incarnation of a worker process; a restart creates a new one."""
+
+    def __init__(self, index: int, slots: int, slot_bytes: int):
+        self.index = index
+        self.arena = SharedMemory(create=True, size=slots * slot_bytes)
+        self.free_slots = list(range(slots))
+        self.inflight: Dict[int, Tuple[concurrent.futures.Future, float, int]] = {}
+        self.pages_inflight = 0
+        self.proc: Optional[subprocess.Popen] = None
+        self.conn: Optional[Connection] = None
+        self.send_lock = threading.Lock()
+        self.ready = threading.Event()
+        self.lost = False
+        self.started_at = time.monotonic()
+        self.last_seen = time.monotonic()
+        self.batches = 0
+        self.pages = 0
+        self.busy_s = 0.0
+        self.load_ms: Optional[float] = None
+
+    def send(self, msg: Any) -> None:
+        with self.send_lock:
+            self.conn.send(msg)
+
+    def retire(self) -> None:
+        """Drop the arena name now; the mapping goes once no batch uses it."""
+        try:
+            self.arena.unlink()
+        except FileNotFoundError:
+            pass
+        self._close_arena()
+
+    def _close_arena(self) -> None:
+        if self.lost and self.pages_inflight == 0:
+            try:
+                self.arena.close()
+            except BufferError:
+                pass
+
+
+class InferencePool:
+    """A BatchModel that runs ``factory(model_path)`` in worker processes."""
+
+    def __init__(
+        self,
+        factory: str,
+        model_path: str,
+        workers: int = 1,
+        slots: int = 8,
+        slot_bytes: int = 8 << 20,
+        timeout_s: float = 120.0,
+        health_interval_s: float = 5.0,
+        start_timeout_s: float = 300.0,
+    ):
+        self.factory = factory
+        self.model_path = model_path
+        self.size = max(1, int(workers))
+        self.slots = max(1, int(slots))
+        self.slot_bytes = int(slot_bytes)
+        self.timeout_s = float(timeout_s)
+        self.health_interval_s = float(health_interval_s)
+        self.start_timeout_s = float(start_timeout_s)
+        self._workers: List[_Worker] = []
+        self._cond = threading.Condition()
+        self._ids = itertools.count(1)
+        self._closed = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+        # metrics
+        self._restarts = 0
+        self._retries = 0
+        self._oversize_pages = 0
+        self._shm_bytes = 0
+
+    # --- lifecycle -------------------------------------------------------
+
+    def start(self) -> None:
+        """Spawn the workers and wait until each has loaded the model."""
+        check_shm(self.size * self.slots * self.slot_bytes)
+        with self._cond:
+            self._workers = [self._spawn(i) for i in range(self.size)]
+        deadline = time.monotonic() + self.start_timeout_s
+        for w in self._workers:
+            if not w.ready.wait(max(0.0, deadline - time.monotonic())):
+                self.close()
+                raise RuntimeError(f"inference worker {w.index} did not load the model within {self.start_timeout_s}s")
+        self._monitor = threading.Thread(target=self._watch, name="inference-pool-monitor", daemon=True)
+        self._monitor.start()
+        logger.info(
+            f"Inference pool ready: {self.size} worker(s), pids {[w.proc.pid for w in self._workers]}, "
+            f"{self.slots} x {self.slot_bytes >> 20} MiB slots each"
+        )
+
+    def _spawn(self, index: int) -> _Worker:
+        w = _Worker(index, self.slots, self.slot_bytes)
+        parent, child = socket.socketpair()
+        w.proc = subprocess.Popen(
+            [
+                sys.executable, os.path.abspath(__file__), "--worker",
+                "--fd", str(child.fileno()), "--arena", w.arena.name,
+                "--factory", self.factory, "--model-path", self.model_path, "--index", str(index),
+            ],
+            pass_fds=[child.fileno()],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            # Factories importable here are importable in the worker
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(p for p in sys.path if p)},
+        )
+        child.close()
+        w.conn = Connection(parent.detach())
+        threading.Thread(target=self._read, args=(w,), name=f"inference-worker-{index}", daemon=True).start()
+        return w
+
+    def _restart(self, w: _Worker, reason: str) -> None:
+        with self._cond:
+            if self._closed.is_set() or self._workers[w.index] is not w:
+                return
+            logger.warning(f"Restarting inference worker {w.index} (pid {w.proc.pid}): {reason}")
+            self._lose(w)
+            self._workers[w.index] = self._spawn(w.index)
+            self._restarts += 1
+            self._cond.notify_all()
+
+    def _lose(self, w: _Worker) -> None:
+        """Fail the worker's batches and stop it. Caller holds the lock."""
+        w.lost = True
+        for fut, _, _ in w.inflight.values():
+            if not fut.done():
+                fut.set_exception(WorkerLost(f"inference worker {w.index} (pid {w.proc.pid}) lost"))
+        w.inflight.clear()
+        # The reader thread sees EOF and closes the connection; closing it
+        # here could hand its fd number to the replacement worker mid-recv
+        if w.proc.poll() is None:
+            w.proc.kill()
+            w.proc.wait(timeout=5)
+        w.retire()
+
+    def close(self) -> None:
+        self._closed.set()
+        with self._cond:
+            for w in self._workers:
+                if w.proc.poll() is None:
+                    try:
+                        w.send(("stop",))
+                    except OSError:
+                        pass
+            for w in self._workers:
+                try:
+                    w.proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    pass
+                self._lose(w)
+            self._cond.notify_all()
+
+    # --- IPC -------------------------------------------------------------
+
+    def _read(self, w: _Worker) -> None:
+        """Per-worker reader: resolves batch futures from worker replies."""
+        while True:
+            try:
+                msg = w.conn.recv()
+            except (EOFError, OSError):
+                w.conn.close()
+                break
+            # Any reply counts as a sign of life, not just pongs
+            w.last_seen = time.monotonic()
+            kind = msg[0]
+            if kind == "ready":
+                w.load_ms = msg[1].get("load_ms")
+                w.ready.set()
+                with self._cond:
+                    self._cond.notify_all()
+            elif kind in ("result", "error"):
+                with self._cond:
+                    entry = w.inflight.pop(msg[1], None)
+                if entry is None:
+                    continue
+                fut, started, pages = entry
+                w.batches += 1
+                w.pages += pages
+                w.busy_s += time.monotonic() - started
+                if kind == "result":
+                    fut.set_result(msg[2])
+                else:
+                    fut.set_exception(RuntimeError(msg[2]))
+        if not self._closed.is_set() and not w.lost:
+            self._restart(w, f"exited with code {w.proc.wait()}")
+
+    def _watch(self) -> None:
+        """Health checks: exited, stuck on a batch, or not answering pings while idle."""
+        while not self._closed.wait(self.health_interval_s):
+            now = time.monotonic()
+            for w in list(self._workers):
+                if w.proc.poll() is not None:
+                    self._restart(w, f"exited with code {w.proc.returncode}")
+                elif any(now - started > self.timeout_s for _, started, _ in list(w.inflight.values())):
+                    self._restart(w, f"batch exceeded {self.timeout_s}s")
+                elif w.ready.is_set() and not w.inflight:
+                    if now - w.last_seen > 3 * self.health_interval_s:
+                        self._restart(w, "no reply to health checks")
+                        continue
+                    try:
+                        w.send(("ping", now))
+                    except OSError:
+                        self._restart(w, "health check failed")
+                elif not w.ready.is_set() and now - w.started_at > self.start_timeout_s:
+                    self._restart(w, "did not load the model")
+
+    # --- BatchModel ------------------------------------------------------
+
+    def _acquire(self, pages: int) -> Tuple[_Worker, List[int]]:
+        """Least-loaded ready worker with enough free slots; waits when all are full."""
+        need = min(pages, self.slots)
+        with self._cond:
+            while True:
+                if self._closed.is_set():
+                    raise RuntimeError("inference pool is closed")
+                ready = [w for w in self._workers if w.ready.is_set() and not w.lost and len(w.free_slots) >= need]
+                if ready:
+                    w = min(ready, key=lambda w: w.pages_inflight)
+                    slots = [w.free_slots.pop() for _ in range(need)]
+                    w.pages_inflight += pages
+                    return w, slots
+                self._cond.wait(timeout=1.0)
+
+    def _release(self, w: _Worker, slots: List[int], pages: int, segments: List[SharedMemory]) -> None:
+        with self._cond:
+            w.free_slots.extend(slots)
+            w.pages_inflight -= pages
+            w._close_arena()
+            self._cond.notify_all()
+        for seg in segments:
+            seg.close()
+            seg.unlink()
+
+    def predict_batch(self, pages: List[PageRequest]) -> List[Dict[str, Any]]:
+        """Blocking; safe to call from several threads at once."""
+        for attempt in (1, 2):
+            w, slots = self._acquire(len(pages))
+            segments: List[SharedMemory] = []
+            try:
+                descriptors: List[Descriptor] = []
+                for i, page in enumerate(pages):
+                    data = page.image
+                    if i < len(slots) and len(data) <= self.slot_bytes:
+                        offset = slots[i] * self.slot_bytes
+                        w.arena.buf[offset:offset + len(data)] = data
+                        descriptors.append((None, offset, len(data), page.filename))
+                    else:
+                        seg = SharedMemory(create=True, size=max(1, len(data)))
+                        seg.buf[:len(data)] = data
+                        segments.append(seg)
+                        descriptors.append((seg.name, 0, len(data), page.filename))
+                        self._oversize_pages += 1
+                    self._shm_bytes += len(data)
+                batch_id = next(self._ids)
+                fut: concurrent.futures.Future = concurrent.futures.Future()
+                with self._cond:
+                    if w.lost:
+                        raise WorkerLost(f"inference worker {w.index} lost")
+                    w.inflight[batch_id] = (fut, time.monotonic(), len(pages))
+                try:
+                    w.send(("batch", batch_id, descriptors))
+                except OSError as e:
+                    self._restart(w, f"send failed: {e}")
+                # The monitor enforces timeout_s; this only guards against a dead monitor
+                return fut.result(timeout=self.timeout_s + 2 * self.health_interval_s + 5)
+            except WorkerLost:
+                if attempt == 2:
+                    raise
+                self._retries += 1
+                logger.warning(f"Retrying batch of {len(pages)} page(s) after losing worker {w.index}")
+            except concurrent.futures.TimeoutError:
+                self._restart(w, f"batch exceeded {self.timeout_s}s")
+                raise TimeoutError(f"inference batch exceeded {self.timeout_s}s")
+            finally:
+                self._release(w, slots, len(pages), segments)
+        raise AssertionError("unreachable")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": [
+                {
+                    "index": w.index,
+                    "pid": w.proc.pid if w.proc else None,
+                    "ready": w.ready.is_set() and not w.lost,
+                    "load_ms": w.load_ms,
+                    "pages_inflight": w.pages_inflight,
+                    "batches": w.batches,
+                    "pages": w.pages,
+                    "avg_batch_ms": round(w.busy_s / w.batches * 1000, 2) if w.batches else 0.0,
+                    "uptime_s": round(time.monotonic() - w.started_at, 1),
+                }
+                for w in self._workers
+            ],
+            "slots_per_worker": self.slots,
+            "slot_bytes": self.slot_bytes,
+            "restarts": self._restarts,
+            "retries": self._retries,
+            "oversize_pages": self._oversize_pages,
+            "shm_bytes_written": self._shm_bytes,
+        }
+
+
+class PoolServer:
+    """Serves one InferencePool to every API worker on the host.
+
+    Each client connection carries one batch at a time: a
+    ``("batch", filenames)`` message followed by one raw message per page
+    (not pickled), answered with ``("result", results)`` or ``("error", msg)``.
+    """
+
+    def __init__(self, pool: InferencePool, path: str):
+        self.pool = pool
+        self.path = path
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        listener = Listener(self.path, family="AF_UNIX")
+        os.chmod(self.path, 0o600)
+        logger.info(f"Inference pool serving on {self.path}")
+        try:
+            while True:
+                conn = listener.accept()
+                threading.Thread(target=self._serve, args=(conn,), name="inference-pool-client", daemon=True).start()
+        finally:
+            listener.close()
+
+    def _serve(self, conn: Connection) -> None:
+        with conn:
+            try:
+                while True:
+                    msg = conn.recv()
+                    if msg[0] == "stats":
+                        conn.send(("result", self.pool.stats()))
+                        continue
+                    pages = [PageRequest(conn.recv_bytes(), filename, None) for filename in msg[1]]
+                    try:
+                        reply = ("result", self.pool.predict_batch(pages))
+                    except Exception as e:
+                        reply = ("error", f"{type(e).__name__}: {e}")
+                    conn.send(reply)
+            except (EOFError, OSError):
+                return  # client went away (worker exit or its timeout)
+
+
+class PoolClient:
+    """BatchModel for API workers: forwards batches to the host's PoolServer.
+
+    Blocking and thread-safe like InferencePool; keeps one connection per
+    concurrent batch and drops a connection on any error.
+    """
+
+    def __init__(self, path: str, timeout_s: float = 120.0):
+        self.path = path
+        self.timeout_s = float(timeout_s)
+        self._idle: List[Connection] = []
+        self._lock = threading.Lock()
+
+    def wait_ready(self, timeout_s: float) -> None:
+        """Block until the server answers (it may still be loading the model)."""
+        deadline = time.monotonic() + timeout_s
+        while True:
+            try:
+                self._call(("stats",), [], timeout_s)
+                return
+            except OSError as e:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"inference pool server at {self.path} not reachable: {e}")
+                time.sleep(0.5)
+
+    def _call(self, msg: Any, payloads: List[Any], timeout_s: float) -> Any:
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = Client(self.path, family="AF_UNIX")
+        try:
+            conn.send(msg)
+            for data in payloads:
+                conn.send_bytes(data)
+            if not conn.poll(timeout_s):
+                raise TimeoutError(f"inference pool server did not answer within {timeout_s:.0f}s")
+            kind, payload = conn.recv()
+        except BaseException:
+            conn.close()
+            raise
+        with self._lock:
+            self._idle.append(conn)
+        if kind == "error":
+            raise RuntimeError(payload)
+        return payload
+
+    def predict_batch(self, pages: List[PageRequest]) -> List[Dict[str, Any]]:
+        # The server may queue the batch behind other API workers' batches
+        return self._call(("batch", [p.filename for p in pages]), [p.image for p in pages], 2 * self.timeout_s)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            return {"server": self.path, **self._call(("stats",), [], 2.0)}
+        except (OSError, EOFError) as e:
+            return {"server": self.path, "error": str(e)}
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+def _load_factory(spec: str) -> Any:
+    module, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module), attr or "load_model")
+
+
+def _worker_main(args: argparse.Namespace) -> None:
+    logging.basicConfig(level=logging.INFO, format=f"%(levelname)s:inference-worker-{args.index}:%(message)s")
+    conn = Connection(args.fd)
+    arena = _attach(args.arena)
+    started = time.perf_counter()
+    model = _load_factory(args.factory)(args.model_path)
+    conn.send(("ready", {"pid": os.getpid(), "load_ms": round((time.perf_counter() - started) * 1000, 1)}))
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg[0] == "ping":
+            conn.send(("pong", msg[1]))
+        elif msg[0] == "stop":
+            break
+        elif msg[0] == "batch":
+            _, batch_id, descriptors = msg
+            views: List[memoryview] = []
+            segments: List[SharedMemory] = []
+            pages = []
+            for name, offset, length, filename in descriptors:
+                if name is None:
+                    view = arena.buf[offset:offset + length]
+                else:
+                    seg = _attach(name)
+                    segments.append(seg)
+                    view = seg.buf[:length]
+                views.append(view)
+                pages.append(PageRequest(view, filename, None))
+            try:
+                conn.send(("result", batch_id, model.predict_batch(pages)))
+            except Exception as e:
+                logger.error(f"Batch {batch_id} failed: {e}")
+                conn.send(("error", batch_id, f"{type(e).__name__}: {e}"))
+            finally:
+                del pages
+                for view in views:
+                    view.release()
+                for seg in segments:
+                    seg.close()
+    arena.close()
+
+
+def _serve_main(args: argparse.Namespace) -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:inference-pool:%(message)s")
+    pool = InferencePool(
+        args.factory,
+        args.model_path,
+        workers=args.workers,
+        slots=args.slots,
+        slot_bytes=int(args.slot_mb * (1 << 20)),
+        timeout_s=args.timeout_s,
+        health_interval_s=args.health_interval_s,
+    )
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    pool.start()
+    try:
+        PoolServer(pool, args.socket).serve_forever()
+    finally:
+        pool.close()
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        parser = argparse.ArgumentParser(description="Host-wide inference pool (started by gunicorn.conf.py).")
+        parser.add_argument("--serve", action="store_true", required=True)
+        parser.add_argument("--socket", required=True)
+        parser.add_argument("--factory", required=True)
+        parser.add_argument("--model-path", required=True)
+        parser.add_argument("--workers", type=int, default=1)
+        parser.add_argument("--slots", type=int, default=8)
+        parser.add_argument("--slot-mb", type=float, default=8.0)
+        parser.add_argument("--timeout-s", type=float, default=120.0)
+        parser.add_argument("--health-interval-s", type=float, default=5.0)
+        _serve_main(parser.parse_args())
+        sys.exit(0)
+    parser = argparse.ArgumentParser(description="Inference worker process (started by InferencePool).")
+    parser.add_argument("--worker", action="store_true", required=True)
+    parser.add_argument("--fd", type=int, required=True)
+    parser.add_argument("--arena", required=True)
+    parser.add_argument("--factory", required=True)
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--index", type=int, default=0)
+    _worker_main(parser.parse_args())
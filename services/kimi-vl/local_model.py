@@ -0,0 +1,44 @@
+"""
+Local Kimi-VL model loading.
+
+Kept free of service imports so inference worker processes
+(``inference_pool.py``) can load the model without importing main.py.
+"""
+
+from typing import Any, Dict, List
+
+from batching import BatchModel, PageRequest
+
+
+class MockLocalModel:
+    """Stand-in for the Kimi-VL model; returns canned results per page."""
+    def __init__(self, model_path: str):
+        self.model_path = model_path
+
+    def predict_batch(self, pages: List[PageRequest]) -> List[Dict[str, Any]]:
+        # Mock processing results (replace with actual local model processing)
+        return [
+            {
+                "text_content": f"Extracted text from {page.filename}\n\nThis is MOCK extracted text from the LOCAL processor.",
+                "confidence": 0.92,
+                "metadata": {
+                    "pages": 1,
+                    "language": "en",
+                    "document_type": "commercial_invoice",
+                    "processing_method": "local_mock",
+                    "model_name": self.model_path
+                },
+                "extracted_fields": {
+                    "invoice_number": "INV-LOCAL-MOCK",
+                    "date": "2024-01-28",
+                    "total_amount": 1250.00,
+                    "currency": "USD"
+                }
+            }
+            for page in pages
+        ]
+
+
+def load_model(model_path: str) -> BatchModel:
+    """Default INFERENCE_MODEL_FACTORY."""
+    return MockLocalModel(model_path)
@@ -7,26 +7,40 @@ Supports multiple processing modes (local, openrouter).
 import os
 import asyncio
 import logging
-import base64
+import hashlib
 import json
-from typing import Dict, Any, Optional, Protocol, List
+import random
+import time
+from typing import Awaitable, Callable, Dict, Any, Optional, Protocol, List, Union
 from datetime import datetime
 
 import httpx
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
+from fastapi import FastAPI, File, Form, UploadFile, HTTPException, BackgroundTasks, Header, Request, Depends
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from pydantic import BaseModel
 import aiofiles
 from dotenv import load_dotenv
-import fitz  # PyMuPDF
 
-# Optional LangSmith tracing
-try:
-    from langsmith.run_trees import RunTree  # type: ignore
-except Exception:  # pragma: no cover - optional dep
-    RunTree = None  # type: ignore
+from batching import BatchModel, MicroBatcher
+from local_model import MockLocalModel
+from inference_pool import InferencePool, PoolClient
+from shared_state import SharedState
+from persistence import PostgresSink
+from search_index import DocumentIndex
+from pipeline import DocumentPipeline
+from decoding import UnsupportedFormat, count_pages, data_url, decode_pages, document_page_source
+from admission import AdmissionController, AdmissionRejected, Ticket, parse_api_keys, parse_classes
+from templates import TemplateStore, validate as validate_template_fields
+from tracing import Tracer, build_exporters, span
+from classifier import ClassifierStats, classify_document, classify_text
+from features import FeatureStats, extract_features
+from schemas import (
+    DOCUMENT_TASK, HEADER_TASK, LINE_ITEMS_TASK, OUTPUT_STATS, SchemaViolation,
+    max_tokens_for, response_format, schema_for, validate as validate_schema,
+)
+from router.adapters.openai_compat import TruncatedOutput, parse_json_content
 
 # Load environment variables from .env file
 load_dotenv()
@@ -41,6 +55,17 @@ PROCESSING_MODE = os.getenv("PROCESSING_MODE", "openrouter")
 # Local Model Config
 MODEL_PATH = os.getenv("MODEL_PATH", "/models/kimi-vl")
 DEVICE = os.getenv("DEVICE", "auto")
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "4"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "20"))
+# Run the local model in this many worker processes (0 = in the API process).
+# Pages reach them through shared memory; see inference_pool.py.
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_MODEL_FACTORY = os.getenv("INFERENCE_MODEL_FACTORY", "local_model:load_model")
+INFERENCE_SLOT_MB = float(os.getenv("INFERENCE_SLOT_MB", "8"))
+INFERENCE_TIMEOUT_S = float(os.getenv("INFERENCE_TIMEOUT_S", "120"))
+INFERENCE_HEALTH_INTERVAL_S = float(os.getenv("INFERENCE_HEALTH_INTERVAL_S", "5"))
+# Set by gunicorn.conf.py: the host-wide pool the API workers share
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "")
 
 # OpenRouter Config
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
@@ -50,14 +75,75 @@ OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
 # API Server Config
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
 API_PORT = int(os.getenv("API_PORT", "8001"))
+# "development" runs a single reloading uvicorn; "production" runs N preloaded workers
+SERVER_MODE = os.getenv("SERVER_MODE", "development")
+
+# Cross-worker shared state (result cache, router stats, rate limits)
+REDIS_URL = os.getenv("REDIS_URL")
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "0"))
+RATE_LIMIT_PER_MINUTE = int(os.getenv("RATE_LIMIT_PER_MINUTE", "0"))
+
+# Optional direct Postgres persistence (beyan_documents)
+PERSIST_DATABASE_URL = os.getenv("PERSIST_DATABASE_URL")
+PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "200"))
+PERSIST_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "1000"))
+PERSIST_FLUSH_MS = float(os.getenv("PERSIST_FLUSH_MS", "500"))
+
+# Local search index over processed results ("" disables)
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "/processed/search_index.sqlite3")
+
+# Learned supplier templates for text-layer PDFs ("" disables). Kept outside
+# the result folders that search_index.py rebuild walks.
+TEMPLATE_STORE_PATH = os.getenv("TEMPLATE_STORE_PATH", "/processed/.state/templates.json")
+TEMPLATE_MATCH_THRESHOLD = float(os.getenv("TEMPLATE_MATCH_THRESHOLD", "0.6"))
+TEMPLATE_LEARN_MIN_CONFIDENCE = float(os.getenv("TEMPLATE_LEARN_MIN_CONFIDENCE", "0.85"))
+
+# Local doc-type classifier; below the threshold routing uses DEFAULT_DOC_TYPE
+CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("CLASSIFIER_MIN_CONFIDENCE", "0.5"))
+DEFAULT_DOC_TYPE = os.getenv("DEFAULT_DOC_TYPE", "invoice")
+
+# Line items expected per page when nothing better is known; sizes max_tokens
+EXPECTED_ROWS_PER_PAGE = float(os.getenv("EXPECTED_ROWS_PER_PAGE", "30"))
+
+# Routing features (size, table density, expected line items) are estimated
+# on this many pages; later pages get the average
+FEATURE_MAX_PAGES = int(os.getenv("FEATURE_MAX_PAGES", "20"))
 
 # LangSmith config (optional)
 LANGCHAIN_TRACING_V2 = os.getenv("LANGCHAIN_TRACING_V2", "false").lower() in {"1", "true", "yes"}
 LANGCHAIN_PROJECT = os.getenv("LANGCHAIN_PROJECT", "beyan")
 
+# Tracing: exporters run in the background ("langsmith", "jsonl"); errors and
+# requests slower than TRACE_SLOW_MS are always kept, the rest are sampled.
+TRACE_EXPORTERS = os.getenv("TRACE_EXPORTERS") or ("langsmith" if LANGCHAIN_TRACING_V2 else "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "10000"))
+TRACE_FILE_PATH = os.getenv("TRACE_FILE_PATH", "/processed/traces.jsonl")
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "50"))
+TRACE_FLUSH_MS = float(os.getenv("TRACE_FLUSH_MS", "1000"))
+
+# /orchestrate streaming pipeline
+RENDER_DPI = int(os.getenv("RENDER_DPI", "200"))
+# Longest side (px) of uploaded photos/scans after decoding
+MAX_IMAGE_SIDE = int(os.getenv("MAX_IMAGE_SIDE", "2048"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+PIPELINE_EXTRACT_CONCURRENCY = int(os.getenv("PIPELINE_EXTRACT_CONCURRENCY", "4"))
+
+# Admission control: per-worker page budget, priority classes (name:weight:max_wait_s)
+ADMISSION_MAX_INFLIGHT_PAGES = int(os.getenv("ADMISSION_MAX_INFLIGHT_PAGES", "16"))
+ADMISSION_CLASSES = os.getenv("ADMISSION_CLASSES", "interactive:8:15,standard:2:60,bulk:1:100")
+ADMISSION_DEFAULT_CLASS = os.getenv("ADMISSION_DEFAULT_CLASS", "standard")
+ADMISSION_API_KEYS = os.getenv("ADMISSION_API_KEYS", "")
+
 # Routing config (optional)
 ROUTING_BUDGET = os.getenv("ROUTING_BUDGET", "low")
 OFFLINE_MODE = os.getenv("OFFLINE_MODE", "false").lower() in {"1", "true", "yes"}
+# Upstream counts as slow when its recent calls average above either limit;
+# WAN_PROBE_RATE of requests still go upstream so recovery shows in the stats
+WAN_SLOW_LATENCY_MS = float(os.getenv("WAN_SLOW_LATENCY_MS") or "20000")
+WAN_SLOW_ERROR_RATE = float(os.getenv("WAN_SLOW_ERROR_RATE") or "0.5")
+WAN_PROBE_RATE = float(os.getenv("WAN_PROBE_RATE") or "0.05")
 
 
 # --- FastAPI App Initialization ---
@@ -111,7 +197,10 @@ class DocumentProcessor(Protocol):
     async def load(self) -> None:
         ... # pragma: no cover
 
-    async def process_document(self, file_content: bytes, filename: str) -> Dict[str, Any]:
+    async def process_document(
+        self, file_content: bytes, filename: str, extra_pages: Optional[List[bytes]] = None,
+        doc_type: str = "invoice",
+    ) -> Dict[str, Any]:
         ... # pragma: no cover
 
     def get_status(self) -> Dict[str, Any]:
@@ -120,52 +209,107 @@ class DocumentProcessor(Protocol):
 class LocalProcessor:
     """
     Processor for a locally hosted model.
-    Currently uses mock data.
+    Pages are micro-batched (MAX_BATCH_SIZE / BATCH_MAX_WAIT_MS) across
+    concurrent requests. With ``workers`` > 0 the model runs in an
+    InferencePool of that many processes, one batch in flight per worker;
+    under gunicorn that pool is shared by the host (INFERENCE_SOCKET).
+    Currently uses mock data unless a model is injected.
     """
-    def __init__(self, model_path: str, device: str):
+    def __init__(
+        self,
+        model_path: str,
+        device: str,
+        model: Optional[BatchModel] = None,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        max_wait_ms: float = BATCH_MAX_WAIT_MS,
+        workers: int = INFERENCE_WORKERS,
+    ):
         self.model_path = model_path
         self.device = device
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.workers = workers
+        self.pool: Optional[Union[InferencePool, PoolClient]] = None
+        self.batcher: Optional[MicroBatcher] = None
         self.model_loaded = False
         logger.info(f"Initializing LocalProcessor with model: {model_path}, device: {device}")
 
     async def load(self) -> None:
         """Load the Kimi-VL model."""
         try:
-            logger.info("Simulating model loading for LocalProcessor...")
-            await asyncio.sleep(2)
+            if self.model is None and self.workers > 0 and INFERENCE_SOCKET:
+                self.pool = PoolClient(INFERENCE_SOCKET, timeout_s=INFERENCE_TIMEOUT_S)
+                await asyncio.to_thread(self.pool.wait_ready, 300.0)
+                self.model = self.pool
+            elif self.model is None and self.workers > 0:
+                self.pool = InferencePool(
+                    INFERENCE_MODEL_FACTORY,
+                    self.model_path,
+                    workers=self.workers,
+                    slots=self.max_batch_size * 2,
+                    slot_bytes=int(INFERENCE_SLOT_MB * (1 << 20)),
+                    timeout_s=INFERENCE_TIMEOUT_S,
+                    health_interval_s=INFERENCE_HEALTH_INTERVAL_S,
+                )
+                await asyncio.to_thread(self.pool.start)
+                self.model = self.pool
+            elif self.model is None:
+                logger.info("Simulating model loading for LocalProcessor...")
+                await asyncio.sleep(2)
+                self.model = MockLocalModel(self.model_path)
+            self.batcher = MicroBatcher(
+                self.model,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait_ms,
+                max_inflight=self.workers if self.pool is not None else 1,
+            )
             self.model_loaded = True
-            logger.info("Local model loaded successfully (mock).")
+            logger.info(f"Local model loaded successfully (batch size {self.max_batch_size}, wait {self.max_wait_ms}ms).")
         except Exception as e:
             logger.error(f"Failed to load local model: {e}")
             raise
 
-    async def process_document(self, file_content: bytes, filename: str) -> Dict[str, Any]:
-        """Process document with the local model."""
-        if not self.model_loaded:
+    async def process_document(
+        self, file_content: bytes, filename: str, extra_pages: Optional[List[bytes]] = None,
+        doc_type: str = "invoice",
+    ) -> Dict[str, Any]:
+        """Process document with the local model; extra pages are batched alongside page 1.
+        The local model has no per-type prompts, so ``doc_type`` is not used."""
+        if not self.model_loaded or self.batcher is None:
             raise HTTPException(status_code=503, detail="Local model not loaded")
 
-        logger.info(f"Processing '{filename}' with LocalProcessor (mock).")
-        # Mock processing results (replace with actual local model processing)
+        logger.info(f"Processing '{filename}' with LocalProcessor.")
+        if not extra_pages:
+            return await self.batcher.submit(file_content, filename)
+        results = await asyncio.gather(*[
+            self.batcher.submit(img, f"{filename}#p{idx}")
+            for idx, img in enumerate([file_content, *extra_pages], start=1)
+        ])
+        merged = dict(results[0])
+        fields = dict(merged.get("extracted_fields") or {})
+        fields["line_items"] = [
+            row for r in results for row in ((r.get("extracted_fields") or {}).get("line_items") or [])
+        ]
+        merged["extracted_fields"] = fields
+        merged["text_content"] = "\n\n".join(r.get("text_content") or "" for r in results)
+        merged["metadata"] = {**(merged.get("metadata") or {}), "pages": len(results)}
+        return merged
+
+    def get_status(self) -> Dict[str, Any]:
         return {
-            "text_content": f"Extracted text from {filename}\n\nThis is MOCK extracted text from the LOCAL processor.",
-            "confidence": 0.92,
-            "metadata": {
-                "pages": 1,
-                "language": "en",
-                "document_type": "commercial_invoice",
-                "processing_method": "local_mock",
-                "model_name": self.model_path
-            },
-            "extracted_fields": {
-                "invoice_number": "INV-LOCAL-MOCK",
-                "date": "2024-01-28",
-                "total_amount": 1250.00,
-                "currency": "USD"
-            }
+            "model_path": self.model_path,
+            "device": self.device,
+            "loaded": self.model_loaded,
+            "batching": self.batcher.stats() if self.batcher is not None else None,
+            "inference_pool": self.pool.stats() if self.pool is not None else None,
         }
 
-    def get_status(self) -> Dict[str, Any]:
-        return {"model_path": self.model_path, "device": self.device, "loaded": self.model_loaded}
+    async def close(self) -> None:
+        if self.batcher is not None:
+            await self.batcher.close()
+        if self.pool is not None:
+            await asyncio.to_thread(self.pool.close)
 
 
 class OpenRouterProcessor:
@@ -183,8 +327,10 @@ class OpenRouterProcessor:
         logger.info("OpenRouterProcessor is ready. No local model loading required.")
         await asyncio.sleep(0)
 
-    def _get_extraction_prompt(self) -> str:
-        """Returns the detailed prompt for invoice extraction."""
+    def _get_extraction_prompt(self, doc_type: str = "invoice") -> str:
+        """Returns the detailed prompt for whole-document extraction of ``doc_type``."""
+        if "document" in _doc_prompts(doc_type):
+            return _doc_prompts(doc_type)["document"]
         # This schema is based on the analysis of the sample documents
         return '''
         You are an expert document analysis AI. A user has uploaded a document image.
@@ -234,48 +380,38 @@ class OpenRouterProcessor:
         ```
         '''
 
-    async def process_document(self, file_content: bytes, filename: str) -> Dict[str, Any]:
-        """Process document by calling the OpenRouter API."""
+    async def process_document(
+        self, file_content: bytes, filename: str, extra_pages: Optional[List[bytes]] = None,
+        doc_type: str = "invoice",
+    ) -> Dict[str, Any]:
+        """Process document by calling the OpenRouter API (all pages in one request)
+        with the prompt and schema for ``doc_type``."""
         logger.info(f"Processing '{filename}' with OpenRouterProcessor.")
         
-        base64_image = base64.b64encode(file_content).decode('utf-8')
-        
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
+        image_parts = [
+            {"type": "image_url", "image_url": {"url": data_url(img)}}
+            for img in [file_content, *(extra_pages or [])]
+        ]
+
         data = {
             "model": self.model_name,
             "messages": [
                 {
                     "role": "user",
                     "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        },
+                        *image_parts,
                         {
                             "type": "text",
-                            "text": self._get_extraction_prompt()
+                            "text": self._get_extraction_prompt(doc_type)
                         }
                     ]
                 }
-            ]
+            ],
+            **self._output_args(DOCUMENT_TASK, doc_type, EXPECTED_ROWS_PER_PAGE * len(image_parts)),
         }
 
         try:
-            response = await self.client.post(OPENROUTER_API_URL, headers=headers, json=data)
-            response.raise_for_status()
-            
-            response_json = response.json()
-            message_content = response_json["choices"][0]["message"]["content"]
-            
-            # Clean up the response to get only the JSON part
-            json_content_str = message_content.strip().lstrip("```json").rstrip("```")
-            extracted_data = json.loads(json_content_str)
+            extracted_data = await self._post_json(data, DOCUMENT_TASK, doc_type)
 
             # Build concise text summary for downstream classifiers
             try:
@@ -297,10 +433,7 @@ class OpenRouterProcessor:
 
             # Compute a simple completeness-based confidence score (0..1)
             try:
-                required_top = [
-                    "invoice_number", "invoice_date", "total_amount", "total_currency",
-                    "buyer", "seller"
-                ]
+                required_top = _doc_prompts(doc_type)["required"]
                 present = 0
                 for k in required_top:
                     v = extracted_data.get(k)
@@ -330,9 +463,8 @@ class OpenRouterProcessor:
         except httpx.HTTPStatusError as e:
             logger.error(f"HTTP error calling OpenRouter: {e.response.status_code} {e.response.text}")
             raise HTTPException(status_code=e.response.status_code, detail=f"OpenRouter API error: {e.response.text}")
-        except (json.JSONDecodeError, KeyError, IndexError) as e:
+        except (json.JSONDecodeError, KeyError, IndexError, SchemaViolation, TruncatedOutput) as e:
             logger.error(f"Failed to parse response from OpenRouter: {e}")
-            logger.error(f"Raw response content: {message_content}")
             raise HTTPException(status_code=500, detail="Failed to parse model response.")
         except Exception as e:
             logger.error(f"An unexpected error occurred with OpenRouter: {e}")
@@ -341,35 +473,71 @@ class OpenRouterProcessor:
     def get_status(self) -> Dict[str, Any]:
         return {"model_name": self.model_name, "api_url": OPENROUTER_API_URL}
 
-    async def process_with_prompt(self, file_content: bytes, filename: str, prompt: str) -> Dict[str, Any]:
-        """Call OpenRouter with a custom prompt and return parsed JSON content.
-        Returns a dict with keys: extracted_fields, raw_message (optional).
-        """
-        base64_image = base64.b64encode(file_content).decode("utf-8")
+    def _output_args(self, task: str, doc_type: str, expected_rows: float) -> Dict[str, Any]:
+        """max_tokens for the task, plus a strict schema when models.yml says the model supports it."""
+        args: Dict[str, Any] = {"max_tokens": max_tokens_for(task, expected_rows, _max_output_tokens(self.model_name))}
+        if _supports_structured_output(self.model_name):
+            args["response_format"] = response_format(task, doc_type)
+        return args
+
+    async def _post_json(self, data: Dict[str, Any], task: str, doc_type: str) -> Dict[str, Any]:
+        """POST a chat completion and return the reply as schema-checked JSON
+        (truncation retry and stats via _structured_call, as routed calls)."""
+        return await _structured_call(
+            lambda budget: self._post_once({**data, "max_tokens": budget}),
+            f"processor:{self.model_name}", task, doc_type,
+            structured="response_format" in data,
+            budget=data["max_tokens"],
+            cap=_max_output_tokens(self.model_name),
+        )
+
+    async def _post_once(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """One POST; returns extracted_fields and usage like OpenAICompatAdapter.extract_json."""
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
         }
+        resp = await self.client.post(OPENROUTER_API_URL, headers=headers, json=data)
+        resp.raise_for_status()
+        response_json = resp.json()
+        choice = response_json["choices"][0]
+        usage = response_json.get("usage") or {}
+        try:
+            extracted = parse_json_content(choice["message"]["content"] or "")
+        except json.JSONDecodeError:
+            logger.error(f"Raw response content: {choice['message']['content']}")
+            if choice.get("finish_reason") == "length":
+                raise TruncatedOutput(self.model_name, usage)
+            raise
+        return {"extracted_fields": extracted, "usage": usage}
+
+    async def process_with_prompt(
+        self,
+        file_content: bytes,
+        filename: str,
+        prompt: str,
+        task: str = HEADER_TASK,
+        doc_type: str = "invoice",
+        expected_rows: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """Call OpenRouter with a custom prompt for one extraction task.
+        Returns a dict with keys: extracted_fields.
+        """
         data = {
             "model": self.model_name,
             "messages": [
                 {
                     "role": "user",
                     "content": [
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{base64_image}"}},
+                        {"type": "image_url", "image_url": {"url": data_url(file_content)}},
                         {"type": "text", "text": prompt},
                     ],
                 }
             ],
+            **self._output_args(task, doc_type, expected_rows or EXPECTED_ROWS_PER_PAGE),
         }
         try:
-            resp = await self.client.post(OPENROUTER_API_URL, headers=headers, json=data)
-            resp.raise_for_status()
-            response_json = resp.json()
-            message_content = response_json["choices"][0]["message"]["content"]
-            json_content_str = message_content.strip().lstrip("```json").rstrip("```")
-            extracted = json.loads(json_content_str)
-            return {"extracted_fields": extracted, "raw_message": message_content}
+            return {"extracted_fields": await self._post_json(data, task, doc_type)}
         except Exception as e:
             logger.error(f"process_with_prompt failed for {filename}: {e}")
             raise
@@ -391,31 +559,247 @@ else:
     raise ValueError(f"Invalid PROCESSING_MODE: '{PROCESSING_MODE}'. Choose 'local' or 'openrouter'.")
 
 
+# --- Shared State (shared across workers when REDIS_URL is set) ---
+
+shared_state = SharedState.from_env(REDIS_URL, RESULT_CACHE_TTL)
+
+persistence_sink: Optional[PostgresSink] = None
+search_index: Optional[DocumentIndex] = None
+template_store: Optional[TemplateStore] = None
+tracer: Optional[Tracer] = None
+classifier_stats = ClassifierStats()
+feature_stats = FeatureStats()
+
+
+async def _classify(content: bytes) -> Dict[str, Any]:
+    """Doc type from the text layer; ``routing_doc_type`` is what routing and prompts use."""
+    with span("classify") as sp:
+        result = await asyncio.to_thread(classify_document, content)
+        sp.set(doc_type=result["doc_type"], confidence=result["confidence"], method=result["method"])
+    confident = result["confidence"] >= CLASSIFIER_MIN_CONFIDENCE
+    result["routing_doc_type"] = result["doc_type"] if confident else DEFAULT_DOC_TYPE
+    classifier_stats.add(result)
+    return result
+
+
+async def _extract_features(content: bytes) -> Dict[str, Any]:
+    """size_bytes, table_density and expected_line_items, per document and per page."""
+    with span("features") as sp:
+        result = await asyncio.to_thread(extract_features, content, FEATURE_MAX_PAGES)
+        sp.set(expected_line_items=result["expected_line_items"], table_density=result["table_density"], ms=result["ms"])
+    feature_stats.add(result)
+    return result
+
+
+def _cache_key(endpoint: str, content: bytes, *parts: Any) -> str:
+    h = hashlib.sha256(content)
+    for p in (endpoint, PROCESSING_MODE, *parts):
+        h.update(f"|{p}".encode("utf-8"))
+    return h.hexdigest()
+
+
+admission: Optional[AdmissionController] = None
+if ADMISSION_MAX_INFLIGHT_PAGES > 0:
+    admission = AdmissionController(
+        ADMISSION_MAX_INFLIGHT_PAGES,
+        parse_classes(ADMISSION_CLASSES),
+        ADMISSION_DEFAULT_CLASS,
+        api_keys=parse_api_keys(ADMISSION_API_KEYS),
+    )
+
+
+async def _admit(pages: int, priority: Optional[str], api_key: Optional[str]) -> Optional[Ticket]:
+    """Wait for a page budget slot, or fail fast with 429 + Retry-After."""
+    if admission is None:
+        return None
+    cls = admission.classify(priority, api_key)
+    try:
+        return await admission.acquire(cls, pages)
+    except AdmissionRejected as e:
+        logger.warning(f"Admission rejected ({cls.name}, {pages} pages): {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+async def _rate_limit(request: Request) -> None:
+    """Per-client request budget (RATE_LIMIT_PER_MINUTE, 0 disables)."""
+    client = request.client.host if request.client else "unknown"
+    allowed, retry_after = await shared_state.check_rate_limit(client, RATE_LIMIT_PER_MINUTE)
+    if not allowed:
+        raise HTTPException(status_code=429, detail="Rate limit exceeded", headers={"Retry-After": str(retry_after)})
+
+
+async def _timed_extract(model_key: str, coro: Any) -> Dict[str, Any]:
+    """Await a model call and record its latency/outcome in shared router stats."""
+    started = asyncio.get_running_loop().time()
+    ok = False
+    try:
+        with span("model_call", model=model_key):
+            result = await coro
+        ok = True
+        return result
+    finally:
+        elapsed_ms = (asyncio.get_running_loop().time() - started) * 1000
+        await shared_state.record_model_call(model_key, elapsed_ms, ok)
+
+
+async def _structured_call(
+    call: Callable[[int], Awaitable[Dict[str, Any]]],
+    stats_key: str,
+    task: str,
+    doc_type: str,
+    structured: bool,
+    budget: int,
+    cap: Optional[int],
+) -> Dict[str, Any]:
+    """Run ``call(max_tokens)`` and return its schema-checked extracted_fields.
+
+    ``call`` returns ``{"extracted_fields", "usage"}`` and raises TruncatedOutput
+    when the reply was cut off; that is retried once with the budget doubled
+    (up to ``cap``). Every attempt is recorded in OUTPUT_STATS under ``stats_key``.
+    """
+    for attempt in range(2):
+        started = time.perf_counter()
+        try:
+            res = await call(budget)
+        except TruncatedOutput as e:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            OUTPUT_STATS.add(stats_key, structured, e.usage.get("completion_tokens"), elapsed_ms, "truncated")
+            if attempt or (cap and budget >= cap):
+                raise
+            budget = min(budget * 2, cap) if cap else budget * 2
+            logger.info(f"{stats_key} {task} reply truncated, retrying with max_tokens={budget}")
+            continue
+        except json.JSONDecodeError:
+            OUTPUT_STATS.add(stats_key, structured, None, (time.perf_counter() - started) * 1000, "parse_error")
+            raise
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        tokens = (res.get("usage") or {}).get("completion_tokens")
+        fields = res.get("extracted_fields") or {}
+        errors = validate_schema(fields, schema_for(task, doc_type), allow_missing=not structured)
+        if errors:
+            OUTPUT_STATS.add(stats_key, structured, tokens, elapsed_ms, "schema_invalid")
+            raise SchemaViolation(task, errors)
+        OUTPUT_STATS.add(stats_key, structured, tokens, elapsed_ms, "ok")
+        return fields
+    raise AssertionError("unreachable")
+
+
+async def _extract_task(
+    snapshot: "RouterSnapshot",
+    adapter: Any,
+    model_key: str,
+    task: str,
+    doc_type: str,
+    prompt: str,
+    img: bytes,
+    expected_rows: float,
+    extra_pages: Optional[List[bytes]] = None,
+) -> Dict[str, Any]:
+    """One routed model call for one task, returning schema-checked fields.
+
+    Models with the structured_output capability get the task's JSON schema
+    as response_format. max_tokens comes from the expected row count and is
+    doubled once (up to tokens.max_output) when a reply is cut off.
+    """
+    model = snapshot.registry.get_model(model_key) or {}
+    structured = "structured_output" in (model.get("capabilities") or [])
+    cap = (model.get("tokens") or {}).get("max_output")
+    fmt = response_format(task, doc_type) if structured else None
+    return await _structured_call(
+        lambda budget: _timed_extract(model_key, adapter.extract_json(
+            prompt, [img, *(extra_pages or [])], model.get("name"), response_format=fmt, max_tokens=budget
+        )),
+        model_key, task, doc_type,
+        structured=structured,
+        budget=max_tokens_for(task, expected_rows, cap),
+        cap=cap,
+    )
+
+
 # --- FastAPI Events and Endpoints ---
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the service on startup."""
+    global persistence_sink, search_index, template_store, tracer
     logger.info(f"Starting service in '{PROCESSING_MODE}' mode.")
     try:
         await processor.load()
+        if _ROUTER_STORE is not None and ROUTER_RELOAD_INTERVAL > 0:
+            asyncio.create_task(_ROUTER_STORE.watch(ROUTER_RELOAD_INTERVAL))
+            logger.info(f"Watching routing config every {ROUTER_RELOAD_INTERVAL}s")
+        if _ROUTER_STORE is not None and shared_state.describe()["backend"] != "memory":
+            # Admin reloads land on one worker; the others follow the published version
+            asyncio.create_task(_ROUTER_STORE.follow(lambda: shared_state.config_version("router"), ROUTER_SYNC_INTERVAL_S))
+        logger.info(f"Shared state backend: {shared_state.describe()['backend']} (pid {os.getpid()})")
+        if SEARCH_INDEX_PATH:
+            try:
+                search_index = DocumentIndex(SEARCH_INDEX_PATH)
+            except Exception as e:
+                logger.error(f"Document search index disabled: {e}")
+        if TEMPLATE_STORE_PATH:
+            try:
+                template_store = TemplateStore(TEMPLATE_STORE_PATH, match_threshold=TEMPLATE_MATCH_THRESHOLD)
+            except Exception as e:
+                logger.error(f"Supplier templates disabled: {e}")
+        exporters = build_exporters(TRACE_EXPORTERS, LANGCHAIN_PROJECT, TRACE_FILE_PATH)
+        if exporters:
+            tracer = Tracer(
+                exporters,
+                sample_rate=TRACE_SAMPLE_RATE,
+                slow_ms=TRACE_SLOW_MS,
+                queue_size=TRACE_QUEUE_SIZE,
+                batch_size=TRACE_BATCH_SIZE,
+                flush_ms=TRACE_FLUSH_MS,
+            )
+            await tracer.start()
+            logger.info(f"Tracing via {', '.join(e.name for e in exporters)} (sample rate {TRACE_SAMPLE_RATE})")
+        if PERSIST_DATABASE_URL:
+            try:
+                sink = PostgresSink(
+                    PERSIST_DATABASE_URL,
+                    batch_size=PERSIST_BATCH_SIZE,
+                    queue_size=PERSIST_QUEUE_SIZE,
+                    flush_ms=PERSIST_FLUSH_MS,
+                )
+                await sink.start()
+                persistence_sink = sink
+            except Exception as e:
+                logger.error(f"Postgres persistence disabled: {e}")
         logger.info("Service started successfully.")
     except Exception as e:
         logger.error(f"Failed to start service: {e}")
         raise
 
-@app.post("/process", response_model=ProcessingResponse)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop inference workers and flush queued database writes, traces and template counters before the worker exits."""
+    if isinstance(processor, LocalProcessor):
+        await processor.close()
+    if persistence_sink is not None:
+        await persistence_sink.close()
+    if tracer is not None:
+        await tracer.close()
+    if template_store is not None:
+        template_store.save(force=True)
+
+@app.post("/process", response_model=ProcessingResponse, dependencies=[Depends(_rate_limit)])
 async def process_document_endpoint(
     background_tasks: BackgroundTasks,
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    x_priority: Optional[str] = Header(default=None),
+    x_api_key: Optional[str] = Header(default=None),
 ) -> ProcessingResponse:
     """
     Process a document using the configured processing mode.
+    Admission priority is the class mapped to X-API-Key; X-Priority can only lower it.
     """
     timestamp = datetime.now().isoformat()
     start_time = datetime.now()
-
-    # (no tracing for classic /process endpoint)
+    ticket: Optional[Ticket] = None
+    active_trace = tracer.begin("process", filename=file.filename) if tracer is not None else None
+    trace_error: Optional[str] = None
 
     try:
         if not file.filename:
@@ -427,11 +811,50 @@ async def process_document_endpoint(
         
         logger.info(f"Processing document: {file.filename} ({len(content)} bytes)")
         
-        result = await processor.process_document(content, file.filename)
+        cache_key = _cache_key("process", content)
+        cached = await shared_state.get_result(cache_key)
+        if cached is not None:
+            processing_time = (datetime.now() - start_time).total_seconds()
+            logger.info(f"Result cache hit for {file.filename}")
+            return ProcessingResponse(
+                success=True,
+                data={**cached, "cache_hit": True},
+                filename=file.filename,
+                processing_time=f"{processing_time:.2f}s",
+                timestamp=timestamp
+            )
+
+        try:
+            with span("admission"):
+                ticket = await _admit(count_pages(content), x_priority, x_api_key)
+            with span("decode") as sp:
+                source_mime, pages = await asyncio.to_thread(decode_pages, content, MAX_IMAGE_SIDE, RENDER_DPI)
+                sp.set(mime=source_mime, pages=len(pages))
+        except UnsupportedFormat as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        logger.info(f"Decoded {file.filename} as {source_mime}: {len(pages)} page(s)")
+        classification = await _classify(content)
+        if OFFLINE_MODE and isinstance(processor, OpenRouterProcessor):
+            # The configured processor is upstream; offline the document goes
+            # to a local provider instead
+            with span("extract", processor="local_provider"):
+                result = await _process_offline(file.filename, pages, classification["routing_doc_type"])
+        else:
+            with span("extract", processor=type(processor).__name__):
+                result = await processor.process_document(
+                    pages[0], file.filename, extra_pages=pages[1:], doc_type=classification["routing_doc_type"]
+                )
+        # Scans have no text layer; the model's own transcription is the next best input
+        if classification["method"] == "no_text_layer" and result.get("text_content"):
+            classification = {**classify_text(result["text_content"]), "method": "model_text", "ms": classification["ms"]}
+            confident = classification["confidence"] >= CLASSIFIER_MIN_CONFIDENCE
+            classification["routing_doc_type"] = classification["doc_type"] if confident else DEFAULT_DOC_TYPE
+        result["metadata"] = {**(result.get("metadata") or {}), "classification": classification}
         
         processing_time = (datetime.now() - start_time).total_seconds()
         result["processing_time_seconds"] = processing_time
         
+        await shared_state.put_result(cache_key, result)
         background_tasks.add_task(save_processed_file, file.filename, content, result)
         
         return ProcessingResponse(
@@ -442,9 +865,11 @@ async def process_document_endpoint(
             timestamp=timestamp
         )
         
-    except HTTPException:
+    except HTTPException as e:
+        trace_error = f"HTTP {e.status_code}: {e.detail}"
         raise
     except Exception as e:
+        trace_error = str(e)
         logger.error(f"Unexpected error in /process endpoint for {file.filename}: {e}", exc_info=True)
         return ProcessingResponse(
             success=False,
@@ -452,28 +877,206 @@ async def process_document_endpoint(
             filename=file.filename,
             timestamp=timestamp
         )
+    finally:
+        if ticket is not None:
+            admission.release(ticket)
+        if active_trace is not None:
+            tracer.end(active_trace, error=trace_error)
+
+
+# --- Smart Router Init (Phase 1) ---
+# models.yml/routing.yml live in a RouterStore so they can be reloaded without
+# a restart; the HTTP adapters stay outside the snapshot to keep their pools warm.
+ROUTER_RELOAD_INTERVAL = float(os.getenv("ROUTER_RELOAD_INTERVAL", "0"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Upstream health verdict is recomputed at most this often
+WAN_CHECK_INTERVAL_S = 5.0
+# How often workers check the router version published by /admin/router/reload
+ROUTER_SYNC_INTERVAL_S = 2.0
+
+
+def _adapter_args(name: str, spec: Dict[str, Any]) -> tuple:
+    """(adapter class, constructor kwargs) for one models.yml provider entry."""
+    kind = spec.get("type", name)
+    api_key = os.getenv(spec["api_key_env"]) if spec.get("api_key_env") else None
+    if kind == "openrouter":
+        return OpenRouterAdapter, {
+            "api_key": api_key or OPENROUTER_API_KEY,
+            "base_url": spec.get("base_url", "https://openrouter.ai/api/v1"),
+        }
+    if kind == "openai_compat":
+        base_url = (os.getenv(spec["base_url_env"]) if spec.get("base_url_env") else None) or spec.get("base_url")
+        return OpenAICompatAdapter, {
+            "base_url": base_url,
+            "api_key": api_key or None,
+            "timeout_s": float(spec.get("timeout_s", 120)),
+            "provider": name,
+        }
+    raise ValueError(f"unsupported provider type '{kind}'")
+
+
+def _build_adapters(snapshot: "RouterSnapshot", previous: Dict[str, Any]) -> Dict[str, Any]:
+    """One adapter per provider; clients whose endpoint did not change are reused."""
+    adapters: Dict[str, Any] = {}
+    for name, spec in snapshot.registry.providers.items():
+        try:
+            cls, kwargs = _adapter_args(name, spec or {})
+        except ValueError as e:
+            logger.warning(f"Provider '{name}' disabled: {e}")
+            continue
+        old = previous.get(name)
+        if (
+            type(old) is cls
+            and old.base_url == (kwargs["base_url"] or "").rstrip("/")
+            and old.api_key == kwargs["api_key"]
+        ):
+            adapters[name] = old
+        else:
+            adapters[name] = cls(**kwargs)
+            if old is not None:
+                logger.info(f"Adapter for provider '{name}' rebuilt for {kwargs['base_url']}")
+    return adapters
+
+
+def _supports_structured_output(model_name: str, provider: str = "openrouter") -> bool:
+    """Look up a provider model id in the current portfolio for the structured_output capability."""
+    if _ROUTER_STORE is None:
+        return False
+    for m in _ROUTER_STORE.current().registry.models.values():
+        if m.get("name") == model_name and m.get("provider") == provider:
+            return "structured_output" in (m.get("capabilities") or [])
+    return False
+
+
+def _max_output_tokens(model_name: str, provider: str = "openrouter") -> Optional[int]:
+    """tokens.max_output of a provider model id in the current portfolio; None when unknown."""
+    if _ROUTER_STORE is None:
+        return None
+    for m in _ROUTER_STORE.current().registry.models.values():
+        if m.get("name") == model_name and m.get("provider") == provider:
+            cap = (m.get("tokens") or {}).get("max_output")
+            return int(cap) if cap else None
+    return None
+
+
+def _local_providers(snapshot: "RouterSnapshot") -> set:
+    return {name for name, p in snapshot.registry.providers.items() if (p or {}).get("local")}
 
 
-# --- Smart Router Init (Phase 1, OpenRouter-only) ---
 try:
-    from router.registry import ModelRegistry
-    from router.policy import RoutingPolicy
-    from router.smart_router import SmartRouter
+    from router.reloader import RouterStore, RouterSnapshot
+    from router.cascade import CascadeRunner, CASCADE_STATS, model_tiers
+    from router.adapters.openai_compat import OpenAICompatAdapter
     from router.adapters.openrouter import OpenRouterAdapter
 
-    _REGISTRY = ModelRegistry(portfolio_path="config/models.yml")
-    _POLICY = RoutingPolicy(routing_path="config/routing.yml")
-    _ROUTER = SmartRouter(registry=_REGISTRY, policy=_POLICY)
-    _OPENROUTER_BASE = (_REGISTRY.get_provider("openrouter") or {}).get("base_url", "https://openrouter.ai/api/v1")
-    _OR_ADAPTER = OpenRouterAdapter(api_key=OPENROUTER_API_KEY, base_url=_OPENROUTER_BASE)
-    logger.info("Smart Router initialized (Phase 1)")
+    _ROUTER_STORE: Optional[RouterStore] = RouterStore(
+        portfolio_path="config/models.yml", routing_path="config/routing.yml"
+    )
+    _ADAPTERS: Dict[str, Any] = _build_adapters(_ROUTER_STORE.current(), {})
+    logger.info(
+        f"Smart Router initialized (config {_ROUTER_STORE.current().version}, "
+        f"providers ready: {[n for n, a in _ADAPTERS.items() if a.is_configured()]})"
+    )
 except Exception as e:
-    _REGISTRY = None
-    _POLICY = None
-    _ROUTER = None
-    _OR_ADAPTER = None
+    _ROUTER_STORE = None
+    _ADAPTERS = {}
     logger.warning(f"Smart Router not initialized: {e}")
 
+
+# Holds the tasks closing replaced adapters until they finish
+_RETIRING: set = set()
+
+
+def _on_router_swap(snapshot: "RouterSnapshot") -> None:
+    """Rebuild only the provider clients whose endpoint actually changed;
+    replaced or removed ones are closed once their in-flight calls drain."""
+    global _ADAPTERS
+    previous, _ADAPTERS = _ADAPTERS, _build_adapters(snapshot, _ADAPTERS)
+    for name, old in previous.items():
+        if _ADAPTERS.get(name) is not old:
+            task = asyncio.get_running_loop().create_task(old.aclose(grace_s=old.timeout_s))
+            _RETIRING.add(task)
+            task.add_done_callback(_RETIRING.discard)
+
+
+if _ROUTER_STORE is not None:
+    _ROUTER_STORE.add_listener(_on_router_swap)
+
+
+_WAN_STATE: Dict[str, Any] = {"checked": 0.0, "slow": False, "error_rate": None, "avg_latency_ms": None}
+
+
+async def _wan_slow(snapshot: Optional["RouterSnapshot"], adapters: Dict[str, Any]) -> bool:
+    """True while recent calls to upstream (non-local) models are failing or slow.
+
+    Only reported when a local provider is ready to take over. A WAN_PROBE_RATE
+    share of requests sees False so upstream keeps getting some traffic and its
+    recovery reaches the stats.
+    """
+    if snapshot is None:
+        return False
+    local = _local_providers(snapshot)
+    if not any(adapters[n].is_configured() for n in local if n in adapters):
+        return False
+    now = time.monotonic()
+    if now - _WAN_STATE["checked"] >= WAN_CHECK_INTERVAL_S:
+        calls = errors = latency = 0.0
+        for key, st in (await shared_state.model_stats()).items():
+            m = snapshot.registry.get_model(key)
+            n = st.get("recent_window") or 0
+            if m is None or m.get("provider") in local or not n:
+                continue
+            calls += n
+            errors += st["recent_error_rate"] * n
+            latency += (st["recent_avg_latency_ms"] or 0.0) * n
+        error_rate = errors / calls if calls else None
+        avg_latency = latency / calls if calls else None
+        slow = bool(calls) and (error_rate >= WAN_SLOW_ERROR_RATE or avg_latency >= WAN_SLOW_LATENCY_MS)
+        if slow != _WAN_STATE["slow"]:
+            logger.warning(f"Upstream {'slow' if slow else 'recovered'}: error rate {error_rate}, avg {avg_latency} ms")
+        _WAN_STATE.update(checked=now, slow=slow, error_rate=error_rate, avg_latency_ms=avg_latency)
+    return _WAN_STATE["slow"] and random.random() >= WAN_PROBE_RATE
+
+
+def _check_admin(x_admin_token: Optional[str]) -> None:
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.get("/admin/router")
+async def router_status(x_admin_token: Optional[str] = Header(default=None)):
+    """Report the routing config snapshot currently serving requests."""
+    _check_admin(x_admin_token)
+    if _ROUTER_STORE is None:
+        raise HTTPException(status_code=503, detail="Smart Router not initialized")
+    return {
+        **_ROUTER_STORE.current().describe(),
+        "providers": {name: a.is_configured() for name, a in _ADAPTERS.items()},
+        "wan_slow": _WAN_STATE["slow"],
+        "model_stats": await shared_state.model_stats(),
+        "cascade": CASCADE_STATS.describe(),
+        "structured_output": OUTPUT_STATS.describe(),
+    }
+
+
+@app.post("/admin/router/reload")
+async def router_reload(x_admin_token: Optional[str] = Header(default=None)):
+    """Re-read models.yml and routing.yml and swap in a new router snapshot.
+    In-flight requests finish on the snapshot they started with. The new
+    version is published through shared state, and the other workers reload
+    within ROUTER_SYNC_INTERVAL_S.
+    """
+    _check_admin(x_admin_token)
+    if _ROUTER_STORE is None:
+        raise HTTPException(status_code=503, detail="Smart Router not initialized")
+    try:
+        res = await _ROUTER_STORE.reload()
+    except Exception as e:
+        logger.error(f"Router reload rejected: {e}")
+        raise HTTPException(status_code=422, detail=f"Router config rejected: {e}")
+    await shared_state.publish_config_version("router", res["version"])
+    return res
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check() -> HealthResponse:
     """Health check endpoint."""
@@ -482,10 +1085,27 @@ async def health_check() -> HealthResponse:
         service="document-processor",
         version="1.1.0",
         processing_mode=PROCESSING_MODE,
-        model_info=processor.get_status(),
+        model_info={
+            **processor.get_status(),
+            "shared_state": shared_state.describe(),
+            "persistence": persistence_sink.stats() if persistence_sink is not None else None,
+            "admission": admission.describe() if admission is not None else None,
+            "tracing": tracer.describe() if tracer is not None else None,
+            "classifier": classifier_stats.describe(),
+            "features": feature_stats.describe(),
+            "pid": os.getpid(),
+        },
         timestamp=datetime.now().isoformat()
     )
 
+@app.get("/admin/admission")
+async def admission_status(x_admin_token: Optional[str] = Header(default=None)):
+    """Queue depth, in-flight pages and wait times per priority class (this worker)."""
+    _check_admin(x_admin_token)
+    if admission is None:
+        raise HTTPException(status_code=503, detail="Admission control disabled")
+    return admission.describe()
+
 @app.get("/")
 async def root():
     """Root endpoint."""
@@ -498,12 +1118,15 @@ async def root():
             "process": "/process",
             "health": "/health",
             "docs": "/docs",
-            "orchestrate": "/orchestrate"
+            "orchestrate": "/orchestrate",
+            "search": "/documents/search",
+            "templates_learn": "/templates/learn",
+            "router_reload": "/admin/router/reload"
         }
     }
 
 async def save_processed_file(filename: str, content: bytes, result: Dict[str, Any]):
-    """Save original file and results in the background."""
+    """Save original file and results in the background, then queue the DB write."""
     try:
         os.makedirs("/processed", exist_ok=True)
         ts = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -534,45 +1157,195 @@ async def save_processed_file(filename: str, content: bytes, result: Dict[str, A
             await f.write(json.dumps(metadata, ensure_ascii=False, indent=2))
 
         logger.info(f"Saved processed artifacts to {target_dir}")
+
+        if search_index is not None:
+            await asyncio.to_thread(search_index.index_result, target_dir, filename, result, metadata["saved_at"])
     except Exception as e:
         logger.error(f"Failed to save processed file artifacts for {filename}: {e}", exc_info=True)
 
+    if persistence_sink is not None:
+        await persistence_sink.submit(filename, result)
+
+
+@app.get("/documents/search")
+async def search_documents(
+    q: Optional[str] = None,
+    invoice_number: Optional[str] = None,
+    po_number: Optional[str] = None,
+    seller: Optional[str] = None,
+    buyer: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    total_min: Optional[float] = None,
+    total_max: Optional[float] = None,
+    limit: int = 20,
+    offset: int = 0,
+):
+    """Search processed documents by header fields, date/total ranges or free text.
+    Seller and buyer match by case-insensitive prefix; dates are YYYY-MM-DD.
+    """
+    if search_index is None:
+        raise HTTPException(status_code=503, detail="Search index not available")
+    return await asyncio.to_thread(
+        search_index.search,
+        q=q,
+        invoice_number=invoice_number,
+        po_number=po_number,
+        seller=seller,
+        buyer=buyer,
+        date_from=date_from,
+        date_to=date_to,
+        total_min=total_min,
+        total_max=total_max,
+        limit=limit,
+        offset=offset,
+    )
 
-# --- Hybrid Orchestrator Utilities (LangGraph-style staging) ---
 
-def _header_prompt() -> str:
-    return (
-        "Extract ONLY top-level header/footer fields for a commercial invoice and return valid JSON. "
-        "Schema: {\n  \"invoice_number\": \"string\",\n  \"invoice_date\": \"YYYY-MM-DD\",\n  \"buyer\": {\"name\": \"string\", \"address\": \"string\"},\n  \"seller\": {\"name\": \"string\", \"address\": \"string\"},\n  \"total_amount\": \"number\",\n  \"total_currency\": \"string\"\n}"
-    )
+async def _learn_template(filename: str, content: bytes, fields: Dict[str, Any], source: str) -> Dict[str, Any]:
+    try:
+        outcome = await asyncio.to_thread(template_store.learn, content, fields, source)
+    except Exception as e:
+        logger.warning(f"Template learning failed for {filename}: {e}")
+        return {"learned": False, "reason": str(e)}
+    if outcome.get("learned"):
+        logger.info(f"Template {outcome['template']} learned from {filename} ({source})")
+    return outcome
 
 
-def _line_items_prompt() -> str:
-    return (
-        "Extract ONLY line items from the page and return valid JSON with key 'line_items' as an array of rows. "
-        "Row Schema: {\n  \"model_code\": \"string\",\n  \"goods_description\": \"string\",\n  \"quantity\": \"number\",\n  \"unit_price\": \"number\",\n  \"amount\": \"number\"\n}"
-    )
+async def _template_extract(filename: str, content: bytes) -> Dict[str, Any]:
+    """Template path report; a store or parser failure sends the document to the models."""
+    try:
+        return await asyncio.to_thread(template_store.extract, content)
+    except Exception as e:
+        logger.warning(f"Template lookup failed for {filename}: {e}")
+        return {"status": "error", "template": None, "score": 0.0, "fields": None, "reason": str(e)}
+
+
+@app.post("/templates/learn")
+async def learn_template_endpoint(
+    file: UploadFile = File(...),
+    corrected_data: str = Form(...),
+    x_admin_token: Optional[str] = Header(default=None),
+):
+    """Learn or fix a supplier template from a reviewer correction.
+    ``corrected_data`` is the JSON stored in reviewer_corrections.corrected_data
+    (extracted_fields, or a result wrapping them). The existing template is
+    scored against the correction first, which feeds per-template accuracy.
+    """
+    _check_admin(x_admin_token)
+    if template_store is None:
+        raise HTTPException(status_code=503, detail="Supplier templates disabled")
+    try:
+        corrected = json.loads(corrected_data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"corrected_data is not valid JSON: {e}")
+    fields = corrected.get("extracted_fields", corrected) if isinstance(corrected, dict) else None
+    if not isinstance(fields, dict):
+        raise HTTPException(status_code=400, detail="corrected_data must be a JSON object")
+    content = await file.read()
+    return await _learn_template(file.filename or "upload", content, fields, "correction")
 
 
-def _render_pdf_pages(pdf_bytes: bytes, dpi: int = 200) -> List[bytes]:
-    """Render each PDF page to PNG bytes using PyMuPDF."""
-    pages_png: List[bytes] = []
-    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-    for page in doc:
-        pix = page.get_pixmap(dpi=dpi)
-        pages_png.append(pix.tobytes("png"))
-    return pages_png
-
-
-def _compute_confidence(extracted_fields: Dict[str, Any]) -> float:
-    required_top = [
-        "invoice_number",
-        "invoice_date",
-        "total_amount",
-        "total_currency",
-        "buyer",
-        "seller",
-    ]
+@app.get("/admin/templates")
+async def templates_status(x_admin_token: Optional[str] = Header(default=None)):
+    """Template hit rate (this worker) and per-template hits/accuracy."""
+    _check_admin(x_admin_token)
+    if template_store is None:
+        raise HTTPException(status_code=503, detail="Supplier templates disabled")
+    return template_store.describe()
+
+
+# --- Hybrid Orchestrator Utilities (LangGraph-style staging) ---
+
+_BUYER_SELLER = (
+    "  \"buyer\": {\"name\": \"string\", \"address\": \"string\"},\n"
+    "  \"seller\": {\"name\": \"string\", \"address\": \"string\"},\n"
+)
+
+# Per doc type: header prompt, line-item prompt, whole-document prompt (the
+# invoice one is OpenRouterProcessor's) and the header fields that count
+# towards _compute_confidence. Unknown types use the invoice entry.
+DOC_PROMPTS: Dict[str, Dict[str, Any]] = {
+    "invoice": {
+        "header": (
+            "Extract ONLY top-level header/footer fields for a commercial invoice and return valid JSON. "
+            "Schema: {\n  \"invoice_number\": \"string\",\n  \"invoice_date\": \"YYYY-MM-DD\",\n" + _BUYER_SELLER +
+            "  \"total_amount\": \"number\",\n  \"total_currency\": \"string\"\n}"
+        ),
+        "line_items": (
+            "Extract ONLY line items from the page and return valid JSON with key 'line_items' as an array of rows. "
+            "Row Schema: {\n  \"model_code\": \"string\",\n  \"goods_description\": \"string\",\n  \"quantity\": \"number\",\n  \"unit_price\": \"number\",\n  \"amount\": \"number\"\n}"
+        ),
+        "required": ["invoice_number", "invoice_date", "total_amount", "total_currency", "buyer", "seller"],
+    },
+    "packing_list": {
+        "header": (
+            "Extract ONLY top-level header/footer fields for a packing list and return valid JSON. "
+            "invoice_number is the packing list or referenced invoice number. "
+            "Schema: {\n  \"invoice_number\": \"string\",\n  \"invoice_date\": \"YYYY-MM-DD\",\n" + _BUYER_SELLER +
+            "  \"total_packages\": \"number\",\n  \"total_net_weight\": \"number\",\n"
+            "  \"total_gross_weight\": \"number\",\n  \"weight_unit\": \"string\"\n}"
+        ),
+        "line_items": (
+            "Extract ONLY packed line items from the page and return valid JSON with key 'line_items' as an array of rows. "
+            "Row Schema: {\n  \"model_code\": \"string\",\n  \"goods_description\": \"string\",\n  \"quantity\": \"number\",\n"
+            "  \"packages\": \"number\",\n  \"net_weight\": \"number\",\n  \"gross_weight\": \"number\"\n}"
+        ),
+        "document": (
+            "Extract all fields of this packing list, including every packed line item on every page, "
+            "and return ONLY valid JSON. Use null for missing fields and numbers for numeric values. "
+            "invoice_number is the packing list or referenced invoice number. "
+            "Schema: {\n  \"invoice_number\": \"string\",\n  \"invoice_date\": \"YYYY-MM-DD\",\n" + _BUYER_SELLER +
+            "  \"total_packages\": \"number\",\n  \"total_net_weight\": \"number\",\n"
+            "  \"total_gross_weight\": \"number\",\n  \"weight_unit\": \"string\",\n"
+            "  \"line_items\": [{\"model_code\": \"string\", \"goods_description\": \"string\", \"quantity\": \"number\", "
+            "\"packages\": \"number\", \"net_weight\": \"number\", \"gross_weight\": \"number\"}]\n}"
+        ),
+        "required": ["invoice_number", "invoice_date", "buyer", "seller", "total_gross_weight"],
+    },
+    "certificate": {
+        "header": (
+            "Extract ONLY the top-level fields of a trade certificate (e.g. certificate of origin) and return valid JSON. "
+            "Schema: {\n  \"certificate_type\": \"string\",\n  \"certificate_number\": \"string\",\n"
+            "  \"issue_date\": \"YYYY-MM-DD\",\n  \"exporter\": {\"name\": \"string\", \"address\": \"string\"},\n"
+            "  \"consignee\": {\"name\": \"string\", \"address\": \"string\"},\n  \"country_of_origin\": \"string\",\n"
+            "  \"invoice_number\": \"string\"\n}"
+        ),
+        "line_items": (
+            "Extract ONLY the goods listed on the page and return valid JSON with key 'line_items' as an array of rows. "
+            "Row Schema: {\n  \"goods_description\": \"string\",\n  \"hs_code\": \"string\",\n  \"quantity\": \"number\",\n"
+            "  \"gross_weight\": \"number\"\n}"
+        ),
+        "document": (
+            "Extract all fields of this trade certificate (e.g. certificate of origin), including every good "
+            "listed on every page, and return ONLY valid JSON. Use null for missing fields and numbers for numeric values. "
+            "Schema: {\n  \"certificate_type\": \"string\",\n  \"certificate_number\": \"string\",\n"
+            "  \"issue_date\": \"YYYY-MM-DD\",\n  \"exporter\": {\"name\": \"string\", \"address\": \"string\"},\n"
+            "  \"consignee\": {\"name\": \"string\", \"address\": \"string\"},\n  \"country_of_origin\": \"string\",\n"
+            "  \"invoice_number\": \"string\",\n"
+            "  \"line_items\": [{\"goods_description\": \"string\", \"hs_code\": \"string\", \"quantity\": \"number\", "
+            "\"gross_weight\": \"number\"}]\n}"
+        ),
+        "required": ["certificate_number", "issue_date", "exporter", "consignee", "country_of_origin"],
+    },
+}
+
+
+def _doc_prompts(doc_type: str) -> Dict[str, Any]:
+    return DOC_PROMPTS.get(doc_type) or DOC_PROMPTS["invoice"]
+
+
+def _header_prompt(doc_type: str = "invoice") -> str:
+    return _doc_prompts(doc_type)["header"]
+
+
+def _line_items_prompt(doc_type: str = "invoice") -> str:
+    return _doc_prompts(doc_type)["line_items"]
+
+
+def _compute_confidence(extracted_fields: Dict[str, Any], doc_type: str = "invoice") -> float:
+    required_top = _doc_prompts(doc_type)["required"]
     present = 0
     for k in required_top:
         v = extracted_fields.get(k)
@@ -602,24 +1375,303 @@ def _build_summary(extracted_fields: Dict[str, Any]) -> str:
     )
 
 
-@app.post("/orchestrate", response_model=OrchestrationResponse)
+def _expected_rows_per_page(features: Dict[str, Any], page: Optional[Dict[str, Any]] = None) -> float:
+    """Line items expected on one page, for sizing max_tokens."""
+    if page is not None and page.get("expected_line_items") is not None:
+        return float(page["expected_line_items"])
+    expected = features.get("expected_line_items")
+    if expected:
+        return float(expected) / max(1, int(features.get("page_count") or 1))
+    return EXPECTED_ROWS_PER_PAGE
+
+
+async def _process_offline(filename: str, pages: List[bytes], doc_type: str = DEFAULT_DOC_TYPE) -> Dict[str, Any]:
+    """/process under OFFLINE_MODE with an upstream processor: one document
+    call on the local provider the router picks. 503 when none is usable."""
+    snapshot = _ROUTER_STORE.current() if _ROUTER_STORE is not None else None
+    features = {
+        "page_count": len(pages),
+        "doc_type": doc_type,
+        "budget": ROUTING_BUDGET,
+        "offline_mode": True,
+        "wan_slow": False,
+        "required_capabilities": ["vision", "json"],
+    }
+    usable = _usable_adapters(snapshot, _ADAPTERS, features) if snapshot is not None else {}
+    sel = snapshot.router.select(DOCUMENT_TASK, features) if usable else None
+    if sel is None or sel.get("provider") not in usable:
+        raise HTTPException(status_code=503, detail="OFFLINE_MODE is set and no local provider is available")
+    logger.info(f"Processing '{filename}' offline with {sel['portfolio_key']}")
+    try:
+        fields = await _extract_task(
+            snapshot, usable[sel["provider"]], sel["portfolio_key"], DOCUMENT_TASK, doc_type,
+            processor._get_extraction_prompt(doc_type), pages[0], EXPECTED_ROWS_PER_PAGE * len(pages), extra_pages=pages[1:],
+        )
+    except Exception as e:
+        logger.error(f"Local provider failed for '{filename}': {e}")
+        raise HTTPException(status_code=502, detail=f"Local provider error: {e}")
+    return {
+        "text_content": _build_summary(fields),
+        "confidence": round(_compute_confidence(fields, doc_type), 2),
+        "extracted_fields": fields,
+        "metadata": {
+            "processing_method": "local_provider",
+            "model_name": sel.get("model_name"),
+            "router": {"version": snapshot.version, "decisions": [{"task": DOCUMENT_TASK, **sel}]},
+        },
+    }
+
+
+def _usable_adapters(snapshot: "RouterSnapshot", adapters: Dict[str, Any], features: Dict[str, Any]) -> Dict[str, Any]:
+    """Configured adapters this request may call; offline mode keeps only local providers."""
+    local = _local_providers(snapshot)
+    return {
+        name: a for name, a in adapters.items()
+        if a.is_configured() and (name in local or not features.get("offline_mode"))
+    }
+
+
+def _cascade_providers(snapshot: "RouterSnapshot", usable: Dict[str, Any], features: Dict[str, Any]) -> List[str]:
+    """Upstream providers normally; local ones only when offline or upstream is slow."""
+    want_local = bool(features.get("offline_mode") or features.get("wan_slow"))
+    local = _local_providers(snapshot)
+    return [name for name in usable if (name in local) == want_local]
+
+
+def _build_cascade(
+    snapshot: "RouterSnapshot",
+    usable: Dict[str, Any],
+    images: Dict[int, bytes],
+    features: Dict[str, Any],
+    page_features: Dict[int, Dict[str, Any]],
+) -> "CascadeRunner":
+    """Cascade over header + per-page line items; ``images`` is filled by the
+    pipeline as pages are encoded (page 1 also carries the header)."""
+    cfg = snapshot.policy.cascade
+    providers = _cascade_providers(snapshot, usable, features)
+    tiers = model_tiers(snapshot.registry, features["required_capabilities"], providers=providers)
+    if not tiers:
+        raise ValueError(f"no eligible models for providers {providers}")
+    tiers = tiers[: int(cfg.get("max_tiers", len(tiers)))]
+    doc_type = features["doc_type"]
+    prompts = {HEADER_TASK: _header_prompt(doc_type), LINE_ITEMS_TASK: _line_items_prompt(doc_type)}
+
+    async def call(model: Dict[str, Any], task: str, page: int) -> Dict[str, Any]:
+        img = images[1] if task == HEADER_TASK else images[page]
+        adapter = usable[model["provider"]]
+        rows = _expected_rows_per_page(features, page_features.get(page) if task == LINE_ITEMS_TASK else None)
+        return await _extract_task(snapshot, adapter, model["key"], task, doc_type, prompts[task], img, rows)
+
+    return CascadeRunner(
+        tiers,
+        call,
+        _compute_confidence,
+        min_confidence=float(cfg.get("min_confidence", 0.85)),
+        tolerance=float(cfg.get("tolerance", 0.02)),
+        tokens_per_call=int(cfg.get("tokens_per_call", 1500)),
+    )
+
+
+async def _finish_cascade(snapshot: "RouterSnapshot", runner: "CascadeRunner", features: Dict[str, Any]) -> tuple:
+    """Apply document-level gates and compare against what static routing would have used."""
+    fields, report = await runner.finish()
+    static_models: Dict[str, Any] = {}
+    for task in ("header_extraction", "line_items"):
+        key = snapshot.router.select(task, features).get("portfolio_key")
+        m = snapshot.registry.get_model(key)
+        static_models[task] = {**m, "key": key} if m else None
+    stats = await shared_state.model_stats()
+    runner.compare_static(report, static_models, {k: v.get("avg_latency_ms") for k, v in stats.items()}, features["page_count"])
+    CASCADE_STATS.add(report)
+    return fields, report
+
+
+HEADER_KEYS = ["invoice_number", "invoice_date", "buyer", "seller", "total_amount", "total_currency"]
+
+
+def _page_routing_features(features: Dict[str, Any], page: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Document features with the page's own table estimates; page_count stays document-wide."""
+    if page is None:
+        return features
+    return {
+        **features,
+        "page": page["page"],
+        "table_density": page["table_density"],
+        "expected_line_items": page["expected_line_items"],
+    }
+
+
+# Table estimates say how many rows a call will read; the header call reads none
+_TABLE_FEATURES = ("page", "table_density", "expected_line_items")
+
+
+def _header_routing_features(features: Dict[str, Any]) -> Dict[str, Any]:
+    """Document-level features without the table estimates, for header_extraction."""
+    return {k: v for k, v in features.items() if k not in _TABLE_FEATURES}
+
+
+def _plan_extraction(
+    filename: str,
+    snapshot: Optional["RouterSnapshot"],
+    adapters: Dict[str, Any],
+    images: Dict[int, bytes],
+    features: Dict[str, Any],
+    page_features: Dict[int, Dict[str, Any]],
+    router_meta: Dict[str, Any],
+    steps: List[str],
+) -> tuple:
+    """Choose how the header and each page's line items are extracted.
+
+    Returns (header_fn, page_fn, cascade_runner_or_None). Order of preference:
+    cascade, Smart Router selection, then the configured processor. A failed
+    router call falls back to the processor for that call only. Line items are
+    routed on the features of the page they read; the header on the document's,
+    without table estimates.
+    """
+    router = snapshot.router if snapshot is not None else None
+    usable = _usable_adapters(snapshot, adapters, features) if snapshot is not None else {}
+    doc_type = features["doc_type"]
+    header_prompt = _header_prompt(doc_type)
+    items_prompt = _line_items_prompt(doc_type)
+
+    # Processor fallbacks. For non-OpenRouter processors page 1 serves both the
+    # header and its own items, so its result is shared rather than run twice.
+    local_results: Dict[int, "asyncio.Task"] = {}
+    # Offline, an upstream processor is no fallback: calls fail fast instead
+    # of sending pages out of the network
+    upstream_blocked = bool(features.get("offline_mode")) and isinstance(processor, OpenRouterProcessor)
+
+    def _offline_error(task: str) -> RuntimeError:
+        return RuntimeError(f"OFFLINE_MODE: no usable local provider for {task} and the processor is upstream")
+
+    def _local(idx: int, img: bytes) -> "asyncio.Task":
+        if idx not in local_results:
+            local_results[idx] = asyncio.ensure_future(processor.process_document(img, f"{filename}#p{idx}"))
+        return local_results[idx]
+
+    async def processor_header(img: bytes) -> Dict[str, Any]:
+        if upstream_blocked:
+            raise _offline_error(HEADER_TASK)
+        if isinstance(processor, OpenRouterProcessor):
+            header = await processor.process_with_prompt(img, f"{filename}#p1", header_prompt, HEADER_TASK, doc_type)
+            return header.get("extracted_fields", {}) or {}
+        interim = await _local(1, img)
+        return {k: (interim.get("extracted_fields", {}) or {}).get(k) for k in HEADER_KEYS}
+
+    async def processor_page(idx: int, img: bytes) -> List[Dict[str, Any]]:
+        if upstream_blocked:
+            raise _offline_error(LINE_ITEMS_TASK)
+        if isinstance(processor, OpenRouterProcessor):
+            rows = _expected_rows_per_page(features, page_features.get(idx))
+            li = await processor.process_with_prompt(img, f"{filename}#p{idx}", items_prompt, LINE_ITEMS_TASK, doc_type, rows)
+        else:
+            li = await _local(idx, img)
+        return (li.get("extracted_fields", {}) or {}).get("line_items") or []
+
+    # Cascade mode: cheapest model first, escalate only failing pages/header.
+    # Its gates are invoice arithmetic, so other doc types use static routing.
+    cascade_cfg = snapshot.policy.cascade if snapshot is not None else {}
+    if cascade_cfg.get("enabled") and usable and features["doc_type"] == "invoice":
+        try:
+            runner = _build_cascade(snapshot, usable, images, features, page_features)
+            steps.append("extract(cascade)")
+            return (lambda img: runner.header()), (lambda idx, img: runner.page(idx)), runner
+        except Exception as e:
+            logger.warning(f"Cascade unavailable, falling back to static routing: {e}")
+
+    def routed(task: str, label: str, task_features: Dict[str, Any]) -> tuple:
+        """(selection, adapter, step labels) for a routed call; (None, None, ...) means the processor."""
+        sel = None
+        labels: List[str] = []
+        if router is not None:
+            try:
+                sel = router.select(task, task_features)
+            except Exception as e:
+                logger.warning(f"Router {task} selection failed, fallback: {e}")
+        if sel is not None and sel.get("provider") in usable:
+            return sel, usable[sel["provider"]], [f"{label}(router:{sel['provider']})"]
+        if sel is not None:
+            labels.append(f"{label}(router_unavailable)")
+        if upstream_blocked:
+            labels.append(f"{label}(offline_unavailable)")
+        else:
+            labels.append(label if isinstance(processor, OpenRouterProcessor) else f"{label}_fallback")
+        return sel, None, labels
+
+    def record(task: str, sel: Optional[Dict[str, Any]], labels: List[str], page: Optional[int] = None) -> None:
+        if sel is not None:
+            # Consecutive pages with the same choice share one decision entry
+            last = router_meta["decisions"][-1] if router_meta["decisions"] else None
+            if (
+                page is not None and last is not None and last.get("pages")
+                and last["portfolio_key"] == sel["portfolio_key"] and last["rule"] == sel["rule"]
+            ):
+                last["pages"].append(page)
+            else:
+                router_meta["decisions"].append({"task": task, **sel, **({"pages": [page]} if page is not None else {})})
+        steps.extend(lb for lb in labels if lb not in steps)
+
+    sel_header, header_adapter, labels = routed(
+        "header_extraction", "extract_header", _header_routing_features(features)
+    )
+    record("header_extraction", sel_header, labels)
+    header_rows = _expected_rows_per_page(features)
+
+    page_routes: Dict[int, tuple] = {}
+    for idx in range(1, int(features["page_count"]) + 1):
+        sel, adapter, labels = routed("line_items", "extract_line_items", _page_routing_features(features, page_features.get(idx)))
+        record("line_items", sel, labels, idx)
+        page_routes[idx] = (sel, adapter)
+
+    async def header_fn(img: bytes) -> Dict[str, Any]:
+        if header_adapter is not None:
+            try:
+                return await _extract_task(
+                    snapshot, header_adapter, sel_header["portfolio_key"], HEADER_TASK, doc_type, header_prompt, img, header_rows
+                )
+            except Exception as e:
+                if upstream_blocked:
+                    raise
+                logger.warning(f"Router header extraction failed, fallback: {e}")
+        return await processor_header(img)
+
+    async def page_fn(idx: int, img: bytes) -> List[Dict[str, Any]]:
+        sel, adapter = page_routes.get(idx, (None, None))
+        if adapter is not None:
+            try:
+                rows = _expected_rows_per_page(features, page_features.get(idx))
+                li = await _extract_task(
+                    snapshot, adapter, sel["portfolio_key"], LINE_ITEMS_TASK, doc_type, items_prompt, img, rows
+                )
+                return li.get("line_items") or []
+            except Exception as e:
+                if upstream_blocked:
+                    raise
+                logger.warning(f"Router line_items extraction failed for page {idx}, fallback: {e}")
+        return await processor_page(idx, img)
+
+    return header_fn, page_fn, None
+
+
+@app.post("/orchestrate", response_model=OrchestrationResponse, dependencies=[Depends(_rate_limit)])
 async def orchestrate_document_endpoint(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
+    x_priority: Optional[str] = Header(default=None),
+    x_api_key: Optional[str] = Header(default=None),
 ) -> OrchestrationResponse:
     """Hybrid orchestrator endpoint using staged extraction steps.
     n8n should call this endpoint as a single step after ingestion.
+    Bulk imports should send X-Priority: bulk so interactive uploads stay fast.
     """
     timestamp = datetime.now().isoformat()
     start_time = datetime.now()
     steps: List[str] = []
-    # Optional tracing root
-    root_run = None
-    if RunTree and LANGCHAIN_TRACING_V2:
-        try:
-            root_run = RunTree(name="orchestrate", inputs={"filename": getattr(file, "filename", None)}, project_name=LANGCHAIN_PROJECT)
-        except Exception:
-            root_run = None
+    ticket: Optional[Ticket] = None
+    close_source: Optional[Any] = None
+    # Spans are recorded in memory; export happens off the request path
+    active_trace = tracer.begin("orchestrate", filename=file.filename) if tracer is not None else None
+    trace_error: Optional[str] = None
     try:
         if not file.filename:
             raise HTTPException(status_code=400, detail="No filename provided")
@@ -631,119 +1683,146 @@ async def orchestrate_document_endpoint(
         logger.info(f"[Hybrid] Orchestrating document: {file.filename} ({len(content)} bytes)")
         steps.append("ingestion")
 
-        # Split into page images if PDF
-        page_images: List[bytes]
-        if file.filename.lower().endswith(".pdf"):
-            page_images = _render_pdf_pages(content)
-            steps.append(f"split_pdf:{len(page_images)}_pages")
+        # Pin one router snapshot for the whole request so a concurrent reload
+        # cannot change routing halfway through a document.
+        snapshot = _ROUTER_STORE.current() if _ROUTER_STORE is not None else None
+        router = snapshot.router if snapshot is not None else None
+        adapters = _ADAPTERS
+
+        cache_key = _cache_key("orchestrate", content, snapshot.version if snapshot else None)
+        cached = await shared_state.get_result(cache_key)
+        if cached is not None:
+            steps.append("result_cache_hit")
+            processing_time = (datetime.now() - start_time).total_seconds()
+            return OrchestrationResponse(
+                success=True,
+                data={**cached, "cache_hit": True},
+                filename=file.filename,
+                processing_time=f"{processing_time:.2f}s",
+                steps=steps,
+                timestamp=timestamp,
+            )
+
+        # Format comes from magic bytes; pages are rendered/encoded lazily by the
+        # pipeline, so only the count is needed up front
+        try:
+            with span("decode") as sp:
+                source_mime, page_count, render_page, encode_page, close_source = document_page_source(
+                    content, max_side=MAX_IMAGE_SIDE, dpi=RENDER_DPI
+                )
+                sp.set(mime=source_mime, pages=page_count)
+        except UnsupportedFormat as e:
+            raise HTTPException(status_code=415, detail=str(e))
+        if source_mime == "application/pdf":
+            steps.append(f"split_pdf:{page_count}_pages")
+        elif page_count > 1:
+            steps.append(f"split_tiff:{page_count}_pages")
         else:
-            page_images = [content]
-            steps.append("single_image")
+            steps.append(f"single_image:{source_mime}")
+
+        with span("admission", pages=page_count):
+            ticket = await _admit(page_count, x_priority, x_api_key)
+        steps.append(f"admitted:{ticket.cls.name}" if ticket is not None else "admitted")
 
-        router_meta: Dict[str, Any] = {"decisions": []}
+        router_meta: Dict[str, Any] = {"decisions": [], "version": snapshot.version if snapshot else None}
+        classification, doc_features = await asyncio.gather(_classify(content), _extract_features(content))
+        doc_type = classification["routing_doc_type"]
+        steps.append(f"classify:{classification['doc_type']}({classification['confidence']})")
+        steps.append(f"features:{doc_features['expected_line_items']}_line_items")
+        page_features = {p["page"]: p for p in doc_features["pages"]}
 
-        # Build routing features (Phase 1: simple heuristics)
+        # Routing features; each call swaps in the table estimates of its page
         features_common = {
-            "page_count": len(page_images),
-            "doc_type": "invoice",  # TODO: plug a lightweight classifier
+            "page_count": page_count,
+            "doc_type": doc_type,
+            "size_bytes": doc_features["size_bytes"],
+            "table_density": doc_features["table_density"],
+            "expected_line_items": doc_features["expected_line_items"],
             "budget": ROUTING_BUDGET,
             "offline_mode": OFFLINE_MODE,
+            "wan_slow": False if OFFLINE_MODE else await _wan_slow(snapshot, adapters),
             "required_capabilities": ["vision", "json"],
         }
-
-        header_result: Dict[str, Any]
-        # Try Smart Router first
-        used_router = False
-        if _ROUTER is not None:
-            try:
-                sel = _ROUTER.select("header_extraction", features_common)
-                router_meta["decisions"].append({"task": "header_extraction", **sel})
-                if sel.get("provider") == "openrouter" and _OR_ADAPTER and _OR_ADAPTER.is_configured():
-                    hdr = await _OR_ADAPTER.extract_json(_header_prompt(), [page_images[0]], sel.get("model_name"))
-                    header_result = {"extracted_fields": hdr.get("extracted_fields", {})}
-                    used_router = True
-                    steps.append("extract_header(router)")
-                else:
-                    steps.append("extract_header(router_unavailable)")
-            except Exception as e:
-                logger.warning(f"Router header selection failed, fallback: {e}")
-
-        if not used_router:
-            if isinstance(processor, OpenRouterProcessor):
-                header = await processor.process_with_prompt(page_images[0], f"{file.filename}#p1", _header_prompt())
-                header_result = {"extracted_fields": header.get("extracted_fields", {})}
-                steps.append("extract_header")
-            else:
-                # Fallback: use existing process and then subset
-                interim = await processor.process_document(page_images[0], f"{file.filename}#p1")
-                header_result = {"extracted_fields": {k: interim.get("extracted_fields", {}).get(k) for k in [
-                    "invoice_number", "invoice_date", "buyer", "seller", "total_amount", "total_currency"
-                ]}}
-                steps.append("extract_header_fallback")
-
-        # Extract line items from all pages
-        aggregated_items: List[Dict[str, Any]] = []
-        used_router_items = False
-        if _ROUTER is not None:
-            try:
-                sel_items = _ROUTER.select("line_items", features_common)
-                router_meta["decisions"].append({"task": "line_items", **sel_items})
-                if sel_items.get("provider") == "openrouter" and _OR_ADAPTER and _OR_ADAPTER.is_configured():
-                    for idx, img in enumerate(page_images, start=1):
-                        li = await _OR_ADAPTER.extract_json(_line_items_prompt(), [img], sel_items.get("model_name"))
-                        page_items = (li.get("extracted_fields", {}) or {}).get("line_items") or []
-                        aggregated_items.extend(page_items)
-                    used_router_items = True
-                    steps.append("extract_line_items(router)")
-            except Exception as e:
-                logger.warning(f"Router line_items selection failed, fallback: {e}")
-
-        if not used_router_items:
-            if isinstance(processor, OpenRouterProcessor):
-                for idx, img in enumerate(page_images, start=1):
-                    li = await processor.process_with_prompt(img, f"{file.filename}#p{idx}", _line_items_prompt())
-                    page_items = (li.get("extracted_fields", {}) or {}).get("line_items") or []
-                    aggregated_items.extend(page_items)
-                steps.append("extract_line_items")
+        if features_common["wan_slow"]:
+            steps.append("wan_slow")
+
+        # Known supplier layout: extract from the text layer, no model calls
+        template_report: Optional[Dict[str, Any]] = None
+        if template_store is not None and source_mime == "application/pdf" and doc_type == "invoice":
+            with span("template") as sp:
+                template_report = await _template_extract(file.filename, content)
+                sp.set(status=template_report["status"], template=template_report["template"])
+            steps.append(f"template_{template_report['status']}")
+
+        pipeline: Optional[DocumentPipeline] = None
+        if template_report is not None and template_report["fields"] is not None:
+            fields = template_report["fields"]
+            steps.append(f"extract(template:{template_report['template']})")
+        else:
+            images: Dict[int, bytes] = {}
+            header_fn, page_fn, runner = _plan_extraction(
+                file.filename, snapshot, adapters, images, features_common, page_features, router_meta, steps
+            )
+            pipeline = DocumentPipeline(
+                page_count,
+                render_page,
+                encode_page,
+                header_fn,
+                page_fn,
+                queue_size=PIPELINE_QUEUE_SIZE,
+                extract_concurrency=PIPELINE_EXTRACT_CONCURRENCY,
+                images=images,
+                close=close_source,
+            )
+            with span("pipeline", pages=page_count):
+                header_fields, aggregated_items = await pipeline.run()
+            steps.append("pipeline")
+
+            if runner is not None:
+                with span("cascade_finish"):
+                    fields, cascade_report = await _finish_cascade(snapshot, runner, features_common)
+                router_meta["cascade"] = cascade_report
+                steps.append(f"cascade({cascade_report['escalated_units']}/{cascade_report['units']}_escalated)")
             else:
-                # Fallback: take whatever items already present
-                try:
-                    items = (interim.get("extracted_fields", {}) or {}).get("line_items") or []
-                    aggregated_items.extend(items)
-                except NameError:
-                    # No interim available (e.g., header used router). Leave items empty.
-                    logger.warning("No interim available for line_items fallback; continuing with empty items.")
-                steps.append("extract_line_items_fallback")
-
-        # Merge
-        fields = header_result.get("extracted_fields", {}) or {}
-        fields["line_items"] = aggregated_items
+                fields = dict(header_fields or {})
+                fields["line_items"] = aggregated_items
         steps.append("merge")
 
         # Compute confidence and summary
-        confidence = round(_compute_confidence(fields), 2)
+        confidence = round(_compute_confidence(fields, doc_type), 2)
         text_content = _build_summary(fields)
         result = {
             "text_content": text_content,
             "confidence": confidence,
             "extracted_fields": fields,
             "metadata": {
-                "processing_method": f"hybrid:{PROCESSING_MODE}",
-                "pages": len(page_images),
+                "processing_method": "template" if pipeline is None else f"hybrid:{PROCESSING_MODE}",
+                "pages": page_count,
+                "classification": classification,
+                "features": doc_features,
                 "router": router_meta,
+                "pipeline": pipeline.describe() if pipeline is not None else None,
+                "template": {k: v for k, v in template_report.items() if k != "fields"} if template_report else None,
             },
         }
 
+        # A validated model extraction of an unseen layout teaches a new template
+        if (
+            pipeline is not None
+            and template_report is not None
+            and template_report["status"] in ("miss", "rejected")
+            and confidence >= TEMPLATE_LEARN_MIN_CONFIDENCE
+            and validate_template_fields(fields) is None
+        ):
+            background_tasks.add_task(_learn_template, file.filename, content, fields, "extraction")
+
         processing_time = (datetime.now() - start_time).total_seconds()
         result["processing_time_seconds"] = processing_time
+        await shared_state.put_result(cache_key, result)
         background_tasks.add_task(save_processed_file, file.filename, content, result)
 
-        # End tracing if enabled
-        if root_run is not None:
-            try:
-                root_run.end(outputs={"success": True, "filename": file.filename, "confidence": confidence, "steps": steps})
-            except Exception:
-                pass
+        if active_trace is not None:
+            active_trace.trace.root.set(confidence=confidence, pages=page_count)
 
         return OrchestrationResponse(
             success=True,
@@ -754,15 +1833,12 @@ async def orchestrate_document_endpoint(
             timestamp=timestamp,
         )
 
-    except HTTPException:
+    except HTTPException as e:
+        trace_error = f"HTTP {e.status_code}: {e.detail}"
         raise
     except Exception as e:
+        trace_error = str(e)
         logger.error(f"Unexpected error in /orchestrate for {file.filename}: {e}", exc_info=True)
-        if root_run is not None:
-            try:
-                root_run.end(error=str(e), outputs={"success": False, "filename": getattr(file, "filename", None), "steps": steps})
-            except Exception:
-                pass
         return OrchestrationResponse(
             success=False,
             error=str(e),
@@ -770,8 +1846,20 @@ async def orchestrate_document_endpoint(
             steps=steps,
             timestamp=timestamp,
         )
+    finally:
+        # Template hits and early failures never ran the pipeline that closes it
+        if close_source is not None:
+            await asyncio.to_thread(close_source)
+        if ticket is not None:
+            admission.release(ticket)
+        if active_trace is not None:
+            tracer.end(active_trace, error=trace_error, steps=steps)
 
 if __name__ == "__main__":
+    if SERVER_MODE == "production":
+        # gunicorn preloads the app once and forks WEB_CONCURRENCY uvicorn workers;
+        # see gunicorn.conf.py. Shared state goes through Redis.
+        os.execvp("gunicorn", ["gunicorn", "-c", "gunicorn.conf.py", "main:app"])
     uvicorn.run(
         "main:app",
         host=API_HOST,
@@ -0,0 +1,258 @@
+"""
+Direct bulk persistence of processed documents to the beyan_documents database.
+
+Results are queued in memory and written by a background task in batches:
+document ids are reserved from the sequence in one round trip, then both
+``processed_documents`` and the normalized ``line_items`` table are filled with
+COPY inside a single transaction. The queue is bounded, so when Postgres falls
+behind, producers wait (up to ``enqueue_timeout``) instead of growing memory.
+"""
+
+import asyncio
+import json
+import logging
+import time
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import asyncpg  # type: ignore
+except Exception:  # pragma: no cover - optional dep
+    asyncpg = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Idempotent; mirrors config/postgres/init-tables.sql for databases created
+# before the normalized columns and line_items table existed.
+SCHEMA_SQL = """
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS invoice_number TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS po_number TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS seller_name TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS buyer_name TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS invoice_date TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS total_amount NUMERIC;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS total_currency TEXT;
+ALTER TABLE processed_documents ADD COLUMN IF NOT EXISTS confidence NUMERIC;
+CREATE INDEX IF NOT EXISTS idx_processed_documents_invoice_number ON processed_documents (invoice_number);
+CREATE INDEX IF NOT EXISTS idx_processed_documents_seller_name ON processed_documents (seller_name);
+CREATE TABLE IF NOT EXISTS line_items (
+    id BIGSERIAL PRIMARY KEY,
+    processed_document_id BIGINT NOT NULL REFERENCES processed_documents(id) ON DELETE CASCADE,
+    line_no INTEGER NOT NULL,
+    model_code TEXT,
+    goods_description TEXT,
+    quantity NUMERIC,
+    unit_price NUMERIC,
+    amount NUMERIC
+);
+CREATE INDEX IF NOT EXISTS idx_line_items_document ON line_items (processed_document_id);
+CREATE INDEX IF NOT EXISTS idx_line_items_model_code ON line_items (model_code);
+"""
+# Every API worker runs SCHEMA_SQL at startup; concurrent IF NOT EXISTS DDL
+# can still collide on the catalog, so the workers take turns on this lock.
+SCHEMA_LOCK_ID = 0x62657961
+
+DOCUMENT_COLUMNS = [
+    "id", "filename", "classification", "extraction", "validation", "status",
+    "invoice_number", "po_number", "seller_name", "buyer_name", "invoice_date",
+    "total_amount", "total_currency", "confidence",
+]
+LINE_ITEM_COLUMNS = [
+    "processed_document_id", "line_no", "model_code", "goods_description",
+    "quantity", "unit_price", "amount",
+]
+
+
+def _num(value: Any) -> Optional[Decimal]:
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        if isinstance(value, str):
+            value = value.replace(",", "").strip()
+        return Decimal(str(value))
+    except (InvalidOperation, ValueError):
+        return None
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def _party_name(fields: Dict[str, Any], key: str) -> Optional[str]:
+    party = fields.get(key)
+    if isinstance(party, dict):
+        return _text(party.get("name"))
+    return _text(party)
+
+
+def document_rows(doc_id: int, filename: str, result: Dict[str, Any]) -> Tuple[tuple, List[tuple]]:
+    """Flatten one API result into a processed_documents row and its line_items rows."""
+    fields = result.get("extracted_fields") or {}
+    metadata = result.get("metadata") or {}
+    header = {k: v for k, v in fields.items() if k != "line_items"}
+    doc = (
+        doc_id,
+        filename,
+        json.dumps(metadata.get("classification"), ensure_ascii=False),
+        json.dumps(fields, ensure_ascii=False),
+        json.dumps({"confidence": result.get("confidence"), "router": metadata.get("router")}, ensure_ascii=False),
+        "completed",
+        _text(header.get("invoice_number")),
+        _text(header.get("po_number")),
+        _party_name(header, "seller"),
+        _party_name(header, "buyer"),
+        _text(header.get("invoice_date") or header.get("date")),
+        _num(header.get("total_amount")),
+        _text(header.get("total_currency") or header.get("currency")),
+        _num(result.get("confidence")),
+    )
+    items: List[tuple] = []
+    for line_no, row in enumerate(fields.get("line_items") or [], start=1):
+        if not isinstance(row, dict):
+            continue
+        items.append((
+            doc_id,
+            line_no,
+            _text(row.get("model_code")),
+            _text(row.get("goods_description")),
+            _num(row.get("quantity")),
+            _num(row.get("unit_price")),
+            _num(row.get("amount")),
+        ))
+    return doc, items
+
+
+class PostgresSink:
+    """Background, batched writer for processed documents and line items."""
+
+    def __init__(
+        self,
+        dsn: str,
+        batch_size: int = 200,
+        queue_size: int = 1000,
+        flush_ms: float = 500.0,
+        enqueue_timeout: float = 30.0,
+        max_retries: int = 3,
+    ):
+        if asyncpg is None:
+            raise RuntimeError("asyncpg is not installed")
+        self.dsn = dsn
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_ms / 1000.0
+        self.enqueue_timeout = enqueue_timeout
+        self.max_retries = max_retries
+        self._queue: "asyncio.Queue[Tuple[str, Dict[str, Any]]]" = asyncio.Queue(maxsize=queue_size)
+        self._pool: Any = None
+        self._worker: Optional[asyncio.Task] = None
+        # metrics
+        self.enqueued = 0
+        self.dropped = 0
+        self.documents_written = 0
+        self.line_items_written = 0
+        self.batches = 0
+        self._write_seconds = 0.0
+
+    async def start(self) -> None:
+        self._pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=2)
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK_ID)
+                await conn.execute(SCHEMA_SQL)
+        self._worker = asyncio.create_task(self._run())
+        logger.info(f"Postgres persistence sink started (batch {self.batch_size}, queue {self._queue.maxsize})")
+
+    async def submit(self, filename: str, result: Dict[str, Any]) -> bool:
+        """Queue one result. Waits while the queue is full (back-pressure)."""
+        try:
+            await asyncio.wait_for(self._queue.put((filename, result)), timeout=self.enqueue_timeout)
+            self.enqueued += 1
+            return True
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            logger.error(f"Persistence queue full for {self.enqueue_timeout}s; dropping {filename}")
+            return False
+
+    async def _collect(self) -> List[Tuple[str, Dict[str, Any]]]:
+        batch = [await self._queue.get()]
+        deadline = time.perf_counter() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def write_batch(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                ids = await conn.fetch(
+                    "SELECT nextval(pg_get_serial_sequence('processed_documents', 'id')) AS id "
+                    "FROM generate_series(1, $1)",
+                    len(batch),
+                )
+                docs: List[tuple] = []
+                items: List[tuple] = []
+                for rec, (filename, result) in zip(ids, batch):
+                    doc, doc_items = document_rows(rec["id"], filename, result)
+                    docs.append(doc)
+                    items.extend(doc_items)
+                await conn.copy_records_to_table("processed_documents", records=docs, columns=DOCUMENT_COLUMNS)
+                if items:
+                    await conn.copy_records_to_table("line_items", records=items, columns=LINE_ITEM_COLUMNS)
+        self.documents_written += len(docs)
+        self.line_items_written += len(items)
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            for attempt in range(1, self.max_retries + 1):
+                try:
+                    await self.write_batch(batch)
+                    break
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        self.dropped += len(batch)
+                        logger.error(f"Persistence batch of {len(batch)} dropped after {attempt} attempts: {e}")
+                    else:
+                        logger.warning(f"Persistence batch failed (attempt {attempt}): {e}")
+                        await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            self._write_seconds += time.perf_counter() - started
+            self.batches += 1
+            for _ in batch:
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        """Flush whatever is queued, then stop the writer and the pool."""
+        if self._worker is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Persistence sink closed with {self._queue.qsize()} documents unwritten")
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    def stats(self) -> Dict[str, Any]:
+        rows = self.documents_written + self.line_items_written
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "documents_written": self.documents_written,
+            "line_items_written": self.line_items_written,
+            "rows_per_sec": round(rows / self._write_seconds, 1) if self._write_seconds else None,
+        }
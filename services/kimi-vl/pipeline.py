@@ -0,0 +1,205 @@
+"""
+Streaming page pipeline for /orchestrate.
+
+    render -> [queue] -> encode -> [queue] -> extract (N workers) -> [queue] -> merge
+
+Each stage runs as its own task and hands pages downstream through a bounded
+queue, so page 1 reaches the models while later pages are still rasterizing
+and a slow stage back-pressures the ones before it instead of buffering the
+whole document. The header call starts as soon as page 1 is encoded.
+
+Per stage we record busy time, idle time (waiting for input) and blocked time
+(waiting for room downstream), which shows where a document spent its time.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+# Page sources come from decoding.document_page_source
+RenderFn = Callable[[int], Any]               # page index (0-based) -> raster (blocking)
+EncodeFn = Callable[[Any], bytes]             # raster -> encoded image bytes (blocking)
+CloseFn = Callable[[], None]                  # release the source document (blocking)
+HeaderFn = Callable[[bytes], Awaitable[Dict[str, Any]]]
+PageFn = Callable[[int, bytes], Awaitable[List[Dict[str, Any]]]]
+
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.idle = 0.0
+        self.blocked = 0.0
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "items": self.items,
+            "busy_ms": round(self.busy * 1000, 1),
+            "idle_ms": round(self.idle * 1000, 1),
+            "blocked_ms": round(self.blocked * 1000, 1),
+        }
+
+
+class DocumentPipeline:
+    """Runs one document through render/encode/extract/merge stages."""
+
+    def __init__(
+        self,
+        page_count: int,
+        render: RenderFn,
+        encode: EncodeFn,
+        header_fn: HeaderFn,
+        page_fn: PageFn,
+        queue_size: int = 2,
+        extract_concurrency: int = 4,
+        images: Optional[Dict[int, bytes]] = None,
+        close: Optional[CloseFn] = None,
+    ):
+        if page_count < 1:
+            raise ValueError("document has no pages")
+        self.page_count = page_count
+        self.render = render
+        self.encode = encode
+        self.close = close
+        self.header_fn = header_fn
+        self.page_fn = page_fn
+        self.queue_size = max(1, queue_size)
+        self.extract_concurrency = max(1, extract_concurrency)
+        # Encoded pages by number; pass a dict in to read pages after the
+        # pipeline (e.g. cascade escalations re-send a page to a larger model).
+        self.images: Dict[int, bytes] = images if images is not None else {}
+        self.stats = {name: StageStats(name) for name in ("render", "encode", "extract", "merge")}
+        self._header_task: Optional[asyncio.Task] = None
+        self._header_started_at: Optional[float] = None
+        self._started = 0.0
+        self.elapsed = 0.0
+
+    async def _put(self, queue: asyncio.Queue, item: Any, stats: StageStats) -> None:
+        t = time.perf_counter()
+        await queue.put(item)
+        stats.blocked += time.perf_counter() - t
+
+    async def _get(self, queue: asyncio.Queue, stats: StageStats) -> Any:
+        t = time.perf_counter()
+        item = await queue.get()
+        stats.idle += time.perf_counter() - t
+        return item
+
+    async def _render_stage(self, out: asyncio.Queue) -> None:
+        st = self.stats["render"]
+        try:
+            for i in range(self.page_count):
+                t = time.perf_counter()
+                with span("render", page=i + 1):
+                    raster = await asyncio.to_thread(self.render, i)
+                st.busy += time.perf_counter() - t
+                st.items += 1
+                await self._put(out, (i + 1, raster), st)
+        finally:
+            # Done with the source document once every page is rendered (or
+            # the run failed); waits for a render still running in its thread
+            if self.close is not None:
+                await asyncio.to_thread(self.close)
+        await self._put(out, _DONE, st)
+
+    async def _encode_stage(self, inp: asyncio.Queue, out: asyncio.Queue) -> None:
+        st = self.stats["encode"]
+        while True:
+            item = await self._get(inp, st)
+            if item is _DONE:
+                for _ in range(self.extract_concurrency):
+                    await self._put(out, _DONE, st)
+                return
+            page_no, raster = item
+            t = time.perf_counter()
+            with span("encode", page=page_no) as sp:
+                image = await asyncio.to_thread(self.encode, raster)
+                sp.set(bytes=len(image))
+            st.busy += time.perf_counter() - t
+            st.items += 1
+            self.images[page_no] = image
+            if page_no == 1:
+                self._header_started_at = time.perf_counter()
+                self._header_task = asyncio.create_task(self._header(image))
+            await self._put(out, (page_no, image), st)
+
+    async def _header(self, image: bytes) -> Dict[str, Any]:
+        with span("extract_header"):
+            return await self.header_fn(image)
+
+    async def _extract_worker(self, inp: asyncio.Queue, out: asyncio.Queue) -> None:
+        st = self.stats["extract"]
+        while True:
+            item = await self._get(inp, st)
+            if item is _DONE:
+                await self._put(out, _DONE, st)
+                return
+            page_no, image = item
+            t = time.perf_counter()
+            with span("extract_page", page=page_no) as sp:
+                rows = await self.page_fn(page_no, image)
+                sp.set(rows=len(rows or []))
+            st.busy += time.perf_counter() - t
+            st.items += 1
+            await self._put(out, (page_no, rows), st)
+
+    async def _merge_stage(self, inp: asyncio.Queue) -> Dict[int, List[Dict[str, Any]]]:
+        st = self.stats["merge"]
+        pages: Dict[int, List[Dict[str, Any]]] = {}
+        finished = 0
+        while finished < self.extract_concurrency:
+            item = await self._get(inp, st)
+            if item is _DONE:
+                finished += 1
+                continue
+            t = time.perf_counter()
+            page_no, rows = item
+            pages[page_no] = rows or []
+            st.busy += time.perf_counter() - t
+            st.items += 1
+        return pages
+
+    async def run(self) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Return (header fields, line items in page order)."""
+        self._started = time.perf_counter()
+        q_render: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        q_encode: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        q_extract: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        tasks = [
+            asyncio.create_task(self._render_stage(q_render)),
+            asyncio.create_task(self._encode_stage(q_render, q_encode)),
+            *[asyncio.create_task(self._extract_worker(q_encode, q_extract)) for _ in range(self.extract_concurrency)],
+        ]
+        merge_task = asyncio.create_task(self._merge_stage(q_extract))
+        try:
+            await asyncio.gather(*tasks, merge_task)
+            header = await self._header_task if self._header_task is not None else {}
+        except BaseException:
+            for t in (*tasks, merge_task, self._header_task):
+                if t is not None and not t.done():
+                    t.cancel()
+            raise
+        pages = merge_task.result()
+        self.elapsed = time.perf_counter() - self._started
+        items = [row for p in sorted(pages) for row in pages[p]]
+        return header, items
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "pages": self.page_count,
+            "queue_size": self.queue_size,
+            "extract_concurrency": self.extract_concurrency,
+            "elapsed_ms": round(self.elapsed * 1000, 1),
+            # time from pipeline start until the header call was issued
+            "header_started_ms": round((self._header_started_at - self._started) * 1000, 1)
+            if self._header_started_at is not None else None,
+            "stages": {name: s.describe() for name, s in self.stats.items()},
+        }
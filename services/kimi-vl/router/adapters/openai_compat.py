@@ -0,0 +1,136 @@
+from __future__ import annotations
+import asyncio
+import base64
+import json
+import re
+from typing import Any, Dict, List, Optional
+import httpx
+
+_FENCE = re.compile(r"^```(?:json)?\s*|\s*```$")
+_IMAGE_MAGIC = ((b"\x89PNG\r\n\x1a\n", "image/png"), (b"\xff\xd8\xff", "image/jpeg"), (b"GIF8", "image/gif"))
+
+
+class TruncatedOutput(ValueError):
+    """The reply hit max_tokens before the JSON was complete."""
+
+    def __init__(self, model: str, usage: Dict[str, Any]):
+        self.usage = usage
+        super().__init__(f"{model} reply truncated at {usage.get('completion_tokens')} output tokens")
+
+
+def image_data_url(image: bytes) -> str:
+    """base64 data URL for a page image, labelled from its magic bytes (PNG if unknown)."""
+    mime = next((m for magic, m in _IMAGE_MAGIC if image.startswith(magic)), None)
+    if mime is None:
+        mime = "image/webp" if image[:4] == b"RIFF" and image[8:12] == b"WEBP" else "image/png"
+    return f"data:{mime};base64,{base64.b64encode(image).decode('utf-8')}"
+
+
+def build_messages(prompt: str, images: List[bytes]) -> List[Dict[str, Any]]:
+    """One user turn: page images first, then the extraction prompt."""
+    contents: List[Dict[str, Any]] = [{"type": "image_url", "image_url": {"url": image_data_url(img)}} for img in images]
+    contents.append({"type": "text", "text": prompt})
+    return [{"role": "user", "content": contents}]
+
+
+def parse_json_content(content: str) -> Dict[str, Any]:
+    """Model reply -> JSON object, tolerating ```json fences and surrounding prose."""
+    text = _FENCE.sub("", content.strip())
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            raise
+        return json.loads(text[start:end + 1])
+
+
+class OpenAICompatAdapter:
+    """
+    JSON extraction with vision inputs against any OpenAI-compatible
+    chat-completions server (llama.cpp server, vLLM, Ollama, LM Studio, ...).
+    """
+
+    provider = "openai_compat"
+
+    def __init__(
+        self,
+        base_url: Optional[str],
+        api_key: Optional[str] = None,
+        timeout_s: float = 120.0,
+        provider: Optional[str] = None,
+    ):
+        self.api_key = api_key
+        self.base_url = (base_url or "").rstrip("/")
+        self.chat_url = f"{self.base_url}/chat/completions"
+        if provider:
+            self.provider = provider
+        self.timeout_s = timeout_s
+        self.inflight = 0
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(timeout_s))
+
+    def is_configured(self) -> bool:
+        return bool(self.base_url)
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    async def extract_json(
+        self,
+        prompt: str,
+        images: List[bytes],
+        model_name: str,
+        temperature: float = 0.1,
+        response_format: Optional[Dict[str, Any]] = None,
+        max_tokens: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """``response_format`` (e.g. a strict json_schema) and ``max_tokens`` are
+        passed through when given. Raises TruncatedOutput when the reply was
+        cut off by ``max_tokens`` and is not valid JSON."""
+        if not self.is_configured():
+            raise RuntimeError(f"{type(self).__name__} is not configured")
+        body: Dict[str, Any] = {
+            "model": model_name,
+            "temperature": temperature,
+            "messages": build_messages(prompt, images),
+        }
+        if response_format is not None:
+            body["response_format"] = response_format
+        if max_tokens:
+            body["max_tokens"] = max_tokens
+        self.inflight += 1
+        try:
+            resp = await self.client.post(self.chat_url, headers=self._headers(), json=body)
+        finally:
+            self.inflight -= 1
+        resp.raise_for_status()
+        payload = resp.json()
+        choice = payload["choices"][0]
+        message_content = choice["message"]["content"] or ""
+        usage = payload.get("usage") or {}
+        try:
+            fields = parse_json_content(message_content)
+        except json.JSONDecodeError:
+            if choice.get("finish_reason") == "length":
+                raise TruncatedOutput(model_name, usage)
+            raise
+        return {
+            "raw": message_content,
+            "extracted_fields": fields,
+            "provider": self.provider,
+            "model": model_name,
+            "usage": usage,
+            "finish_reason": choice.get("finish_reason"),
+        }
+
+    async def aclose(self, grace_s: float = 0.0) -> None:
+        """Close the HTTP client once no call is using it. ``grace_s`` covers
+        callers that picked this adapter before it was replaced but have not
+        sent their request yet."""
+        await asyncio.sleep(grace_s)
+        while self.inflight:
+            await asyncio.sleep(0.5)
+        await self.client.aclose()
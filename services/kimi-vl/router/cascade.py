@@ -0,0 +1,251 @@
+from __future__ import annotations
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .registry import ModelRegistry
+
+# call(model, task, page_index) -> extracted_fields; page_index is 0 for the header
+CallFn = Callable[[Dict[str, Any], str, int], Awaitable[Dict[str, Any]]]
+
+LATENCY_ORDER = {"low": 0, "medium": 1, "high": 2}
+
+
+def model_tiers(registry: ModelRegistry, capabilities: List[str], providers: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """Eligible models ordered cheapest first (price, then latency class)."""
+    cands = registry.candidates(capabilities)
+    if providers is not None:
+        cands = [c for c in cands if c.get("provider") in providers]
+    return sorted(cands, key=lambda m: (
+        float(m.get("price_per_1k_input_usd") or 0.0),
+        LATENCY_ORDER.get(m.get("latency_class"), 1),
+    ))
+
+
+def _num(value: Any) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return float(str(value).replace(",", "").strip())
+    except ValueError:
+        return None
+
+
+def _close(a: float, b: float, tolerance: float) -> bool:
+    return abs(a - b) <= max(0.01, tolerance * max(abs(a), abs(b)))
+
+
+def check_line_items(rows: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """quantity x unit_price ~= amount for every row that has all three numbers."""
+    problems: List[str] = []
+    for i, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            problems.append(f"row {i}: not an object")
+            continue
+        q, p, a = _num(row.get("quantity")), _num(row.get("unit_price")), _num(row.get("amount"))
+        if q is not None and p is not None and a is not None and not _close(q * p, a, tolerance):
+            problems.append(f"row {i}: {q} x {p} != {a}")
+    return problems
+
+
+def check_total(fields: Dict[str, Any], tolerance: float) -> Optional[str]:
+    """sum(amount) ~= total_amount, when both are known."""
+    total = _num(fields.get("total_amount"))
+    amounts = [_num(r.get("amount")) for r in fields.get("line_items") or [] if isinstance(r, dict)]
+    amounts = [a for a in amounts if a is not None]
+    if total is None or not amounts:
+        return None
+    s = sum(amounts)
+    return None if _close(s, total, tolerance) else f"sum(amount) {round(s, 2)} != total_amount {total}"
+
+
+def _call_cost(model: Dict[str, Any], tokens: int) -> float:
+    return float(model.get("price_per_1k_input_usd") or 0.0) * tokens / 1000.0
+
+
+class CascadeStats:
+    """Process-wide counters behind the escalation-rate / savings report."""
+
+    def __init__(self) -> None:
+        self.documents = 0
+        self.units = 0
+        self.escalated_units = 0
+        self.calls = 0
+        self.cost_usd = 0.0
+        self.static_cost_usd = 0.0
+        self.latency_ms = 0.0
+        self.static_latency_ms = 0.0
+        self.latency_samples = 0
+
+    def add(self, report: Dict[str, Any]) -> None:
+        self.documents += 1
+        self.units += report["units"]
+        self.escalated_units += report["escalated_units"]
+        self.calls += report["calls"]
+        self.cost_usd += report["est_cost_usd"]
+        self.static_cost_usd += report["static_est_cost_usd"]
+        if report.get("static_est_latency_ms") is not None:
+            self.latency_ms += report["latency_ms"]
+            self.static_latency_ms += report["static_est_latency_ms"]
+            self.latency_samples += 1
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "documents": self.documents,
+            "escalation_rate": round(self.escalated_units / self.units, 3) if self.units else 0.0,
+            "calls": self.calls,
+            "est_cost_usd": round(self.cost_usd, 5),
+            "static_est_cost_usd": round(self.static_cost_usd, 5),
+            "est_cost_saved_usd": round(self.static_cost_usd - self.cost_usd, 5),
+            "est_latency_saved_ms": round(self.static_latency_ms - self.latency_ms, 1) if self.latency_samples else None,
+        }
+
+
+CASCADE_STATS = CascadeStats()
+
+
+class CascadeRunner:
+    """Confidence-gated cascade: every unit (header, each page's line items)
+    starts on the cheapest tier and only failing units move up a tier.
+
+    Gates, in order:
+      1. per page: quantity x unit_price ~= amount on each row
+      2. document: score_fn(merged fields) >= min_confidence, else escalate header
+      3. document: sum(amount) ~= total_amount, else escalate pages still on
+         the lowest tier, then the header
+    """
+
+    def __init__(
+        self,
+        tiers: List[Dict[str, Any]],
+        call: CallFn,
+        score_fn: Callable[[Dict[str, Any]], float],
+        min_confidence: float = 0.85,
+        tolerance: float = 0.02,
+        tokens_per_call: int = 1500,
+    ):
+        if not tiers:
+            raise ValueError("cascade needs at least one eligible model")
+        self.tiers = tiers
+        self.call = call
+        self.score_fn = score_fn
+        self.min_confidence = min_confidence
+        self.tolerance = tolerance
+        self.tokens_per_call = tokens_per_call
+        self.calls: List[Dict[str, Any]] = []
+        self._started: Optional[float] = None
+        self._header: Dict[str, Any] = {}
+        self._header_tier = 0
+        self._pages: Dict[int, Tuple[List[Dict[str, Any]], int]] = {}
+
+    async def _run(self, task: str, page: int, tier: int) -> Dict[str, Any]:
+        model = self.tiers[tier]
+        started = time.perf_counter()
+        try:
+            fields = await self.call(model, task, page)
+            ok = True
+        except Exception as e:
+            fields, ok = {"_error": str(e)}, False
+        self.calls.append({
+            "task": task, "page": page, "tier": tier, "model": model["key"], "ok": ok,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+        })
+        return fields
+
+    async def _page(self, page: int, tier: int) -> Tuple[List[Dict[str, Any]], int]:
+        """Run one page's line items, escalating until the row checks pass."""
+        while True:
+            fields = await self._run("line_items", page, tier)
+            rows = fields.get("line_items") or []
+            failed = "_error" in fields or bool(check_line_items(rows, self.tolerance))
+            if not failed or tier + 1 >= len(self.tiers):
+                return rows, tier
+            tier += 1
+
+    # Incremental API so a streaming pipeline can feed units as pages arrive:
+    # header() and page() run on the cheapest tier (escalating per page),
+    # finish() applies the document-level gates once every page is in.
+
+    async def header(self) -> Dict[str, Any]:
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._header = await self._run("header_extraction", 0, 0)
+        self._header_tier = 0
+        return self._header
+
+    async def page(self, page: int) -> List[Dict[str, Any]]:
+        if self._started is None:
+            self._started = time.perf_counter()
+        rows, tier = await self._page(page, 0)
+        self._pages[page] = (rows, tier)
+        return rows
+
+    def _merged(self) -> Dict[str, Any]:
+        fields = {k: v for k, v in self._header.items() if k != "_error"}
+        fields["line_items"] = [row for p in sorted(self._pages) for row in self._pages[p][0]]
+        return fields
+
+    async def _escalate_header(self) -> None:
+        self._header_tier += 1
+        self._header = await self._run("header_extraction", 0, self._header_tier)
+
+    async def finish(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        fields = self._merged()
+        while self.score_fn(fields) < self.min_confidence and self._header_tier + 1 < len(self.tiers):
+            await self._escalate_header()
+            fields = self._merged()
+
+        if check_total(fields, self.tolerance):
+            cheap = [p for p, (_, t) in self._pages.items() if t == 0]
+            if cheap and len(self.tiers) > 1:
+                results = await asyncio.gather(*[self._page(p, 1) for p in cheap])
+                self._pages.update(dict(zip(cheap, results)))
+                fields = self._merged()
+            if check_total(fields, self.tolerance) and self._header_tier + 1 < len(self.tiers):
+                await self._escalate_header()
+                fields = self._merged()
+
+        latency_ms = (time.perf_counter() - (self._started or time.perf_counter())) * 1000
+        report = self._report(len(self._pages), self._header_tier, self._pages, latency_ms)
+        report["total_check"] = check_total(fields, self.tolerance) or "ok"
+        return fields, report
+
+    async def run(self, page_count: int) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """Run every unit at once (all page images already available)."""
+        await asyncio.gather(self.header(), *[self.page(p) for p in range(1, page_count + 1)])
+        return await self.finish()
+
+    def _report(self, page_count: int, header_tier: int, pages: Dict[int, Tuple[Any, int]], latency_ms: float) -> Dict[str, Any]:
+        units = 1 + page_count
+        escalated = (1 if header_tier > 0 else 0) + sum(1 for _, t in pages.values() if t > 0)
+        return {
+            "tiers": [t["key"] for t in self.tiers],
+            "header_tier": header_tier,
+            "page_tiers": {str(p): t for p, (_, t) in sorted(pages.items())},
+            "units": units,
+            "escalated_units": escalated,
+            "escalation_rate": round(escalated / units, 3),
+            "calls": len(self.calls),
+            "latency_ms": round(latency_ms, 1),
+            "est_cost_usd": round(sum(_call_cost(self.tiers[c["tier"]], self.tokens_per_call) for c in self.calls), 5),
+            "call_log": self.calls,
+        }
+
+    def compare_static(self, report: Dict[str, Any], static_models: Dict[str, Dict[str, Any]],
+                       avg_latency_ms: Dict[str, Optional[float]], page_count: int) -> Dict[str, Any]:
+        """Estimate what static routing (one model per task, sequential calls) would have cost."""
+        header_m, items_m = static_models.get("header_extraction"), static_models.get("line_items")
+        cost = 0.0
+        latency: Optional[float] = 0.0
+        for model, n in ((header_m, 1), (items_m, page_count)):
+            if not model:
+                continue
+            cost += _call_cost(model, self.tokens_per_call) * n
+            lat = avg_latency_ms.get(model.get("key", ""))
+            latency = None if latency is None or lat is None else latency + lat * n
+        report["static_models"] = {k: (v or {}).get("key") for k, v in static_models.items()}
+        report["static_est_cost_usd"] = round(cost, 5)
+        report["est_cost_saved_usd"] = round(cost - report["est_cost_usd"], 5)
+        report["static_est_latency_ms"] = round(latency, 1) if latency is not None else None
+        report["est_latency_saved_ms"] = round(latency - report["latency_ms"], 1) if latency is not None else None
+        return report
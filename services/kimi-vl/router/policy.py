@@ -12,6 +12,7 @@ class RoutingPolicy:
       - "doc_type == \"invoice\""
       - "page_count <= 3"
       - "budget in [\"low\", \"medium\"]"
+      - "offline_mode == true"
     Supports 'all' and 'any' blocks under 'when'.
     """
 
@@ -20,6 +21,7 @@ class RoutingPolicy:
         self.rules: List[Dict[str, Any]] = []
         self.fallbacks: Dict[str, Any] = {}
         self.retry_policy: Dict[str, Any] = {}
+        self.cascade: Dict[str, Any] = {}
         self._load()
 
     def _load(self) -> None:
@@ -30,6 +32,7 @@ class RoutingPolicy:
         self.rules = data.get("rules", [])
         self.fallbacks = data.get("fallbacks", {})
         self.retry_policy = data.get("retry_policy", {"attempts": 1, "backoff_ms": 0})
+        self.cascade = data.get("cascade", {}) or {}
 
     def _eval_condition(self, expr: str, ctx: Dict[str, Any]) -> bool:
         expr = str(expr).strip()
@@ -64,9 +67,12 @@ class RoutingPolicy:
                             return lval_num > rval_num
                         if op == "<":
                             return lval_num < rval_num
+                        return lval_num == rval_num
                     except Exception:
-                        # fallback to string compare for == only
+                        # fallback to string compare for == only; booleans match true/false
                         if op == "==":
+                            if isinstance(lval, bool):
+                                return str(lval).lower() == right.lower()
                             return str(lval) == str(right)
                         return False
             return False
@@ -83,7 +89,7 @@ class RoutingPolicy:
 
     def match(self, task: str, features: Dict[str, Any], candidates: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
         ctx = {**features, "task": task}
-        cand_names = {c["name"] for c in candidates}
+        cand_names = {c.get("key", c["name"]) for c in candidates}
         for rule in self.rules:
             when = rule.get("when", {})
             if self._match_when(when, ctx):
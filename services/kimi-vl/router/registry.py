@@ -35,7 +35,8 @@ class ModelRegistry:
         for mname, m in self.models.items():
             caps = set(m.get("capabilities", []))
             if all(c in caps for c in capabilities):
-                result.append({"name": mname, **m})
+                # "name" is the provider's model id; "key" is the portfolio key
+                result.append({"name": mname, **m, "key": mname})
         return result
 
     def get_default_model(self) -> Optional[Dict[str, Any]]:
@@ -44,8 +45,8 @@ class ModelRegistry:
         for fb in fallbacks:
             m = self.get_model(fb)
             if m:
-                return {"name": fb, **m}
+                return {"name": fb, **m, "key": fb}
         # otherwise first in models
         for mname, m in self.models.items():
-            return {"name": mname, **m}
+            return {"name": mname, **m, "key": mname}
         return None
@@ -0,0 +1,173 @@
+from __future__ import annotations
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from .registry import ModelRegistry
+from .policy import RoutingPolicy
+from .smart_router import SmartRouter
+
+logger = logging.getLogger(__name__)
+
+# Provider "type" values main.py knows how to build an adapter for
+PROVIDER_TYPES = {"openrouter", "openai_compat"}
+
+
+class RouterSnapshot:
+    """Immutable view of one loaded (models.yml, routing.yml) pair.
+
+    Requests grab a snapshot once and use it until they finish, so a reload
+    never changes routing underneath an in-flight request.
+    """
+
+    def __init__(self, registry: ModelRegistry, policy: RoutingPolicy, version: str, generation: int):
+        self.registry = registry
+        self.policy = policy
+        self.router = SmartRouter(registry=registry, policy=policy)
+        self.version = version
+        self.generation = generation
+        self.loaded_at = time.time()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "generation": self.generation,
+            "loaded_at": self.loaded_at,
+            "models": len(self.registry.models),
+            "rules": len(self.policy.rules),
+        }
+
+
+def _file_version(paths: List[str]) -> str:
+    h = hashlib.sha256()
+    for p in paths:
+        with open(p, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:12]
+
+
+def validate_config(registry: ModelRegistry, policy: RoutingPolicy) -> List[str]:
+    """Return a list of problems; empty when the pair is safe to serve."""
+    errors: List[str] = []
+    if not registry.models:
+        errors.append("models.yml defines no models")
+    for name, p in registry.providers.items():
+        if (p or {}).get("type", name) not in PROVIDER_TYPES:
+            errors.append(f"provider '{name}' has unsupported type '{(p or {}).get('type')}'")
+    for key, m in registry.models.items():
+        if m.get("provider") not in registry.providers:
+            errors.append(f"model '{key}' references unknown provider '{m.get('provider')}'")
+        if not m.get("name"):
+            errors.append(f"model '{key}' has no remote name")
+    for fb in registry.defaults.get("fallbacks", []):
+        if fb not in registry.models:
+            errors.append(f"default fallback '{fb}' is not a known model")
+    for rule in policy.rules:
+        name = rule.get("name", "unknown")
+        choice = rule.get("choose")
+        if choice not in registry.models:
+            errors.append(f"rule '{name}' chooses unknown model '{choice}'")
+        when = rule.get("when") or {}
+        if not isinstance(when, dict) or not ({"all", "any"} & set(when)):
+            errors.append(f"rule '{name}' needs an 'all' or 'any' block under 'when'")
+    return errors
+
+
+class RouterStore:
+    """Holds the current RouterSnapshot and swaps it atomically on reload.
+
+    Reloads re-read and validate both YAML files; an invalid config is
+    rejected and the previous snapshot keeps serving.
+    """
+
+    def __init__(self, portfolio_path: str = "config/models.yml", routing_path: str = "config/routing.yml"):
+        self.portfolio_path = portfolio_path
+        self.routing_path = routing_path
+        self._listeners: List[Callable[[RouterSnapshot], None]] = []
+        self._lock = asyncio.Lock()
+        self._stamp = self._stat()
+        self._snapshot = self._build(generation=1)
+
+    def current(self) -> RouterSnapshot:
+        return self._snapshot
+
+    def add_listener(self, fn: Callable[[RouterSnapshot], None]) -> None:
+        """Register a callback invoked with the new snapshot after each swap."""
+        self._listeners.append(fn)
+
+    def _stat(self) -> tuple:
+        out = []
+        for p in (self.portfolio_path, self.routing_path):
+            try:
+                st = os.stat(p)
+                out.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+    def _build(self, generation: int) -> RouterSnapshot:
+        registry = ModelRegistry(portfolio_path=self.portfolio_path)
+        policy = RoutingPolicy(routing_path=self.routing_path)
+        errors = validate_config(registry, policy)
+        if errors:
+            raise ValueError("; ".join(errors))
+        version = _file_version([self.portfolio_path, self.routing_path])
+        return RouterSnapshot(registry, policy, version=version, generation=generation)
+
+    async def reload(self) -> Dict[str, Any]:
+        """Re-read both files and swap in a new snapshot if they validate."""
+        async with self._lock:
+            previous = self._snapshot
+            self._stamp = self._stat()
+            snapshot = self._build(generation=previous.generation + 1)
+            if snapshot.version == previous.version:
+                return {"changed": False, **previous.describe()}
+            self._snapshot = snapshot
+            for fn in self._listeners:
+                try:
+                    fn(snapshot)
+                except Exception as e:
+                    logger.warning(f"Router reload listener failed: {e}")
+            logger.info(f"Router config reloaded: {previous.version} -> {snapshot.version}")
+            return {"changed": True, "previous_version": previous.version, **snapshot.describe()}
+
+    async def follow(self, published: Callable[[], Awaitable[Optional[str]]], interval: float) -> None:
+        """Reload whenever ``published()`` names a version other than the one serving.
+
+        Lets a reload requested on one worker reach the others. Each published
+        version is attempted once, so a worker whose files differ does not
+        reload in a loop.
+        """
+        attempted: Optional[str] = None
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                version = await published()
+            except Exception as e:
+                logger.warning(f"Router version check failed: {e}")
+                continue
+            if not version or version == self._snapshot.version or version == attempted:
+                continue
+            attempted = version
+            try:
+                res = await self.reload()
+                if res["version"] != version:
+                    logger.warning(f"Router reload for published {version} loaded {res['version']}")
+            except Exception as e:
+                logger.error(f"Router config reload rejected, keeping {self._snapshot.version}: {e}")
+
+    async def watch(self, interval: float) -> None:
+        """Poll file stats and reload when either file changes."""
+        while True:
+            await asyncio.sleep(interval)
+            if self._stat() == self._stamp:
+                continue
+            try:
+                await self.reload()
+            except Exception as e:
+                # Keep serving the old snapshot; retry on the next change.
+                self._stamp = self._stat()
+                logger.error(f"Router config reload rejected, keeping {self._snapshot.version}: {e}")
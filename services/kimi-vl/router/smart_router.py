@@ -32,10 +32,8 @@ class SmartRouter:
             }
         # fallback
         m = self.registry.get_default_model() or {}
-        # NOTE: registry.get_default_model returns {"name": <remote_model>} so we need key
-        # We can't recover portfolio key here easily; mark as default
         return {
-            "portfolio_key": "<default>",
+            "portfolio_key": m.get("key", "<default>"),
             "provider": m.get("provider"),
             "model_name": m.get("name"),
             "rule": "default",
@@ -0,0 +1,230 @@
+"""
+JSON Schemas for the extraction tasks, a validator for model replies and
+output-token budgets.
+
+Each (task, doc type) has one schema. Models with the ``structured_output``
+capability in config/models.yml get it as an OpenAI-style ``response_format``
+(strict json_schema), so they return bare, compact JSON in the right shape.
+Other models still get the prose prompt. Every reply is validated against
+the schema either way, so a malformed reply fails that one call instead of
+reaching the merge.
+
+Strict mode requires every property to be listed in ``required`` and
+``additionalProperties: false``; missing values are expressed as null.
+
+``max_tokens`` is sized from the expected number of rows instead of being
+left to the provider default, which caps runaway output and lets the
+provider schedule the request as a short one.
+"""
+
+import math
+from typing import Any, Dict, List, Optional
+
+HEADER_TASK = "header_extraction"
+LINE_ITEMS_TASK = "line_items"
+DOCUMENT_TASK = "document"
+
+# Output-token budget: JSON envelope + per-row cost, with headroom for long
+# descriptions. A compact invoice row is ~45 tokens.
+HEADER_MAX_TOKENS = 400
+ENVELOPE_TOKENS = 40
+ROW_TOKENS = 60
+HEADROOM = 1.5
+MIN_ROWS = 5
+
+_STR = {"type": ["string", "null"]}
+_NUM = {"type": ["number", "null"]}
+
+
+def _obj(properties: Dict[str, Any], nullable: bool = False) -> Dict[str, Any]:
+    return {
+        "type": ["object", "null"] if nullable else "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+_PARTY = _obj({"name": _STR, "address": _STR}, nullable=True)
+
+HEADER_FIELDS: Dict[str, Dict[str, Any]] = {
+    "invoice": {
+        "invoice_number": _STR, "invoice_date": _STR, "buyer": _PARTY, "seller": _PARTY,
+        "total_amount": _NUM, "total_currency": _STR,
+    },
+    "packing_list": {
+        "invoice_number": _STR, "invoice_date": _STR, "buyer": _PARTY, "seller": _PARTY,
+        "total_packages": _NUM, "total_net_weight": _NUM, "total_gross_weight": _NUM, "weight_unit": _STR,
+    },
+    "certificate": {
+        "certificate_type": _STR, "certificate_number": _STR, "issue_date": _STR,
+        "exporter": _PARTY, "consignee": _PARTY, "country_of_origin": _STR, "invoice_number": _STR,
+    },
+}
+
+ROW_FIELDS: Dict[str, Dict[str, Any]] = {
+    "invoice": {
+        "model_code": _STR, "goods_description": _STR, "quantity": _NUM, "unit_price": _NUM, "amount": _NUM,
+    },
+    "packing_list": {
+        "model_code": _STR, "goods_description": _STR, "quantity": _NUM,
+        "packages": _NUM, "net_weight": _NUM, "gross_weight": _NUM,
+    },
+    "certificate": {
+        "goods_description": _STR, "hs_code": _STR, "quantity": _NUM, "gross_weight": _NUM,
+    },
+}
+
+# Whole-document extraction (OpenRouterProcessor on /process)
+DOCUMENT_EXTRA_FIELDS = {
+    "po_number": _STR, "consignee": _PARTY, "delivery_and_payment_term": _STR, "country_of_origin": _STR,
+}
+
+
+def _fields(table: Dict[str, Dict[str, Any]], doc_type: str) -> Dict[str, Any]:
+    return table.get(doc_type) or table["invoice"]
+
+
+def _line_items(doc_type: str) -> Dict[str, Any]:
+    return {"type": "array", "items": _obj(_fields(ROW_FIELDS, doc_type))}
+
+
+def schema_for(task: str, doc_type: str = "invoice") -> Dict[str, Any]:
+    if task == HEADER_TASK:
+        return _obj(_fields(HEADER_FIELDS, doc_type))
+    if task == LINE_ITEMS_TASK:
+        return _obj({"line_items": _line_items(doc_type)})
+    if task == DOCUMENT_TASK:
+        return _obj({
+            **_fields(HEADER_FIELDS, doc_type),
+            **(DOCUMENT_EXTRA_FIELDS if doc_type == "invoice" else {}),
+            "line_items": _line_items(doc_type),
+        })
+    raise ValueError(f"unknown extraction task '{task}'")
+
+
+def response_format(task: str, doc_type: str = "invoice") -> Dict[str, Any]:
+    """OpenAI-compatible ``response_format`` for strict structured output."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": f"{doc_type}_{task}", "strict": True, "schema": schema_for(task, doc_type)},
+    }
+
+
+def max_tokens_for(task: str, expected_rows: Optional[float] = None, cap: Optional[int] = None) -> int:
+    """Output-token budget for one call; ``cap`` is the model's tokens.max_output."""
+    rows = max(MIN_ROWS, float(expected_rows or 0))
+    if task == HEADER_TASK:
+        budget = HEADER_MAX_TOKENS
+    elif task == DOCUMENT_TASK:
+        budget = HEADER_MAX_TOKENS + math.ceil(rows * ROW_TOKENS * HEADROOM)
+    else:
+        budget = ENVELOPE_TOKENS + math.ceil(rows * ROW_TOKENS * HEADROOM)
+    return min(budget, int(cap)) if cap else budget
+
+
+def _type_ok(value: Any, expected: str) -> bool:
+    if expected == "null":
+        return value is None
+    if expected == "object":
+        return isinstance(value, dict)
+    if expected == "array":
+        return isinstance(value, list)
+    if expected == "string":
+        return isinstance(value, str)
+    if expected == "number":
+        if isinstance(value, bool):
+            return False
+        if isinstance(value, (int, float)):
+            return True
+        # Prompt-only models often quote numbers ("1,250.00"); downstream
+        # parsing (router.cascade._num) accepts them, so the schema does too.
+        if isinstance(value, str):
+            try:
+                float(value.replace(",", "").strip())
+                return True
+            except ValueError:
+                return False
+        return False
+    if expected == "boolean":
+        return isinstance(value, bool)
+    return True
+
+
+def validate(instance: Any, schema: Dict[str, Any], path: str = "$", allow_missing: bool = False) -> List[str]:
+    """Errors for ``instance`` against the schema subset used here; empty when valid.
+
+    Unknown extra keys are tolerated; wrong container types and non-numeric
+    numbers are errors. Missing keys are errors unless ``allow_missing``,
+    which suits prompt-only replies where an omitted field means null.
+    """
+    errors: List[str] = []
+    types = schema.get("type")
+    if types is not None:
+        types = types if isinstance(types, list) else [types]
+        if not any(_type_ok(instance, t) for t in types):
+            return [f"{path}: expected {'/'.join(types)}, got {type(instance).__name__}"]
+    if isinstance(instance, dict) and "properties" in schema:
+        for key in [] if allow_missing else schema.get("required", []):
+            if key not in instance:
+                errors.append(f"{path}.{key}: missing")
+        for key, sub in schema["properties"].items():
+            if key in instance:
+                errors.extend(validate(instance[key], sub, f"{path}.{key}", allow_missing))
+    if isinstance(instance, list) and "items" in schema:
+        for i, item in enumerate(instance):
+            errors.extend(validate(item, schema["items"], f"{path}[{i}]", allow_missing))
+    return errors
+
+
+class SchemaViolation(ValueError):
+    """A model reply parsed as JSON but does not match the task schema."""
+
+    def __init__(self, task: str, errors: List[str]):
+        self.errors = errors
+        more = f" (+{len(errors) - 3} more)" if len(errors) > 3 else ""
+        super().__init__(f"{task} reply violates schema: {'; '.join(errors[:3])}{more}")
+
+
+class OutputStats:
+    """Per-model output tokens, truncations and schema failures (this worker)."""
+
+    def __init__(self) -> None:
+        self.models: Dict[str, Dict[str, float]] = {}
+
+    def add(
+        self,
+        model_key: str,
+        structured: bool,
+        completion_tokens: Optional[int],
+        latency_ms: float,
+        outcome: str,
+    ) -> None:
+        m = self.models.setdefault(model_key, {
+            "calls": 0, "structured_calls": 0, "completion_tokens": 0, "token_reports": 0,
+            "latency_ms": 0.0, "ok": 0, "truncated": 0, "schema_invalid": 0, "parse_error": 0,
+        })
+        m["calls"] += 1
+        m["structured_calls"] += 1 if structured else 0
+        if completion_tokens is not None:
+            m["completion_tokens"] += completion_tokens
+            m["token_reports"] += 1
+        m["latency_ms"] += latency_ms
+        m[outcome] = m.get(outcome, 0) + 1
+
+    def describe(self) -> Dict[str, Any]:
+        out = {}
+        for key, m in self.models.items():
+            out[key] = {
+                "calls": m["calls"],
+                "structured_calls": m["structured_calls"],
+                "avg_completion_tokens": round(m["completion_tokens"] / m["token_reports"], 1) if m["token_reports"] else None,
+                "avg_latency_ms": round(m["latency_ms"] / m["calls"], 1),
+                "truncated": m["truncated"],
+                "schema_invalid": m["schema_invalid"],
+                "parse_error": m["parse_error"],
+            }
+        return out
+
+
+OUTPUT_STATS = OutputStats()
@@ -0,0 +1,306 @@
+"""
+Embedded search index over processed results (SQLite + FTS5).
+
+Every artifact written by ``save_processed_file`` is upserted here, so
+operators can look documents up by invoice number, PO, seller, buyer, date
+range and total (B-tree indexes) or by free text (FTS5) without walking
+``/processed`` or unnesting JSONB.
+
+Rebuild from existing artifacts:
+
+    python search_index.py rebuild --root /processed --db /processed/search_index.sqlite3
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from templates import parse_date
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    artifact TEXT NOT NULL UNIQUE,
+    filename TEXT,
+    saved_at TEXT,
+    invoice_number TEXT COLLATE NOCASE,
+    po_number TEXT COLLATE NOCASE,
+    seller_name TEXT COLLATE NOCASE,
+    buyer_name TEXT COLLATE NOCASE,
+    invoice_date TEXT,
+    total_amount REAL,
+    total_currency TEXT,
+    confidence REAL,
+    line_item_count INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_documents_invoice_number ON documents (invoice_number);
+CREATE INDEX IF NOT EXISTS idx_documents_po_number ON documents (po_number);
+CREATE INDEX IF NOT EXISTS idx_documents_seller_name ON documents (seller_name);
+CREATE INDEX IF NOT EXISTS idx_documents_buyer_name ON documents (buyer_name);
+CREATE INDEX IF NOT EXISTS idx_documents_invoice_date ON documents (invoice_date);
+CREATE INDEX IF NOT EXISTS idx_documents_total_amount ON documents (total_amount);
+CREATE INDEX IF NOT EXISTS idx_documents_saved_at ON documents (saved_at);
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    invoice_number, po_number, seller, buyer, body, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+RESULT_COLUMNS = [
+    "id", "artifact", "filename", "saved_at", "invoice_number", "po_number", "seller_name",
+    "buyer_name", "invoice_date", "total_amount", "total_currency", "confidence", "line_item_count",
+]
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None or value == "":
+        return None
+    return str(value).strip()
+
+
+def _num(value: Any) -> Optional[float]:
+    if value is None or value == "" or isinstance(value, bool):
+        return None
+    try:
+        return float(str(value).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def _iso_date(value: Any) -> Optional[str]:
+    """YYYY-MM-DD so date ranges compare correctly; None when unparseable."""
+    parsed = parse_date(value)
+    return parsed.isoformat() if parsed else None
+
+
+def _party(fields: Dict[str, Any], key: str) -> Tuple[Optional[str], str]:
+    party = fields.get(key)
+    if isinstance(party, dict):
+        return _text(party.get("name")), " ".join(str(v) for v in party.values() if v)
+    return _text(party), str(party or "")
+
+
+def _like_prefix(value: str) -> str:
+    """LIKE pattern matching ``value`` literally as a prefix (used with ESCAPE '\\')."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _is_result(value: Any) -> bool:
+    """True for an extraction result, as opposed to other JSON kept next to them."""
+    return isinstance(value, dict) and isinstance(value.get("extracted_fields"), dict)
+
+
+def _fts_query(q: str) -> Optional[str]:
+    """Turn free text into an FTS5 prefix query, dropping operator syntax."""
+    tokens = _TOKEN_RE.findall(q)
+    if not tokens:
+        return None
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+class DocumentIndex:
+    """SQLite-backed index; safe to share across threads (and worker processes via WAL)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+
+    def _upsert(self, artifact: str, filename: str, result: Dict[str, Any], saved_at: str) -> None:
+        fields = result.get("extracted_fields") or {}
+        seller, seller_text = _party(fields, "seller")
+        buyer, buyer_text = _party(fields, "buyer")
+        items = [r for r in (fields.get("line_items") or []) if isinstance(r, dict)]
+        body = " ".join(filter(None, [
+            filename,
+            seller_text,
+            buyer_text,
+            _party(fields, "consignee")[1],
+            *(f"{r.get('model_code') or ''} {r.get('goods_description') or ''}" for r in items),
+        ]))
+        row = (
+            artifact, filename, saved_at,
+            _text(fields.get("invoice_number")), _text(fields.get("po_number")), seller, buyer,
+            _iso_date(fields.get("invoice_date") or fields.get("date")),
+            _num(fields.get("total_amount")), _text(fields.get("total_currency") or fields.get("currency")),
+            _num(result.get("confidence")), len(items),
+        )
+        cur = self._conn.execute(
+            "INSERT INTO documents (artifact, filename, saved_at, invoice_number, po_number, seller_name, "
+            "buyer_name, invoice_date, total_amount, total_currency, confidence, line_item_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(artifact) DO UPDATE SET filename=excluded.filename, saved_at=excluded.saved_at, "
+            "invoice_number=excluded.invoice_number, po_number=excluded.po_number, seller_name=excluded.seller_name, "
+            "buyer_name=excluded.buyer_name, invoice_date=excluded.invoice_date, total_amount=excluded.total_amount, "
+            "total_currency=excluded.total_currency, confidence=excluded.confidence, "
+            "line_item_count=excluded.line_item_count "
+            "RETURNING id",
+            row,
+        )
+        doc_id = cur.fetchone()[0]
+        self._conn.execute("DELETE FROM documents_fts WHERE rowid = ?", (doc_id,))
+        self._conn.execute(
+            "INSERT INTO documents_fts (rowid, invoice_number, po_number, seller, buyer, body) VALUES (?, ?, ?, ?, ?, ?)",
+            (doc_id, row[3] or "", row[4] or "", seller_text, buyer_text, body),
+        )
+
+    def index_result(self, artifact: str, filename: str, result: Dict[str, Any], saved_at: Optional[str] = None) -> None:
+        """Insert or update one processed result (blocking; call via asyncio.to_thread)."""
+        saved_at = saved_at or time.strftime("%Y-%m-%dT%H:%M:%S")
+        with self._lock, self._conn:
+            self._upsert(artifact, filename, result, saved_at)
+
+    def search(
+        self,
+        q: Optional[str] = None,
+        invoice_number: Optional[str] = None,
+        po_number: Optional[str] = None,
+        seller: Optional[str] = None,
+        buyer: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        total_min: Optional[float] = None,
+        total_max: Optional[float] = None,
+        limit: int = 20,
+        offset: int = 0,
+    ) -> Dict[str, Any]:
+        """Filter documents; exact/prefix lookups use the B-tree indexes, ``q`` uses FTS5."""
+        where: List[str] = []
+        params: List[Any] = []
+        if invoice_number:
+            where.append("d.invoice_number = ?")
+            params.append(invoice_number)
+        if po_number:
+            where.append("d.po_number = ?")
+            params.append(po_number)
+        if seller:
+            where.append("d.seller_name LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(seller))
+        if buyer:
+            where.append("d.buyer_name LIKE ? ESCAPE '\\'")
+            params.append(_like_prefix(buyer))
+        if date_from:
+            where.append("d.invoice_date >= ?")
+            params.append(_iso_date(date_from) or date_from)
+        if date_to:
+            where.append("d.invoice_date <= ?")
+            params.append(_iso_date(date_to) or date_to)
+        if total_min is not None:
+            where.append("d.total_amount >= ?")
+            params.append(total_min)
+        if total_max is not None:
+            where.append("d.total_amount <= ?")
+            params.append(total_max)
+        limit = max(1, min(int(limit), 200))
+        offset = max(0, int(offset))
+        if q:
+            match = _fts_query(q)
+            if match is None:
+                # Nothing searchable (e.g. only punctuation); matches no document
+                return {"items": [], "limit": limit, "offset": offset, "has_more": False, "next_offset": None, "query_ms": 0.0}
+            where.append("d.id IN (SELECT rowid FROM documents_fts WHERE documents_fts MATCH ?)")
+            params.append(match)
+
+        sql = f"SELECT {', '.join('d.' + c for c in RESULT_COLUMNS)} FROM documents d"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # Fetch one extra row to know whether another page exists without COUNT(*).
+        sql += " ORDER BY d.saved_at DESC, d.id DESC LIMIT ? OFFSET ?"
+        started = time.perf_counter()
+        with self._lock:
+            rows = self._conn.execute(sql, [*params, limit + 1, offset]).fetchall()
+        items = [dict(r) for r in rows[:limit]]
+        has_more = len(rows) > limit
+        return {
+            "items": items,
+            "limit": limit,
+            "offset": offset,
+            "has_more": has_more,
+            "next_offset": offset + limit if has_more else None,
+            "query_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def rebuild(self, root: str) -> int:
+        """Re-index every result under ``root`` (``<dir>/output.json`` or flat ``*.json``).
+        JSON files that are not extraction results (e.g. templates.json) are skipped."""
+        n = 0
+        with self._lock, self._conn:
+            for artifact, filename, result, saved_at in iter_artifacts(root):
+                self._upsert(artifact, filename, result, saved_at)
+                n += 1
+        return n
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def iter_artifacts(root: str) -> Iterator[Tuple[str, str, Dict[str, Any], str]]:
+    """Yield (artifact, filename, result, saved_at) for processed results under ``root``."""
+    if not os.path.isdir(root):
+        return
+    for entry in sorted(os.scandir(root), key=lambda e: e.name):
+        try:
+            if entry.is_dir():
+                output = os.path.join(entry.path, "output.json")
+                if not os.path.exists(output):
+                    continue
+                with open(output, "r", encoding="utf-8") as f:
+                    result = json.load(f)
+                if not _is_result(result):
+                    continue
+                meta: Dict[str, Any] = {}
+                meta_path = os.path.join(entry.path, "metadata.json")
+                if os.path.exists(meta_path):
+                    with open(meta_path, "r", encoding="utf-8") as f:
+                        meta = json.load(f)
+                filename = meta.get("filename") or entry.name.split("__", 1)[-1]
+                saved_at = meta.get("saved_at") or time.strftime(
+                    "%Y-%m-%dT%H:%M:%S", time.localtime(os.path.getmtime(output)))
+                yield entry.path, filename, result, saved_at
+            elif entry.is_file() and entry.name.endswith(".json"):
+                with open(entry.path, "r", encoding="utf-8") as f:
+                    result = json.load(f)
+                if not _is_result(result):
+                    continue
+                saved_at = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(entry.stat().st_mtime))
+                yield entry.path, entry.name[:-len(".json")], result, saved_at
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable artifact {entry.path}: {e}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage the processed-document search index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rb = sub.add_parser("rebuild", help="index all existing artifacts")
+    rb.add_argument("--root", default=os.getenv("PROCESSED_DIR", "/processed"))
+    rb.add_argument("--db", default=os.getenv("SEARCH_INDEX_PATH", "/processed/search_index.sqlite3"))
+    args = parser.parse_args()
+
+    index = DocumentIndex(args.db)
+    started = time.perf_counter()
+    count = index.rebuild(args.root)
+    logger.info(f"Indexed {count} artifacts from {args.root} in {time.perf_counter() - started:.2f}s "
+                f"({index.count()} documents in {args.db})")
+    index.close()
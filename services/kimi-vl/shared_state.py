@@ -0,0 +1,223 @@
+"""
+State shared by all API workers: result cache, per-model latency/health
+statistics, rate-limiter counters and the published router config version.
+
+With REDIS_URL set every worker talks to the Redis instance docker-compose
+already runs, so N workers behave as one service. Without it an in-process
+backend is used, which is only correct for a single worker.
+"""
+
+import json
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+try:
+    import redis.asyncio as aioredis  # type: ignore
+except Exception:  # pragma: no cover - optional dep
+    aioredis = None  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "beyan:"
+# Number of recent calls per model kept for latency/error statistics
+STATS_WINDOW = 200
+# Most recent calls used for the "recent_*" figures that react to outages
+RECENT_WINDOW = 20
+
+
+def _summarize(samples: Any, calls: int) -> Dict[str, Any]:
+    """``samples`` is (latency_ms, ok) pairs, oldest first."""
+    samples = list(samples)
+    lat = sorted(s[0] for s in samples)
+    errors = sum(1 for s in samples if not s[1])
+    n = len(lat)
+    recent = samples[-RECENT_WINDOW:]
+    r = len(recent)
+    return {
+        "calls": calls,
+        "window": n,
+        "error_rate": round(errors / n, 3) if n else 0.0,
+        "avg_latency_ms": round(sum(lat) / n, 1) if n else None,
+        "p95_latency_ms": round(lat[min(n - 1, int(n * 0.95))], 1) if n else None,
+        "recent_window": r,
+        "recent_error_rate": round(sum(1 for s in recent if not s[1]) / r, 3) if r else 0.0,
+        "recent_avg_latency_ms": round(sum(s[0] for s in recent) / r, 1) if r else None,
+    }
+
+
+class MemoryBackend:
+    """Per-process fallback; fine for a single worker or local development."""
+    name = "memory"
+
+    def __init__(self) -> None:
+        self._cache: Dict[str, Tuple[float, str]] = {}
+        self._samples: Dict[str, Deque[Tuple[float, bool]]] = {}
+        self._calls: Dict[str, int] = {}
+        self._counters: Dict[str, Tuple[float, int]] = {}
+        self._values: Dict[str, str] = {}
+
+    async def cache_get(self, key: str) -> Optional[str]:
+        item = self._cache.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.time():
+            self._cache.pop(key, None)
+            return None
+        return value
+
+    async def cache_set(self, key: str, value: str, ttl: int) -> None:
+        self._cache[key] = (time.time() + ttl, value)
+
+    async def record_call(self, model_key: str, latency_ms: float, ok: bool) -> None:
+        self._samples.setdefault(model_key, deque(maxlen=STATS_WINDOW)).append((latency_ms, ok))
+        self._calls[model_key] = self._calls.get(model_key, 0) + 1
+
+    async def model_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {k: _summarize(v, self._calls.get(k, 0)) for k, v in self._samples.items()}
+
+    async def incr_window(self, key: str, window_s: int) -> int:
+        now = time.time()
+        expires, count = self._counters.get(key, (0.0, 0))
+        if expires < now:
+            expires, count = now + window_s, 0
+        count += 1
+        self._counters[key] = (expires, count)
+        return count
+
+    async def set_value(self, key: str, value: str) -> None:
+        self._values[key] = value
+
+    async def get_value(self, key: str) -> Optional[str]:
+        return self._values.get(key)
+
+
+class RedisBackend:
+    """Redis-backed state shared across worker processes (and pods)."""
+    name = "redis"
+
+    def __init__(self, url: str) -> None:
+        if aioredis is None:
+            raise RuntimeError("redis package is not installed")
+        self.client = aioredis.from_url(url, decode_responses=True)
+
+    async def cache_get(self, key: str) -> Optional[str]:
+        return await self.client.get(f"{KEY_PREFIX}cache:{key}")
+
+    async def cache_set(self, key: str, value: str, ttl: int) -> None:
+        await self.client.set(f"{KEY_PREFIX}cache:{key}", value, ex=ttl)
+
+    async def record_call(self, model_key: str, latency_ms: float, ok: bool) -> None:
+        lkey = f"{KEY_PREFIX}model:{model_key}:samples"
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.lpush(lkey, f"{latency_ms:.1f}|{1 if ok else 0}")
+            pipe.ltrim(lkey, 0, STATS_WINDOW - 1)
+            pipe.incr(f"{KEY_PREFIX}model:{model_key}:calls")
+            await pipe.execute()
+
+    async def model_stats(self) -> Dict[str, Dict[str, Any]]:
+        out: Dict[str, Dict[str, Any]] = {}
+        async for lkey in self.client.scan_iter(match=f"{KEY_PREFIX}model:*:samples"):
+            model_key = lkey[len(f"{KEY_PREFIX}model:"):-len(":samples")]
+            raw = await self.client.lrange(lkey, 0, -1)
+            calls = int(await self.client.get(f"{KEY_PREFIX}model:{model_key}:calls") or 0)
+            samples = []
+            for item in reversed(raw):  # lpush keeps the newest first
+                lat, ok = item.split("|", 1)
+                samples.append((float(lat), ok == "1"))
+            out[model_key] = _summarize(samples, calls)
+        return out
+
+    async def incr_window(self, key: str, window_s: int) -> int:
+        rkey = f"{KEY_PREFIX}rl:{key}:{int(time.time() // window_s)}"
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incr(rkey)
+            pipe.expire(rkey, window_s)
+            count, _ = await pipe.execute()
+        return int(count)
+
+    async def set_value(self, key: str, value: str) -> None:
+        await self.client.set(f"{KEY_PREFIX}value:{key}", value)
+
+    async def get_value(self, key: str) -> Optional[str]:
+        return await self.client.get(f"{KEY_PREFIX}value:{key}")
+
+
+class SharedState:
+    """Facade used by the API; never lets a backend failure fail a request."""
+
+    def __init__(self, backend: Any, cache_ttl: int = 0):
+        self.backend = backend
+        self.cache_ttl = cache_ttl
+
+    @classmethod
+    def from_env(cls, redis_url: Optional[str], cache_ttl: int) -> "SharedState":
+        if redis_url:
+            try:
+                return cls(RedisBackend(redis_url), cache_ttl)
+            except Exception as e:
+                logger.warning(f"Shared state falling back to in-process memory: {e}")
+        return cls(MemoryBackend(), cache_ttl)
+
+    async def get_result(self, key: str) -> Optional[Dict[str, Any]]:
+        if self.cache_ttl <= 0:
+            return None
+        try:
+            raw = await self.backend.cache_get(key)
+            return json.loads(raw) if raw else None
+        except Exception as e:
+            logger.warning(f"Result cache read failed: {e}")
+            return None
+
+    async def put_result(self, key: str, result: Dict[str, Any]) -> None:
+        if self.cache_ttl <= 0:
+            return
+        try:
+            await self.backend.cache_set(key, json.dumps(result, ensure_ascii=False), self.cache_ttl)
+        except Exception as e:
+            logger.warning(f"Result cache write failed: {e}")
+
+    async def record_model_call(self, model_key: str, latency_ms: float, ok: bool) -> None:
+        try:
+            await self.backend.record_call(model_key, latency_ms, ok)
+        except Exception as e:
+            logger.warning(f"Model stats update failed: {e}")
+
+    async def model_stats(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            return await self.backend.model_stats()
+        except Exception as e:
+            logger.warning(f"Model stats read failed: {e}")
+            return {}
+
+    async def check_rate_limit(self, client_key: str, limit: int, window_s: int = 60) -> Tuple[bool, int]:
+        """Fixed-window limiter. Returns (allowed, retry_after_seconds)."""
+        if limit <= 0:
+            return True, 0
+        try:
+            count = await self.backend.incr_window(client_key, window_s)
+        except Exception as e:
+            logger.warning(f"Rate limiter unavailable, allowing request: {e}")
+            return True, 0
+        if count > limit:
+            return False, max(1, int(window_s - time.time() % window_s))
+        return True, 0
+
+    async def publish_config_version(self, name: str, version: str) -> None:
+        """Announce the config version every worker should be serving."""
+        try:
+            await self.backend.set_value(f"config:{name}", version)
+        except Exception as e:
+            logger.warning(f"Config version publish failed: {e}")
+
+    async def config_version(self, name: str) -> Optional[str]:
+        try:
+            return await self.backend.get_value(f"config:{name}")
+        except Exception as e:
+            logger.warning(f"Config version read failed: {e}")
+            return None
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.backend.name, "result_cache_ttl": self.cache_ttl}
@@ -0,0 +1,834 @@
+"""
+Learned supplier templates for repeat invoice layouts.
+
+Most volume comes from a few dozen suppliers whose invoices share one
+layout. For PDFs with a text layer we learn, per layout:
+
+- a fingerprint: label-like words in the top of page 1 with quantized
+  positions. Matching is containment of the template's anchors in the
+  document, and anchors that vary between documents (buyer names, dates)
+  are dropped as more documents confirm the template.
+- header fields: where each value sits, either after a label on the same
+  line (survives totals moving down with longer tables) or at a fixed
+  position.
+- table columns: the x-range of each line-item column and on which line
+  (relative to the numeric row) text columns such as the description sit.
+
+Templates are learned from validated model extractions and from reviewer
+corrections. A match is extracted deterministically in milliseconds and
+checked with the same arithmetic gates as the cascade. Documents that fail
+the match or the checks go to the models as before.
+
+Learn from a corrected document:
+
+    python templates.py learn --pdf invoice.pdf --fields corrected.json
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import statistics
+import threading
+import time
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from decoding import FITZ_LOCK
+from router.cascade import check_line_items, check_total
+
+logger = logging.getLogger(__name__)
+
+# (x0, y0, x1, y1, text), coordinates relative to the page size
+Word = Tuple[float, float, float, float, str]
+Line = List[Word]
+
+MIN_WORDS = 30            # fewer words on page 1 means a scan, not a text PDF
+GRID = 50                 # anchor quantization (cells per page side)
+ANCHOR_REGION = 0.45      # anchors come from the top part of page 1
+MIN_ANCHORS = 8
+X_TOL = 0.03
+Y_TOL = 0.012
+WORD_GAP = 0.02           # max gap between words of one value
+TOLERANCE = 0.02          # arithmetic checks, same default as the cascade
+# Per-template stats that are counts; workers' increments are summed on save
+_COUNTED_STATS = ("hits", "rejected", "corrections", "checked_fields", "correct_fields")
+
+HEADER_FIELDS = {
+    "invoice_number": "text",
+    "invoice_date": "date",
+    "total_amount": "number",
+    "total_currency": "text",
+    "seller.name": "name",
+    "buyer.name": "name",
+}
+LINE_COLUMNS = {
+    "model_code": "text",
+    "goods_description": "text",
+    "quantity": "number",
+    "unit_price": "number",
+    "amount": "number",
+}
+DATE_FORMATS = [
+    "%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d.%m.%y",
+    "%d.%b.%Y", "%d-%b-%Y", "%d %b %Y", "%d %B %Y", "%B %d, %Y", "%b %d, %Y", "%b. %d, %Y",
+]
+
+_NUMBER_RE = re.compile(r"^[-+]?\d[\d.,]*$")
+_STRIP = "()$€£¥₺:;*"
+
+
+def _norm(text: str) -> str:
+    return re.sub(r"[^0-9a-z]+", "", text.lower())
+
+
+def parse_number(token: str, decimal: str = ".") -> Optional[float]:
+    """Parse ``1,234.50`` (decimal '.') or ``1.234,50`` (decimal ',')."""
+    t = token.strip().strip(_STRIP)
+    if not _NUMBER_RE.match(t):
+        return None
+    t = t.replace("," if decimal == "." else ".", "")
+    if decimal == ",":
+        t = t.replace(",", ".")
+    try:
+        return float(t)
+    except ValueError:
+        return None
+
+
+def _as_float(value: Any) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    num = parse_number(str(value), ".")
+    return num if num is not None else parse_number(str(value), ",")
+
+
+def _close(a: float, b: float) -> bool:
+    return abs(a - b) <= max(0.005, 0.001 * max(abs(a), abs(b)))
+
+
+def _as_date(value: Any) -> Optional[date]:
+    try:
+        return date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return None
+
+
+def parse_date(value: Any) -> Optional[date]:
+    """Parse an ISO date or any of DATE_FORMATS (e.g. ``05.03.2024``, ``March 5, 2024``)."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if not isinstance(value, str) or not value.strip():
+        return None
+    text = value.strip().strip(_STRIP)
+    parsed = _as_date(text)
+    if parsed is not None:
+        return parsed
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _get(fields: Dict[str, Any], path: str) -> Any:
+    cur: Any = fields
+    for part in path.split("."):
+        cur = cur.get(part) if isinstance(cur, dict) else None
+    return cur
+
+
+def page_words(pdf_bytes: bytes) -> Optional[List[List[Word]]]:
+    """Words per page from the PDF text layer; None for scans / non-PDFs."""
+    with FITZ_LOCK:
+        try:
+            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        except Exception:
+            return None
+        with doc:
+            pages = []
+            for page in doc:
+                w, h = page.rect.width or 1.0, page.rect.height or 1.0
+                pages.append([(x0 / w, y0 / h, x1 / w, y1 / h, t) for x0, y0, x1, y1, t, *_ in page.get_text("words")])
+    if not pages or len(pages[0]) < MIN_WORDS:
+        return None
+    return pages
+
+
+def _lines(words: List[Word]) -> List[Line]:
+    """Group words into visual lines by vertical center."""
+    if not words:
+        return []
+    tol = 0.35 * statistics.median(w[3] - w[1] for w in words)
+    lines: List[Line] = []
+    center = None
+    for w in sorted(words, key=lambda w: (w[1] + w[3]) / 2):
+        c = (w[1] + w[3]) / 2
+        if center is None or c - center > tol:
+            lines.append([])
+            center = c
+        lines[-1].append(w)
+    return [sorted(line, key=lambda w: w[0]) for line in lines]
+
+
+def _yc(line: Line) -> float:
+    return sum((w[1] + w[3]) / 2 for w in line) / len(line)
+
+
+def _anchors(words: List[Word], expand: bool = False) -> set:
+    keys = set()
+    for x0, y0, _, _, t in words:
+        n = _norm(t)
+        if y0 > ANCHOR_REGION or len(n) < 3 or not n.isalpha():
+            continue
+        gx, gy = round(x0 * GRID), round(y0 * GRID)
+        if expand:
+            keys.update(f"{n}@{gx + dx},{gy + dy}" for dx in (-1, 0, 1) for dy in (-1, 0, 1))
+        else:
+            keys.add(f"{n}@{gx},{gy}")
+    return keys
+
+
+# --- Learning ---------------------------------------------------------------
+
+def _value_matches(words: List[Word], kind: str, value: Any, decimal: str) -> Optional[str]:
+    """Return '' (or the date format) when ``words`` spell ``value``; None otherwise."""
+    text = " ".join(w[4] for w in words)
+    if kind == "number":
+        num = _as_float(value)
+        got = parse_number(words[0][4], decimal) if len(words) == 1 else None
+        return "" if num is not None and got is not None and _close(num, got) else None
+    if kind == "date":
+        want = _as_date(value)
+        for fmt in DATE_FORMATS:
+            try:
+                if want is not None and datetime.strptime(text.strip(_STRIP), fmt).date() == want:
+                    return fmt
+            except ValueError:
+                continue
+    target = _norm(str(value))
+    return "" if target and _norm(text) == target else None
+
+
+def _find(lines_by_page: List[List[Line]], kind: str, value: Any, decimal: str) -> List[Dict[str, Any]]:
+    """Every (page, line, span) where the value appears."""
+    hits = []
+    max_len = 1 if kind == "number" else (3 if kind == "date" else len(str(value).split()) + 3)
+    for p, lines in enumerate(lines_by_page):
+        for li, line in enumerate(lines):
+            for i in range(len(line)):
+                for j in range(i + 1, min(len(line), i + max_len) + 1):
+                    fmt = _value_matches(line[i:j], kind, value, decimal)
+                    if fmt is not None:
+                        hits.append({"page": p, "line": li, "start": i, "end": j, "format": fmt or None})
+                        break
+    return hits
+
+
+def _field_spec(lines_by_page: List[List[Line]], hit: Dict[str, Any], kind: str) -> Dict[str, Any]:
+    line = lines_by_page[hit["page"]][hit["line"]]
+    span = line[hit["start"]:hit["end"]]
+    # Label words directly in front of the value ("Invoice No: 123").
+    label: List[str] = []
+    right = span[0][0]
+    for w in reversed(line[:hit["start"]]):
+        if any(ch.isdigit() for ch in w[4]) or len(label) == 3 or right - w[2] > 0.05:
+            break
+        if _norm(w[4]):
+            label.insert(0, _norm(w[4]))
+        right = w[0]
+    # Otherwise the word that starts the line ("TOTAL  1,799 Piece  43,391.58").
+    head = _norm(line[0][4]) if hit["start"] > 0 else ""
+    last_page = len(lines_by_page) - 1
+    return {
+        "kind": kind,
+        "page": "first" if hit["page"] == 0 or last_page == 0 else "last",
+        "x0": span[0][0], "x1": span[-1][2],
+        "yc": _yc(span),
+        "nwords": len(span),
+        "align": "right" if kind == "number" else "left",
+        "label": label,
+        "line_key": head if head.isalpha() else None,
+        "format": hit.get("format"),
+    }
+
+
+def _learn_table(lines_by_page: List[List[Line]], rows: List[Dict[str, Any]], decimal: str) -> Optional[Dict[str, Any]]:
+    """Learn column x-ranges from the lines that carry each row's numbers."""
+    used = set()
+    spans: Dict[str, List[Tuple[float, float]]] = {c: [] for c in LINE_COLUMNS}
+    offsets: Dict[str, List[int]] = {c: [] for c in LINE_COLUMNS}
+    start_yc = None
+    for row in rows:
+        amount, qty = _as_float(row.get("amount")), _as_float(row.get("quantity"))
+        if amount is None:
+            continue
+        found = None
+        for p, lines in enumerate(lines_by_page):
+            for li, line in enumerate(lines):
+                if (p, li) in used:
+                    continue
+                nums = [parse_number(w[4], decimal) for w in line]
+                if any(n is not None and _close(n, amount) for n in nums) and (
+                        qty is None or any(n is not None and _close(n, qty) for n in nums)):
+                    found = (p, li)
+                    break
+            if found:
+                break
+        if not found:
+            continue
+        used.add(found)
+        p, li = found
+        if p == 0 and start_yc is None:
+            start_yc = _yc(lines_by_page[0][li])
+        for col, kind in LINE_COLUMNS.items():
+            if row.get(col) in (None, ""):
+                continue
+            for off in ((0,) if kind == "number" else (0, -1, 1)):
+                if not 0 <= li + off < len(lines_by_page[p]):
+                    continue
+                hits = _find([[lines_by_page[p][li + off]]], kind, row[col], decimal)
+                if not hits and kind == "text" and len(str(row[col])) >= 8:
+                    hits = _find_prefix(lines_by_page[p][li + off], str(row[col]))
+                if hits:
+                    span = lines_by_page[p][li + off][hits[0]["start"]:hits[0]["end"]]
+                    spans[col].append((span[0][0], span[-1][2]))
+                    offsets[col].append(off)
+                    break
+    if len(spans["amount"]) < max(1, int(0.6 * len(rows))):
+        return None
+    columns = {}
+    for col, xs in spans.items():
+        if len(xs) >= max(1, int(0.6 * len(spans["amount"]))):
+            columns[col] = {
+                "x0": min(x[0] for x in xs),
+                "x1": max(x[1] for x in xs),
+                "line_offset": max(set(offsets[col]), key=offsets[col].count),
+            }
+    return {"columns": columns, "start_yc": (start_yc or 0.0) - Y_TOL, "rows_learned": len(spans["amount"])}
+
+
+def _find_prefix(line: Line, value: str) -> List[Dict[str, Any]]:
+    """Longest span whose text is a prefix of ``value`` (wrapped descriptions)."""
+    target = _norm(value)
+    best = None
+    for i in range(len(line)):
+        acc = ""
+        for j in range(i, len(line)):
+            acc += _norm(line[j][4])
+            if not target.startswith(acc):
+                break
+            if len(acc) >= 0.5 * len(target) and (best is None or j + 1 - i > best[1] - best[0]):
+                best = (i, j + 1)
+    return [{"start": best[0], "end": best[1]}] if best else []
+
+
+def _pick(hits: List[Dict[str, Any]], field: str, chosen: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    if field == "total_amount":  # totals sit at the bottom
+        return max(hits, key=lambda h: (h["page"], h["line"]))
+    total = chosen.get("total_amount")
+    if field == "total_currency" and total is not None:
+        same_line = [h for h in hits if (h["page"], h["line"]) == (total["page"], total["line"])]
+        if same_line:
+            return min(same_line, key=lambda h: abs(h["start"] - total["end"]))
+    return min(hits, key=lambda h: (h["page"], h["line"]))
+
+
+def learn_template(pages: List[List[Word]], fields: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], str]:
+    """Build a template from one document and its (trusted) fields.
+
+    Returns (template, reason). Fields that do not reproduce on the source
+    document are dropped; the template is rejected when the line items do not.
+    """
+    lines_by_page = [_lines(p) for p in pages]
+    anchors = sorted(_anchors(pages[0]))
+    if len(anchors) < MIN_ANCHORS:
+        return None, "too few layout anchors"
+    rows = [r for r in fields.get("line_items") or [] if isinstance(r, dict)]
+    if not rows:
+        return None, "no line items to learn columns from"
+
+    best = None
+    for decimal in (".", ","):
+        table = _learn_table(lines_by_page, rows, decimal)
+        if table and (best is None or table["rows_learned"] > best[1]["rows_learned"]):
+            best = (decimal, table)
+    if best is None:
+        return None, "line item amounts not found in the text layer"
+    decimal, table = best
+
+    specs = {}
+    chosen: Dict[str, Dict[str, Any]] = {}
+    for field, kind in HEADER_FIELDS.items():
+        value = _get(fields, field)
+        if value in (None, ""):
+            continue
+        hits = _find(lines_by_page, kind, value, decimal)
+        if hits:
+            chosen[field] = _pick(hits, field, chosen)
+            specs[field] = _field_spec(lines_by_page, chosen[field], kind)
+
+    template = {
+        "id": "tpl-" + hashlib.sha1("|".join(anchors).encode("utf-8")).hexdigest()[:10],
+        "supplier": _get(fields, "seller.name"),
+        "anchors": anchors,
+        "decimal": decimal,
+        "fields": specs,
+        "table": table,
+    }
+    # Keep only what reproduces the trusted extraction on its own source.
+    got = apply_template(template, lines_by_page)
+    for field in list(specs):
+        if not _same(HEADER_FIELDS[field], _get(got, field), _get(fields, field)):
+            del specs[field]
+    if "total_amount" not in specs:
+        return None, "total_amount not found in the text layer"
+    if not _same_rows(got.get("line_items") or [], rows):
+        return None, "line items do not reproduce from learned columns"
+    return template, "ok"
+
+
+# --- Extraction -------------------------------------------------------------
+
+def _take(line: Line, start: int, spec: Dict[str, Any]) -> List[Word]:
+    if spec["kind"] != "name":
+        return line[start:start + spec["nwords"]]
+    out = [line[start]]
+    for w in line[start + 1:]:
+        if w[0] - out[-1][2] > WORD_GAP or len(out) >= 12:
+            break
+        out.append(w)
+    return out
+
+
+def _convert(words: List[Word], spec: Dict[str, Any], decimal: str) -> Any:
+    if not words:
+        return None
+    if spec["kind"] == "number":
+        for w in words:
+            n = parse_number(w[4], decimal)
+            if n is not None:
+                return n
+        return None
+    text = " ".join(w[4] for w in words)
+    if spec["kind"] == "date":
+        try:
+            return datetime.strptime(text.strip(_STRIP), spec["format"]).date().isoformat()
+        except (TypeError, ValueError):
+            return None
+    return text
+
+
+def _extract_field(spec: Dict[str, Any], lines_by_page: List[List[Line]], decimal: str) -> Any:
+    lines = lines_by_page[0 if spec["page"] == "first" else -1]
+    label = spec.get("label") or []
+    if label:
+        # Label on the same line: follows the value when rows push it down.
+        found = []
+        for line in lines:
+            norms = [_norm(w[4]) for w in line]
+            for i in range(len(norms) - len(label) + 1):
+                if norms[i:i + len(label)] == label and i + len(label) < len(line):
+                    found.append((abs(_yc(line) - spec["yc"]), line, i + len(label)))
+        for _, line, start in sorted(found, key=lambda f: f[0]):
+            value = _convert(_take(line, start, spec), spec, decimal)
+            if value is not None:
+                return value
+    key = spec.get("line_key")
+    keyed = [line for line in lines if key and _norm(line[0][4]) == key]
+    positioned = [line for line in lines if abs(_yc(line) - spec["yc"]) <= Y_TOL]
+    by_distance = lambda l: abs(_yc(l) - spec["yc"])  # noqa: E731
+    for line in sorted(keyed, key=by_distance) + sorted(positioned, key=by_distance):
+        for i, w in enumerate(line):
+            edge = (w[2], spec["x1"]) if spec["align"] == "right" else (w[0], spec["x0"])
+            if abs(edge[0] - edge[1]) <= X_TOL:
+                if spec["align"] == "right":
+                    i = max(0, i - spec["nwords"] + 1)
+                value = _convert(_take(line, i, spec), spec, decimal)
+                if value is not None:
+                    return value
+    return None
+
+
+def _cells(line: Line, columns: Dict[str, Dict[str, Any]]) -> Dict[str, List[Word]]:
+    cells: Dict[str, List[Word]] = {}
+    for w in line:
+        xc = (w[0] + w[2]) / 2
+        inside = [c for c, r in columns.items() if r["x0"] - 0.01 <= xc <= r["x1"] + 0.01]
+        if inside:
+            col = min(inside, key=lambda c: abs(xc - (columns[c]["x0"] + columns[c]["x1"]) / 2))
+            cells.setdefault(col, []).append(w)
+    return cells
+
+
+def _extract_rows(table: Dict[str, Any], lines_by_page: List[List[Line]], decimal: str) -> List[Dict[str, Any]]:
+    columns = table["columns"]
+    # A row needs every learned numeric column; total/subtotal lines lack a unit price.
+    numeric = [c for c, kind in LINE_COLUMNS.items() if kind == "number" and c in columns]
+    rows = []
+    for p, lines in enumerate(lines_by_page):
+        for li, line in enumerate(lines):
+            if p == 0 and _yc(line) < table["start_yc"]:
+                continue
+            cells = _cells(line, columns)
+            values = {c: _convert(cells.get(c, []), {"kind": "number"}, decimal) for c in numeric}
+            if any(v is None for v in values.values()):
+                continue
+            row: Dict[str, Any] = {}
+            for col, spec in columns.items():
+                kind = LINE_COLUMNS[col]
+                if kind == "number":
+                    row[col] = _convert(cells.get(col, []), {"kind": "number"}, decimal)
+                    continue
+                src = li + spec["line_offset"]
+                words = _cells(lines[src], {col: spec}).get(col, []) if 0 <= src < len(lines) else []
+                row[col] = " ".join(w[4] for w in words) or None
+            rows.append(row)
+    return rows
+
+
+def apply_template(template: Dict[str, Any], lines_by_page: List[List[Line]]) -> Dict[str, Any]:
+    decimal = template["decimal"]
+    fields: Dict[str, Any] = {}
+    for field, spec in template["fields"].items():
+        value = _extract_field(spec, lines_by_page, decimal)
+        if "." in field:
+            parent, child = field.split(".", 1)
+            fields.setdefault(parent, {})[child] = value
+        else:
+            fields[field] = value
+    fields["line_items"] = _extract_rows(template["table"], lines_by_page, decimal)
+    return fields
+
+
+def validate(fields: Dict[str, Any]) -> Optional[str]:
+    rows = fields.get("line_items") or []
+    if not rows:
+        return "no line items"
+    if fields.get("total_amount") is None:
+        return "total_amount missing"
+    problems = check_line_items(rows, TOLERANCE)
+    if problems:
+        return problems[0]
+    return check_total(fields, TOLERANCE)
+
+
+def _same(kind: str, a: Any, b: Any) -> bool:
+    if a is None or b is None:
+        return a is b
+    if kind == "number":
+        fa, fb = _as_float(a), _as_float(b)
+        return fa is not None and fb is not None and _close(fa, fb)
+    if kind == "date":
+        return _as_date(a) == _as_date(b)
+    return _norm(str(a)) == _norm(str(b))
+
+
+def _same_rows(a: List[Dict[str, Any]], b: List[Dict[str, Any]]) -> bool:
+    return len(a) == len(b) and all(_same("number", x.get("amount"), y.get("amount")) for x, y in zip(a, b))
+
+
+# --- Store ------------------------------------------------------------------
+
+class TemplateStore:
+    """JSON-file backed template set with hit/accuracy accounting.
+
+    Definitions and correction accuracy are persisted; hit/miss counters are
+    per worker. Every worker keeps its own copy and the file is the meeting
+    point: ``save`` re-reads it under a file lock and merges before writing,
+    so templates learned by other workers are kept and per-template counts
+    add up instead of overwriting each other.
+    """
+
+    def __init__(self, path: str, match_threshold: float = 0.6, save_interval: float = 5.0):
+        self.path = path
+        self.match_threshold = match_threshold
+        self.save_interval = save_interval
+        self.templates: Dict[str, Dict[str, Any]] = {}
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0, "rejected": 0, "no_text_layer": 0, "learned": 0}
+        self._lock = threading.Lock()
+        # Per-template stat increments (and the latest consecutive_rejects)
+        # not yet written to the file
+        self._pending: Dict[str, Dict[str, int]] = {}
+        self._mtime = 0.0
+        self._dirty = False
+        self._saved_at = 0.0
+        with self._lock:
+            self._load()
+
+    def _read_file(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        return {t["id"]: t for t in data.get("templates", [])}
+
+    def _merge(self, on_file: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """Combine the file with this worker's templates and pending stats. Caller holds the lock."""
+        merged = {}
+        for tid in {*on_file, *self.templates}:
+            theirs, ours = on_file.get(tid), self.templates.get(tid)
+            if theirs is None:
+                merged[tid] = ours
+                continue
+            pending = self._pending.get(tid, {})
+            stats = dict(theirs.get("stats", {}))
+            for key, n in pending.items():
+                if key in _COUNTED_STATS:
+                    stats[key] = stats.get(key, 0) + n
+            if "consecutive_rejects" in pending:
+                stats["consecutive_rejects"] = pending["consecutive_rejects"]
+            base = theirs
+            if ours is not None:
+                rev_ours, rev_theirs = ours.get("revision", 1), theirs.get("revision", 1)
+                if rev_ours != rev_theirs:
+                    base = ours if rev_ours > rev_theirs else theirs
+                elif ours.get("updated_at") != theirs.get("updated_at"):
+                    # Relearned on two workers at once; the later one wins
+                    base = ours if (ours.get("updated_at") or "") > (theirs.get("updated_at") or "") else theirs
+                else:
+                    # Same definition, refined independently: keep anchors both still share
+                    shared = [a for a in theirs["anchors"] if a in set(ours["anchors"])]
+                    base = {**theirs, "anchors": shared if len(shared) >= MIN_ANCHORS else theirs["anchors"]}
+            merged[tid] = {**base, "stats": stats}
+        return merged
+
+    def _load(self) -> None:
+        """Merge in the file when another worker changed it. Caller holds the lock."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        self.templates = self._merge(self._read_file())
+        self._mtime = mtime
+        logger.info(f"Loaded {len(self.templates)} supplier templates from {self.path}")
+
+    def save(self, force: bool = False) -> None:
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._saved_at < self.save_interval):
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(f"{self.path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    merged = self._merge(self._read_file())
+                    tmp = f"{self.path}.tmp{os.getpid()}"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump({"version": 1, "templates": list(merged.values())}, f, ensure_ascii=False, indent=1)
+                    os.replace(tmp, self.path)
+                    self._mtime = os.path.getmtime(self.path)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            self.templates = merged
+            self._pending = {}
+            self._dirty = False
+            self._saved_at = time.time()
+
+    def _count(self, tpl: Dict[str, Any], key: str, n: int = 1) -> None:
+        """Bump a persisted per-template stat. Caller holds the lock."""
+        stats = tpl.setdefault("stats", {})
+        stats[key] = stats.get(key, 0) + n
+        pending = self._pending.setdefault(tpl["id"], {})
+        pending[key] = pending.get(key, 0) + n
+        self._dirty = True
+
+    def _set_rejects(self, tpl: Dict[str, Any], value: int) -> None:
+        tpl.setdefault("stats", {})["consecutive_rejects"] = value
+        self._pending.setdefault(tpl["id"], {})["consecutive_rejects"] = value
+        self._dirty = True
+
+    def match(self, pages: List[List[Word]]) -> Tuple[Optional[Dict[str, Any]], float]:
+        doc = _anchors(pages[0], expand=True)
+        with self._lock:
+            templates = list(self.templates.values())
+        best, best_score = None, 0.0
+        for tpl in templates:
+            anchors = tpl["anchors"]
+            score = sum(1 for a in anchors if a in doc) / len(anchors)
+            if score > best_score:
+                best, best_score = tpl, score
+        return (best, best_score) if best_score >= self.match_threshold else (None, best_score)
+
+    def extract(self, pdf_bytes: bytes) -> Dict[str, Any]:
+        """Try the template path. Always returns a report; ``fields`` is set on a validated hit."""
+        started = time.perf_counter()
+        report: Dict[str, Any] = {"status": "miss", "template": None, "score": 0.0, "fields": None}
+        with self._lock:
+            self._load()
+            self.counters["lookups"] += 1
+        pages = page_words(pdf_bytes)
+        if pages is None:
+            with self._lock:
+                self.counters["no_text_layer"] += 1
+            report["status"] = "no_text_layer"
+        else:
+            tpl, score = self.match(pages)
+            report["score"] = round(score, 3)
+            if tpl is None:
+                with self._lock:
+                    self.counters["misses"] += 1
+            else:
+                fields = apply_template(tpl, [_lines(p) for p in pages])
+                problem = validate(fields)
+                report["template"] = tpl["id"]
+                with self._lock:
+                    # Count on the current copy; a load may have replaced tpl meanwhile
+                    current = self.templates.get(tpl["id"], tpl)
+                    if problem:
+                        self.counters["rejected"] += 1
+                        self._count(current, "rejected")
+                        self._set_rejects(current, current["stats"].get("consecutive_rejects", 0) + 1)
+                        report.update(status="rejected", reason=problem)
+                    else:
+                        self.counters["hits"] += 1
+                        self._count(current, "hits")
+                        self._set_rejects(current, 0)
+                        self._refine(current, pages)
+                        report.update(status="hit", fields=fields, supplier=tpl.get("supplier"))
+        report["ms"] = round((time.perf_counter() - started) * 1000, 2)
+        self.save()
+        return report
+
+    def _refine(self, tpl: Dict[str, Any], pages: List[List[Word]]) -> None:
+        """Drop anchors this validated document does not share (variable text)."""
+        doc = _anchors(pages[0], expand=True)
+        kept = [a for a in tpl["anchors"] if a in doc]
+        if len(kept) >= max(MIN_ANCHORS, len(tpl["anchors"]) // 2):
+            tpl["anchors"] = kept
+
+    def learn(self, pdf_bytes: bytes, fields: Dict[str, Any], source: str = "extraction") -> Dict[str, Any]:
+        """Learn or update a template from trusted fields.
+
+        ``source="extraction"`` only creates templates for unseen layouts (or
+        replaces one that keeps failing validation); ``source="correction"``
+        first scores the existing template against the corrected fields, then
+        relearns it.
+        """
+        pages = page_words(pdf_bytes)
+        if pages is None:
+            return {"learned": False, "reason": "no text layer"}
+        with self._lock:
+            self._load()
+        existing, score = self.match(pages)
+        result: Dict[str, Any] = {"learned": False, "matched": existing["id"] if existing else None}
+        if existing is not None and source == "correction":
+            result["accuracy_sample"] = self._score(existing, pages, fields)
+        elif existing is not None and existing.get("stats", {}).get("consecutive_rejects", 0) < 3:
+            result["reason"] = "layout already has a template"
+            return result
+
+        template, reason = learn_template(pages, fields)
+        result["reason"] = reason
+        if template is None:
+            return result
+        now = datetime.now().isoformat()
+        with self._lock:
+            if existing is not None:
+                existing = self.templates.pop(existing["id"], existing)
+                template["id"] = existing["id"]
+                doc = _anchors(pages[0], expand=True)
+                kept = [a for a in existing["anchors"] if a in doc]
+                if len(kept) >= MIN_ANCHORS:
+                    template["anchors"] = kept
+                template["created_at"] = existing.get("created_at", now)
+                template["revision"] = existing.get("revision", 1) + 1
+                template["stats"] = dict(existing.get("stats", {}))
+            else:
+                template["created_at"] = now
+                template["revision"] = 1
+                template["stats"] = {}
+            template["updated_at"] = now
+            template["source"] = source
+            self.templates[template["id"]] = template
+            self._set_rejects(template, 0)
+            self.counters["learned"] += 1
+        self.save(force=True)
+        logger.info(f"Learned template {template['id']} ({template.get('supplier')}) from {source}")
+        result.update(learned=True, template=template["id"], fields=sorted(template["fields"]),
+                      columns=sorted(template["table"]["columns"]))
+        return result
+
+    def _score(self, tpl: Dict[str, Any], pages: List[List[Word]], truth: Dict[str, Any]) -> Dict[str, Any]:
+        """Compare what the template extracts with reviewer-corrected fields."""
+        got = apply_template(tpl, [_lines(p) for p in pages])
+        checked = correct = 0
+        for field in tpl["fields"]:
+            want = _get(truth, field)
+            if want in (None, ""):
+                continue
+            checked += 1
+            correct += 1 if _same(HEADER_FIELDS[field], _get(got, field), want) else 0
+        checked += 1
+        correct += 1 if _same_rows(got.get("line_items") or [], truth.get("line_items") or []) else 0
+        with self._lock:
+            current = self.templates.get(tpl["id"], tpl)
+            self._count(current, "corrections")
+            self._count(current, "checked_fields", checked)
+            self._count(current, "correct_fields", correct)
+        return {"checked": checked, "correct": correct}
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self.counters)
+            current = list(self.templates.values())
+        attempts = c["hits"] + c["misses"] + c["rejected"]
+        templates = []
+        for t in current:
+            s = t.get("stats", {})
+            templates.append({
+                "id": t["id"],
+                "supplier": t.get("supplier"),
+                "source": t.get("source"),
+                "updated_at": t.get("updated_at"),
+                "anchors": len(t["anchors"]),
+                "fields": sorted(t["fields"]),
+                "hits": s.get("hits", 0),
+                "rejected": s.get("rejected", 0),
+                "corrections": s.get("corrections", 0),
+                "accuracy": round(s["correct_fields"] / s["checked_fields"], 3) if s.get("checked_fields") else None,
+            })
+        return {
+            "path": self.path,
+            "templates": len(current),
+            "match_threshold": self.match_threshold,
+            "hit_rate": round(c["hits"] / attempts, 3) if attempts else 0.0,
+            "counters": c,
+            "by_template": sorted(templates, key=lambda t: -t["hits"]),
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Manage learned supplier templates.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ln = sub.add_parser("learn", help="learn/update a template from a PDF and corrected fields (JSON)")
+    ln.add_argument("--pdf", required=True)
+    ln.add_argument("--fields", required=True, help="JSON file with extracted_fields (e.g. reviewer_corrections.corrected_data)")
+    ln.add_argument("--store", default=os.getenv("TEMPLATE_STORE_PATH", "/processed/.state/templates.json"))
+    ex = sub.add_parser("extract", help="run the template path on a PDF")
+    ex.add_argument("--pdf", required=True)
+    ex.add_argument("--store", default=os.getenv("TEMPLATE_STORE_PATH", "/processed/.state/templates.json"))
+    args = parser.parse_args()
+
+    store = TemplateStore(args.store)
+    with open(args.pdf, "rb") as f:
+        pdf = f.read()
+    if args.command == "learn":
+        with open(args.fields, "r", encoding="utf-8") as f:
+            corrected = json.load(f)
+        print(json.dumps(store.learn(pdf, corrected.get("extracted_fields", corrected), source="correction"), indent=2))
+    else:
+        print(json.dumps(store.extract(pdf), indent=2, ensure_ascii=False))
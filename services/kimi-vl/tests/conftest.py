@@ -0,0 +1,48 @@
+"""
+Shared paths for the service tests.
+
+Run from services/kimi-vl:
+
+    python -m pytest -q
+
+Tests that read the portfolio config or sample documents skip when the
+repository checkout is not around them (e.g. inside the service image).
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+SERVICE_DIR = Path(__file__).resolve().parents[1]
+REPO_ROOT = SERVICE_DIR.parents[1]
+CONFIG_DIR = REPO_ROOT / "config"
+SAMPLE_DOCS = REPO_ROOT / "sample_docs"
+
+sys.path.insert(0, str(SERVICE_DIR))
+
+
+@pytest.fixture
+def config_dir() -> Path:
+    if not (CONFIG_DIR / "models.yml").exists():
+        pytest.skip("config/ not available")
+    return CONFIG_DIR
+
+
+@pytest.fixture
+def sample_doc():
+    """Read a file from sample_docs/ by name, e.g. sample_doc("invoice")."""
+    names = {
+        "invoice": "2640316788_Commercial Invoice_1.pdf",
+        "packing_list": "2640316788_Packing List_1.pdf",
+        "supplier_invoice": "XIN_F2_2100504266.pdf",
+        "photo": "WhatsApp Image 2024-09-30 at 14.56.01.jpeg",
+    }
+
+    def read(kind: str) -> bytes:
+        path = SAMPLE_DOCS / names[kind]
+        if not path.exists():
+            pytest.skip(f"sample_docs/{names[kind]} not available")
+        return path.read_bytes()
+
+    return read
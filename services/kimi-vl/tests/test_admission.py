@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, parse_api_keys, parse_classes
+
+
+def _controller(capacity=4, spec="interactive:8:15,standard:2:60,bulk:1:100", seconds_per_page=0.01):
+    return AdmissionController(
+        capacity, parse_classes(spec), "standard",
+        api_keys=parse_api_keys("key-a:bulk,key:with:colons:interactive"),
+        initial_seconds_per_page=seconds_per_page,
+    )
+
+
+def test_class_comes_from_api_key_and_header_can_only_lower_it():
+    ctl = _controller()
+    assert ctl.classify("interactive", "key-a").name == "bulk"
+    assert ctl.classify(None, "key-a").name == "bulk"
+    assert ctl.classify(None, "key:with:colons").name == "interactive"
+    assert ctl.classify("bulk", "key:with:colons").name == "bulk"
+    assert ctl.classify("interactive", None).name == "standard"
+    assert ctl.classify("bulk", None).name == "bulk"
+    assert ctl.classify("unknown", "unknown").name == "standard"
+
+
+def test_interactive_request_overtakes_queued_bulk():
+    ctl = _controller()
+    order = []
+
+    async def request(name, cls, pages):
+        ticket = await ctl.acquire(ctl.classes[cls], pages)
+        order.append(name)
+        return ticket
+
+    async def run():
+        holder = await ctl.acquire(ctl.classes["bulk"], 4)
+        waiting = [asyncio.create_task(request(f"bulk{i}", "bulk", 2)) for i in range(3)]
+        await asyncio.sleep(0)
+        waiting.append(asyncio.create_task(request("interactive", "interactive", 2)))
+        await asyncio.sleep(0)
+        assert ctl.describe()["queued_requests"] == 4
+        ctl.release(holder)
+        # Capacity 4 fits two 2-page requests; the rest wait for releases
+        released = set()
+        while len(order) < 4:
+            await asyncio.sleep(0)
+            for task in waiting:
+                if task.done() and task not in released:
+                    released.add(task)
+                    ctl.release(task.result())
+
+    asyncio.run(run())
+    assert order[0] == "interactive"
+    assert order[1:] == ["bulk0", "bulk1", "bulk2"]
+    assert ctl.inflight == 0
+
+
+def test_quiet_interactive_traffic_does_not_bank_a_late_start_tag():
+    ctl = _controller()
+    order = []
+
+    async def request(name, cls, pages):
+        ticket = await ctl.acquire(ctl.classes[cls], pages)
+        order.append(name)
+        return ticket
+
+    async def run():
+        for _ in range(2000):
+            ctl.release(await ctl.acquire(ctl.classes["interactive"], 1))
+        holder = await ctl.acquire(ctl.classes["bulk"], 4)
+        waiting = [asyncio.create_task(request(f"bulk{i}", "bulk", 4)) for i in range(5)]
+        await asyncio.sleep(0)
+        waiting.append(asyncio.create_task(request("interactive", "interactive", 1)))
+        await asyncio.sleep(0)
+        ctl.release(holder)
+        released = set()
+        while len(order) < 6:
+            await asyncio.sleep(0)
+            for task in waiting:
+                if task.done() and task not in released:
+                    released.add(task)
+                    ctl.release(task.result())
+
+    asyncio.run(run())
+    assert order[0] == "interactive"
+    assert ctl.classes["interactive"].rejected == 0
+
+
+def test_request_is_rejected_when_estimated_wait_exceeds_deadline():
+    ctl = _controller(spec="interactive:8:1,standard:2:60", seconds_per_page=10.0)
+
+    async def run():
+        await ctl.acquire(ctl.classes["standard"], 4)
+        await ctl.acquire(ctl.classes["interactive"], 4)
+
+    with pytest.raises(AdmissionRejected) as exc:
+        asyncio.run(run())
+    assert exc.value.retry_after >= 1
+    assert ctl.classes["interactive"].rejected == 1
+
+
+def test_oversized_request_is_capped_and_admitted_alone():
+    ctl = _controller(capacity=4)
+
+    async def run():
+        return await ctl.acquire(ctl.classes["standard"], 50)
+
+    ticket = asyncio.run(run())
+    assert ticket.cost == 4 and ctl.inflight == 4
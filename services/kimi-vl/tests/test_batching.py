@@ -0,0 +1,84 @@
+import asyncio
+import threading
+
+import pytest
+
+from batching import MicroBatcher
+
+
+class EchoModel:
+    """Returns each page's filename; records the batch sizes it saw."""
+
+    def __init__(self, fail: bool = False):
+        self.batches = []
+        self.fail = fail
+        self.lock = threading.Lock()
+
+    def predict_batch(self, pages):
+        with self.lock:
+            self.batches.append(len(pages))
+        if self.fail:
+            raise RuntimeError("model crashed")
+        return [{"filename": p.filename, "size": len(p.image)} for p in pages]
+
+
+def test_concurrent_pages_share_a_batch_and_get_their_own_results():
+    model = EchoModel()
+
+    async def run():
+        batcher = MicroBatcher(model, max_batch_size=4, max_wait_ms=200)
+        try:
+            return await asyncio.gather(*(batcher.submit(b"x" * i, f"p{i}") for i in range(1, 5))), batcher.stats()
+        finally:
+            await batcher.close()
+
+    results, stats = asyncio.run(run())
+    assert [r["filename"] for r in results] == ["p1", "p2", "p3", "p4"]
+    assert [r["size"] for r in results] == [1, 2, 3, 4]
+    assert model.batches == [4]
+    assert stats["batches"] == 1 and stats["batch_fill_rate"] == 1.0
+
+
+def test_batches_are_capped_at_max_batch_size():
+    model = EchoModel()
+
+    async def run():
+        batcher = MicroBatcher(model, max_batch_size=2, max_wait_ms=50)
+        try:
+            await asyncio.gather(*(batcher.submit(b"x", f"p{i}") for i in range(5)))
+        finally:
+            await batcher.close()
+
+    asyncio.run(run())
+    assert sum(model.batches) == 5
+    assert max(model.batches) <= 2
+
+
+def test_model_failure_reaches_every_caller_in_the_batch():
+    model = EchoModel(fail=True)
+
+    async def run():
+        batcher = MicroBatcher(model, max_batch_size=3, max_wait_ms=100)
+        try:
+            return await asyncio.gather(*(batcher.submit(b"x", f"p{i}") for i in range(3)), return_exceptions=True)
+        finally:
+            await batcher.close()
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_wrong_result_count_is_an_error():
+    class Short(EchoModel):
+        def predict_batch(self, pages):
+            return super().predict_batch(pages)[:-1]
+
+    async def run():
+        batcher = MicroBatcher(Short(), max_batch_size=2, max_wait_ms=100)
+        try:
+            await asyncio.gather(batcher.submit(b"x", "a"), batcher.submit(b"y", "b"))
+        finally:
+            await batcher.close()
+
+    with pytest.raises(RuntimeError, match="1 results for 2 pages"):
+        asyncio.run(run())
@@ -0,0 +1,70 @@
+import asyncio
+
+from router.cascade import CascadeRunner, check_line_items, check_total
+
+TIERS = [
+    {"key": "cheap", "price_per_1k_input_usd": 0.1},
+    {"key": "mid", "price_per_1k_input_usd": 1.0},
+    {"key": "strong", "price_per_1k_input_usd": 3.0},
+]
+GOOD_ROWS = [{"quantity": 2, "unit_price": 10, "amount": 20}, {"quantity": 1, "unit_price": 30, "amount": 30}]
+BAD_ROWS = [{"quantity": 2, "unit_price": 10, "amount": 200}]
+HEADER = {"invoice_number": "INV-1", "total_amount": 50}
+
+
+def _score(fields):
+    return 1.0 if fields.get("invoice_number") else 0.0
+
+
+def _runner(answers):
+    """answers[(model key, task, page)] -> fields; missing entries raise."""
+    async def call(model, task, page):
+        key = (model["key"], task, page)
+        if key not in answers:
+            raise RuntimeError(f"no answer for {key}")
+        return answers[key]
+    return CascadeRunner(TIERS, call, _score, min_confidence=0.85)
+
+
+def test_row_and_total_checks():
+    assert check_line_items(GOOD_ROWS, 0.02) == []
+    assert check_line_items(BAD_ROWS, 0.02) == ["row 1: 2.0 x 10.0 != 200.0"]
+    assert check_line_items([{"quantity": "1,000", "unit_price": 1, "amount": 1000}], 0.02) == []
+    assert check_total({**HEADER, "line_items": GOOD_ROWS}, 0.02) is None
+    assert check_total({"total_amount": 99, "line_items": GOOD_ROWS}, 0.02) == "sum(amount) 50.0 != total_amount 99.0"
+
+
+def test_consistent_document_stays_on_cheapest_tier():
+    runner = _runner({
+        ("cheap", "header_extraction", 0): HEADER,
+        ("cheap", "line_items", 1): {"line_items": GOOD_ROWS},
+    })
+    fields, report = asyncio.run(runner.run(1))
+    assert fields["line_items"] == GOOD_ROWS
+    assert report["escalated_units"] == 0 and report["calls"] == 2
+    assert report["total_check"] == "ok"
+
+
+def test_failing_page_escalates_alone():
+    runner = _runner({
+        ("cheap", "header_extraction", 0): {"invoice_number": "INV-1", "total_amount": 70},
+        ("cheap", "line_items", 1): {"line_items": GOOD_ROWS},
+        ("cheap", "line_items", 2): {"line_items": BAD_ROWS},
+        ("mid", "line_items", 2): {"line_items": [{"quantity": 2, "unit_price": 10, "amount": 20}]},
+    })
+    fields, report = asyncio.run(runner.run(2))
+    assert report["page_tiers"] == {"1": 0, "2": 1}
+    assert report["header_tier"] == 0
+    assert len(fields["line_items"]) == 3 and report["total_check"] == "ok"
+
+
+def test_low_confidence_header_and_failed_calls_escalate():
+    runner = _runner({
+        ("cheap", "header_extraction", 0): {"invoice_number": None},
+        ("mid", "header_extraction", 0): HEADER,
+        ("mid", "line_items", 1): {"line_items": GOOD_ROWS},
+    })
+    fields, report = asyncio.run(runner.run(1))
+    assert fields["invoice_number"] == "INV-1"
+    assert report["header_tier"] == 1 and report["page_tiers"] == {"1": 1}
+    assert [c["ok"] for c in report["call_log"] if c["task"] == "line_items"] == [False, True]
@@ -0,0 +1,54 @@
+import pytest
+
+from classifier import OTHER, ClassifierStats, classify_document, classify_text
+
+
+@pytest.mark.parametrize("text,doc_type", [
+    ("COMMERCIAL INVOICE\nInvoice No: 123\nUnit Price  Total Amount\nPayment: 30 days", "invoice"),
+    ("PACKING LIST\nRef. Invoice No: 123\nCartons  Net Weight  Gross Weight  CBM", "packing_list"),
+    ("CERTIFICATE OF ORIGIN\nThe undersigned hereby certify that the goods\nChamber of Commerce", "certificate"),
+])
+def test_title_decides_between_related_trade_documents(text, doc_type):
+    result = classify_text(text)
+    assert result["doc_type"] == doc_type
+    assert result["confidence"] > 0.5
+
+
+def test_body_mentions_do_not_outweigh_the_title():
+    # A packing list quoting the invoice it belongs to, many times
+    text = "PACKING LIST\n" + "invoice no 123 total amount\n" * 20 + "cartons net weight"
+    assert classify_text(text)["doc_type"] == "packing_list"
+
+
+def test_weak_or_missing_signals_are_other():
+    assert classify_text("Meeting notes from Tuesday")["doc_type"] == OTHER
+    # Two minor invoice words below the title zone are not enough
+    weak = classify_text("\n".join(f"line {i}" for i in range(10)) + "\npayment vat")
+    assert weak["doc_type"] == OTHER and weak["scores"]["invoice"] > 0
+
+
+def test_mixed_titles_lower_confidence():
+    clear = classify_text("COMMERCIAL INVOICE\ninvoice no 1")
+    mixed = classify_text("COMMERCIAL INVOICE AND PACKING LIST\ninvoice no 1")
+    assert mixed["confidence"] < clear["confidence"]
+
+
+def test_sample_documents(sample_doc):
+    assert classify_document(sample_doc("invoice"))["doc_type"] == "invoice"
+    assert classify_document(sample_doc("supplier_invoice"))["doc_type"] == "invoice"
+    packing = classify_document(sample_doc("packing_list"))
+    assert packing["doc_type"] == "packing_list" and packing["method"] == "text_layer"
+
+
+def test_photos_and_broken_pdfs_have_no_text_layer(sample_doc):
+    assert classify_document(sample_doc("photo"))["method"] == "no_text_layer"
+    assert classify_document(b"%PDF-1.7\ntruncated")["method"] == "no_text_layer"
+
+
+def test_stats_count_labels_and_methods():
+    stats = ClassifierStats()
+    stats.add({"doc_type": "invoice", "method": "text_layer", "ms": 2.0, "confidence": 0.9})
+    stats.add({"doc_type": OTHER, "method": "no_text_layer", "ms": 0.5, "confidence": 0.0})
+    described = stats.describe()
+    assert described["by_type"] == {"invoice": 1, OTHER: 1}
+    assert described["by_method"] == {"text_layer": 1, "no_text_layer": 1}
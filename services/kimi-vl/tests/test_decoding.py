@@ -0,0 +1,89 @@
+import io
+
+import pytest
+from PIL import Image
+
+from decoding import UnsupportedFormat, count_pages, data_url, decode_pages, document_page_source, sniff_mime
+
+# PIL warns while probing the deliberately corrupt TIFF
+pytestmark = pytest.mark.filterwarnings("ignore:Corrupt EXIF data")
+
+
+def _image(fmt, size=(40, 30), **save):
+    buf = io.BytesIO()
+    Image.new("RGB", size, "white").save(buf, format=fmt, **save)
+    return buf.getvalue()
+
+
+def _tiff(frames):
+    buf = io.BytesIO()
+    first, *rest = [Image.new("L", (20, 20), shade) for shade in range(0, 250, 250 // frames)][:frames]
+    first.save(buf, format="TIFF", save_all=True, append_images=rest)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("fmt,mime", [
+    ("JPEG", "image/jpeg"), ("PNG", "image/png"), ("TIFF", "image/tiff"),
+    ("GIF", "image/gif"), ("BMP", "image/bmp"), ("WEBP", "image/webp"),
+])
+def test_sniff_by_magic_bytes(fmt, mime):
+    assert sniff_mime(_image(fmt)) == mime
+
+
+def test_sniff_pdf_with_leading_junk_and_unknown_bytes():
+    assert sniff_mime(b"\xef\xbb\xbf%PDF-1.7\n...") == "application/pdf"
+    assert sniff_mime(b"PK\x03\x04 zip archive") is None
+    assert data_url(b"not an image").startswith("data:image/png;base64,")
+
+
+def test_sample_documents_decode(sample_doc):
+    pdf = sample_doc("invoice")
+    assert sniff_mime(pdf) == "application/pdf"
+    assert count_pages(pdf) == 2
+    mime, pages = decode_pages(pdf, dpi=72)
+    assert mime == "application/pdf" and len(pages) == 2
+    assert all(p.startswith(b"\x89PNG") for p in pages)
+
+    photo = sample_doc("photo")
+    assert count_pages(photo) == 1
+    mime, pages = decode_pages(photo, max_side=512)
+    assert mime == "image/jpeg"
+    with Image.open(io.BytesIO(pages[0])) as img:
+        assert max(img.size) <= 512
+
+
+def test_small_jpeg_passes_through_unchanged():
+    jpeg = _image("JPEG")
+    assert decode_pages(jpeg)[1] == [jpeg]
+
+
+def test_multi_page_tiff_becomes_one_page_per_frame():
+    tiff = _tiff(3)
+    assert count_pages(tiff) == 3
+    mime, pages = decode_pages(tiff)
+    assert mime == "image/tiff" and len(pages) == 3
+    assert all(p.startswith(b"\x89PNG") for p in pages)
+
+
+def test_page_source_close_is_idempotent(sample_doc):
+    _, _, render, encode, close = document_page_source(sample_doc("invoice"), dpi=72)
+    pix = render(0)
+    close()
+    close()
+    assert encode(pix).startswith(b"\x89PNG")
+
+
+TRUNCATED_PDF = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\ntruncated"
+BAD_TIFF = b"II*\x00garbage after the tiff header"
+
+
+@pytest.mark.parametrize("data", [TRUNCATED_PDF, BAD_TIFF])
+def test_page_count_of_unreadable_pdf_or_tiff_raises(data):
+    with pytest.raises(UnsupportedFormat):
+        count_pages(data)
+
+
+@pytest.mark.parametrize("data", [TRUNCATED_PDF, BAD_TIFF, b"\xff\xd8\xff\xe0truncated jpeg", b"plain text"])
+def test_unreadable_uploads_raise_unsupported_format(data):
+    with pytest.raises(UnsupportedFormat):
+        decode_pages(data)
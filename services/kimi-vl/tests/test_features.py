@@ -0,0 +1,103 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+import pytest
+from PIL import Image
+
+from classifier import classify_document
+from features import FeatureStats, extract_features
+from router.reloader import RouterStore
+
+
+def _table_pdf(rows_per_page, pages=1):
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=595, height=842)
+        page.insert_text((40, 60), "COMMERCIAL INVOICE  Invoice No 1001  Date 2024-03-12", fontsize=10)
+        for x, head in ((40, "Code"), (120, "Description"), (330, "Qty"), (410, "Price"), (490, "Amount")):
+            page.insert_text((x, 120), head, fontsize=9)
+        y = 140
+        for i in range(rows_per_page):
+            for x, cell in ((40, f"A-{i}"), (120, "Brass valve"), (330, f"{i + 1}"), (410, "12.50"), (490, f"{(i + 1) * 12.5:.2f}")):
+                page.insert_text((x, y), cell, fontsize=9)
+            y += 16
+        page.insert_text((410, y + 20), f"TOTAL   {sum((i + 1) * 12.5 for i in range(rows_per_page)):.2f}", fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def _as_png(pdf):
+    with fitz.open(stream=pdf, filetype="pdf") as doc:
+        return doc[0].get_pixmap(dpi=150).tobytes("png")
+
+
+def test_text_layer_counts_item_rows_but_not_totals():
+    result = extract_features(_table_pdf(12))
+    (page,) = result["pages"]
+    assert page["method"] == "text_layer" and page["page"] == 1
+    assert result["expected_line_items"] == 12
+    assert 0 < result["table_density"] <= 1
+
+
+def test_scanned_page_is_estimated_from_a_thumbnail():
+    result = extract_features(_as_png(_table_pdf(12)))
+    (page,) = result["pages"]
+    assert page["method"] == "thumbnail"
+    assert abs(result["expected_line_items"] - 12) <= 2
+
+
+def test_pages_past_max_pages_are_extrapolated():
+    result = extract_features(_table_pdf(6, pages=5), max_pages=2)
+    assert result["analysed_pages"] == 2
+    assert [p["method"] for p in result["pages"]] == ["text_layer"] * 2 + ["extrapolated"] * 3
+    assert result["expected_line_items"] == 30
+
+
+def test_unreadable_input_has_no_pages():
+    result = extract_features(b"not a document")
+    assert result["pages"] == [] and result["expected_line_items"] == 0
+    assert result["size_bytes"] == len(b"not a document")
+
+
+def test_sample_documents(sample_doc):
+    invoice = extract_features(sample_doc("invoice"))
+    assert [p["page"] for p in invoice["pages"]] == [1, 2]
+    assert invoice["expected_line_items"] > 0
+    photo = extract_features(sample_doc("photo"))
+    assert photo["pages"][0]["method"] == "thumbnail"
+
+    stats = FeatureStats()
+    stats.add(invoice)
+    stats.add(photo)
+    assert stats.describe()["pages_by_method"] == {"text_layer": 2, "thumbnail": 1}
+
+
+def test_classifier_and_features_can_share_a_pdf_across_threads(sample_doc):
+    # /orchestrate runs both on the same upload at once
+    docs = [sample_doc("invoice"), sample_doc("packing_list"), sample_doc("supplier_invoice")]
+    expected = [(classify_document(d)["doc_type"], extract_features(d)["expected_line_items"]) for d in docs]
+    with ThreadPoolExecutor(8) as pool:
+        for _ in range(5):
+            kinds = pool.map(lambda d: classify_document(d)["doc_type"], docs)
+            items = pool.map(lambda d: extract_features(d)["expected_line_items"], docs)
+            assert list(zip(kinds, items)) == expected
+
+
+def test_image_without_table_has_no_items():
+    buf = io.BytesIO()
+    Image.new("L", (800, 1100), 255).save(buf, format="PNG")
+    assert extract_features(buf.getvalue())["expected_line_items"] == 0
+
+
+def test_header_is_routed_without_table_estimates(config_dir):
+    main = pytest.importorskip("main")
+    router = RouterStore(str(config_dir / "models.yml"), str(config_dir / "routing.yml")).current().router
+    features = {
+        "page_count": 2, "doc_type": "invoice", "budget": "low", "required_capabilities": ["vision", "json"],
+        "offline_mode": False, "wan_slow": False, "table_density": 0.9, "expected_line_items": 80,
+    }
+    dense_page = main._page_routing_features(features, {"page": 1, "table_density": 0.9, "expected_line_items": 80})
+    assert router.select("line_items", dense_page)["rule"] == "heavy-tables-high-accuracy"
+    assert router.select("header_extraction", main._header_routing_features(features))["rule"] == "small-invoice-cheap"
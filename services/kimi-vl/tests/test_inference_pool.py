@@ -0,0 +1,101 @@
+import os
+import threading
+import zlib
+
+import pytest
+
+from batching import PageRequest
+from inference_pool import InferencePool, PoolClient, PoolServer, check_shm
+
+
+class EchoModel:
+    """Worker-side model: reports what arrived through shared memory."""
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+
+    def predict_batch(self, pages):
+        out = []
+        for page in pages:
+            if page.filename == "boom.png":
+                raise ValueError("cannot read page")
+            marker = os.path.join(self.model_path, "crashed")
+            if page.filename == "crash.png" and not os.path.exists(marker):
+                open(marker, "w").close()
+                os._exit(3)  # dies mid-batch, once
+            out.append({"filename": page.filename, "size": len(page.image), "crc": zlib.crc32(page.image),
+                        "pid": os.getpid()})
+        return out
+
+
+def load_echo(model_path):
+    return EchoModel(model_path)
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = InferencePool("test_inference_pool:load_echo", str(tmp_path), workers=1, slots=2, slot_bytes=1024,
+                         timeout_s=30, health_interval_s=0.2, start_timeout_s=60)
+    pool.start()
+    try:
+        yield pool
+    finally:
+        pool.close()
+
+
+def test_pages_reach_the_worker_intact_including_oversize_ones(pool):
+    pages = [PageRequest(bytes([i]) * size, f"p{i}.png", None) for i, size in enumerate((10, 1024, 5000))]
+    results = pool.predict_batch(pages)
+    assert [(r["filename"], r["size"], r["crc"]) for r in results] == [
+        (p.filename, len(p.image), zlib.crc32(p.image)) for p in pages
+    ]
+    assert results[0]["pid"] != os.getpid()
+    stats = pool.stats()
+    assert stats["oversize_pages"] == 1  # the only page bigger than a slot
+    assert stats["shm_bytes_written"] == 10 + 1024 + 5000
+    assert stats["workers"][0]["pages"] == 3
+
+
+def test_more_pages_than_slots_use_dedicated_segments(pool):
+    pages = [PageRequest(b"x" * 100, f"p{i}.png", None) for i in range(5)]
+    assert len(pool.predict_batch(pages)) == 5
+    assert pool.stats()["oversize_pages"] == 3
+
+
+def test_model_errors_are_raised_without_restarting_the_worker(pool):
+    with pytest.raises(RuntimeError, match="ValueError: cannot read page"):
+        pool.predict_batch([PageRequest(b"img", "boom.png", None)])
+    assert pool.predict_batch([PageRequest(b"img", "a.png", None)])[0]["size"] == 3
+    assert pool.stats()["restarts"] == 0
+
+
+def test_a_lost_worker_is_replaced_and_its_batch_retried(pool):
+    first = pool.stats()["workers"][0]["pid"]
+    (result,) = pool.predict_batch([PageRequest(b"img", "crash.png", None)])
+    assert result["pid"] != first
+    stats = pool.stats()
+    assert stats["restarts"] == 1 and stats["retries"] == 1
+
+
+def test_api_workers_share_one_pool_through_the_server(pool, tmp_path):
+    path = str(tmp_path / "pool.sock")
+    threading.Thread(target=PoolServer(pool, path).serve_forever, daemon=True).start()
+    clients = [PoolClient(path, timeout_s=30) for _ in range(3)]
+    try:
+        clients[0].wait_ready(10)
+        pages = [PageRequest(b"y" * 3000, "big.png", None), PageRequest(b"z", "small.png", None)]
+        for client in clients:
+            assert [r["size"] for r in client.predict_batch(pages)] == [3000, 1]
+        with pytest.raises(RuntimeError, match="cannot read page"):
+            clients[0].predict_batch([PageRequest(b"img", "boom.png", None)])
+        stats = clients[1].stats()
+        assert stats["server"] == path and stats["workers"][0]["batches"] == 4
+    finally:
+        for client in clients:
+            client.close()
+
+
+def test_arenas_larger_than_shared_memory_are_refused():
+    check_shm(1)
+    with pytest.raises(RuntimeError, match="KIMI_VL_SHM_SIZE"):
+        check_shm(1 << 60)
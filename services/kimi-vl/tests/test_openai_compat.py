@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from router.adapters.openai_compat import OpenAICompatAdapter, TruncatedOutput, image_data_url, parse_json_content
+from router.reloader import RouterStore
+
+
+def _adapter(reply, finish_reason="stop", seen=None):
+    def handler(request):
+        if seen is not None:
+            seen.append((str(request.url), request.headers.get("authorization"), json.loads(request.content)))
+        return httpx.Response(200, json={
+            "choices": [{"message": {"content": reply}, "finish_reason": finish_reason}],
+            "usage": {"completion_tokens": 42},
+        })
+
+    adapter = OpenAICompatAdapter("http://local-llm:8080/v1/", api_key="secret", provider="local")
+    adapter.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return adapter
+
+
+@pytest.mark.parametrize("content", [
+    '{"invoice_number": "A-1"}',
+    '```json\n{\n  "invoice_number": "A-1"\n}\n```',
+    'Here is the extracted data:\n{"invoice_number": "A-1"}\nLet me know if you need more.',
+])
+def test_parse_json_content_tolerates_fences_and_prose(content):
+    assert parse_json_content(content) == {"invoice_number": "A-1"}
+
+
+def test_parse_json_content_rejects_non_json():
+    with pytest.raises(json.JSONDecodeError):
+        parse_json_content("I could not read this document.")
+
+
+@pytest.mark.parametrize("image,mime", [
+    (b"\x89PNG\r\n\x1a\n....", "image/png"),
+    (b"\xff\xd8\xff\xe0....", "image/jpeg"),
+    (b"RIFF\x00\x00\x00\x00WEBPVP8 ", "image/webp"),
+    (b"unknown bytes", "image/png"),
+])
+def test_image_data_url_labels_the_page_type(image, mime):
+    assert image_data_url(image).startswith(f"data:{mime};base64,")
+
+
+def test_extract_json_posts_images_schema_and_budget():
+    seen = []
+    adapter = _adapter('```json\n{"line_items": []}\n```', seen=seen)
+    fmt = {"type": "json_schema", "json_schema": {"name": "line_items", "strict": True, "schema": {}}}
+    res = asyncio.run(adapter.extract_json("rows please", [b"\x89PNG page1", b"\xff\xd8\xff page2"], "local-vl",
+                                           response_format=fmt, max_tokens=900))
+
+    url, auth, body = seen[0]
+    assert url == "http://local-llm:8080/v1/chat/completions" and auth == "Bearer secret"
+    content = body["messages"][0]["content"]
+    assert [c["type"] for c in content] == ["image_url", "image_url", "text"]
+    assert content[1]["image_url"]["url"].startswith("data:image/jpeg;base64,")
+    assert body["response_format"] == fmt and body["max_tokens"] == 900
+    assert res["extracted_fields"] == {"line_items": []} and res["provider"] == "local"
+    assert res["usage"] == {"completion_tokens": 42}
+
+
+def test_cut_off_reply_raises_truncated_output():
+    adapter = _adapter('{"line_items": [{"amount": 1', finish_reason="length")
+    with pytest.raises(TruncatedOutput) as exc:
+        asyncio.run(adapter.extract_json("rows", [b"img"], "local-vl", max_tokens=10))
+    assert exc.value.usage == {"completion_tokens": 42}
+
+
+def test_unconfigured_adapter_refuses_calls():
+    adapter = OpenAICompatAdapter(None)
+    assert adapter.is_configured() is False
+    with pytest.raises(RuntimeError):
+        asyncio.run(adapter.extract_json("p", [b"img"], "local-vl"))
+
+
+def test_offline_and_slow_wan_route_to_the_local_model(config_dir):
+    router = RouterStore(str(config_dir / "models.yml"), str(config_dir / "routing.yml")).current().router
+    base = {"page_count": 2, "doc_type": "invoice", "budget": "low", "required_capabilities": ["vision", "json"]}
+    for flags in ({"offline_mode": True, "wan_slow": False}, {"offline_mode": False, "wan_slow": True}):
+        sel = router.select("line_items", {**base, **flags})
+        assert sel["provider"] == "local" and sel["rule"] == "offline-or-slow-wan-local"
+    assert router.select("line_items", {**base, "offline_mode": False, "wan_slow": False})["provider"] != "local"
+
+
+def test_aclose_waits_for_calls_in_flight():
+    async def run():
+        release = asyncio.Event()
+
+        async def handler(request):
+            await release.wait()
+            return httpx.Response(200, json={"choices": [{"message": {"content": "{}"}, "finish_reason": "stop"}]})
+
+        adapter = OpenAICompatAdapter("http://local-llm:8080/v1", provider="local")
+        adapter.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        call = asyncio.create_task(adapter.extract_json("p", [b"img"], "local-vl"))
+        await asyncio.sleep(0.05)
+        closing = asyncio.create_task(adapter.aclose())
+        await asyncio.sleep(0.05)
+        assert adapter.inflight == 1 and not closing.done()
+        release.set()
+        assert (await call)["extracted_fields"] == {}
+        await closing
+        assert adapter.client.is_closed
+
+    asyncio.run(run())
+
+
+def test_router_swap_closes_replaced_clients(config_dir, monkeypatch):
+    main = pytest.importorskip("main")
+    snapshot = RouterStore(str(config_dir / "models.yml"), str(config_dir / "routing.yml")).current()
+    old = OpenAICompatAdapter("http://old-host:8080/v1", provider="local")
+    old.timeout_s = 0
+    monkeypatch.setattr(main, "_ADAPTERS", {"local": old})
+
+    async def run():
+        main._on_router_swap(snapshot)
+        await asyncio.gather(*main._RETIRING)
+
+    asyncio.run(run())
+    assert main._ADAPTERS["local"] is not old and old.client.is_closed
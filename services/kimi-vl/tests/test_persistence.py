@@ -0,0 +1,59 @@
+import json
+from decimal import Decimal
+
+from persistence import DOCUMENT_COLUMNS, LINE_ITEM_COLUMNS, document_rows
+
+RESULT = {
+    "confidence": 0.86,
+    "extracted_fields": {
+        "invoice_number": "INV-77",
+        "po_number": 4500123,
+        "invoice_date": "2024-09-30",
+        "seller": {"name": "Xin Trading Co.", "address": "Ningbo"},
+        "buyer": "Beyan Ltd",
+        "total_amount": "1,250.50",
+        "total_currency": "USD",
+        "line_items": [
+            {"model_code": "A-1", "goods_description": "Valve", "quantity": 10, "unit_price": 100.05, "amount": 1000.5},
+            "not a row",
+            {"model_code": None, "goods_description": "Freight", "quantity": "", "unit_price": None, "amount": 250},
+        ],
+    },
+    "metadata": {
+        "classification": {"doc_type": "invoice", "confidence": 0.9, "method": "text_layer"},
+        "router": {"version": "abc"},
+    },
+}
+
+
+def test_document_row_normalizes_header_fields():
+    doc, _ = document_rows(7, "inv.pdf", RESULT)
+    row = dict(zip(DOCUMENT_COLUMNS, doc))
+
+    assert row["id"] == 7 and row["filename"] == "inv.pdf" and row["status"] == "completed"
+    assert row["invoice_number"] == "INV-77"
+    assert row["po_number"] == "4500123"
+    assert row["seller_name"] == "Xin Trading Co."
+    assert row["buyer_name"] == "Beyan Ltd"
+    assert row["total_amount"] == Decimal("1250.50")
+    assert row["confidence"] == Decimal("0.86")
+    assert json.loads(row["classification"]) == RESULT["metadata"]["classification"]
+    assert json.loads(row["validation"]) == {"confidence": 0.86, "router": {"version": "abc"}}
+
+
+def test_line_item_rows_keep_order_and_skip_non_objects():
+    _, items = document_rows(7, "inv.pdf", RESULT)
+    rows = [dict(zip(LINE_ITEM_COLUMNS, r)) for r in items]
+
+    assert [r["line_no"] for r in rows] == [1, 3]
+    assert rows[0]["quantity"] == Decimal("10") and rows[0]["amount"] == Decimal("1000.5")
+    assert rows[1]["model_code"] is None and rows[1]["quantity"] is None
+    assert all(r["processed_document_id"] == 7 for r in rows)
+
+
+def test_empty_result_still_produces_a_document_row():
+    doc, items = document_rows(1, "blank.png", {})
+    row = dict(zip(DOCUMENT_COLUMNS, doc))
+    assert items == []
+    assert row["invoice_number"] is None and row["total_amount"] is None
+    assert json.loads(row["extraction"]) == {}
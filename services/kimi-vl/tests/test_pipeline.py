@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from decoding import document_page_source
+from pipeline import DocumentPipeline
+
+
+def _fake_source():
+    closed = []
+
+    def render(index):
+        return f"raster{index + 1}"
+
+    def encode(raster):
+        return raster.replace("raster", "img").encode()
+
+    return render, encode, lambda: closed.append(True), closed
+
+
+def test_items_come_back_in_page_order_and_header_reads_page_one():
+    render, encode, close, closed = _fake_source()
+    seen_header = []
+
+    async def header_fn(image):
+        seen_header.append(image)
+        return {"invoice_number": "INV-1"}
+
+    async def page_fn(page_no, image):
+        # Later pages finish first
+        await asyncio.sleep(0.01 * (5 - page_no))
+        return [{"page": page_no, "image": image.decode()}]
+
+    pipeline = DocumentPipeline(4, render, encode, header_fn, page_fn, extract_concurrency=4, close=close)
+    header, items = asyncio.run(pipeline.run())
+
+    assert header == {"invoice_number": "INV-1"}
+    assert seen_header == [b"img1"]
+    assert [i["page"] for i in items] == [1, 2, 3, 4]
+    assert sorted(pipeline.images) == [1, 2, 3, 4]
+    assert closed == [True]
+    assert pipeline.describe()["stages"]["extract"]["items"] == 4
+
+
+def test_failed_page_cancels_the_run_and_still_closes_the_source():
+    render, encode, close, closed = _fake_source()
+
+    async def header_fn(image):
+        return {}
+
+    async def page_fn(page_no, image):
+        if page_no == 2:
+            raise RuntimeError("model error on page 2")
+        return []
+
+    pipeline = DocumentPipeline(3, render, encode, header_fn, page_fn, close=close)
+    with pytest.raises(RuntimeError, match="page 2"):
+        asyncio.run(pipeline.run())
+    assert closed == [True]
+
+
+def test_empty_document_is_rejected():
+    render, encode, close, _ = _fake_source()
+    with pytest.raises(ValueError):
+        DocumentPipeline(0, render, encode, None, None)
+
+
+def test_sample_pdf_runs_through_the_real_page_source(sample_doc):
+    mime, count, render, encode, close = document_page_source(sample_doc("invoice"), dpi=72)
+
+    async def header_fn(image):
+        return {"bytes": len(image)}
+
+    async def page_fn(page_no, image):
+        assert image.startswith(b"\x89PNG")
+        return [{"page": page_no}]
+
+    pipeline = DocumentPipeline(count, render, encode, header_fn, page_fn, close=close)
+    header, items = asyncio.run(pipeline.run())
+    assert mime == "application/pdf" and count == 2
+    assert header["bytes"] > 0 and [i["page"] for i in items] == [1, 2]
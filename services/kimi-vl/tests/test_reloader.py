@@ -0,0 +1,76 @@
+import asyncio
+import shutil
+
+import pytest
+
+from router.registry import ModelRegistry
+from router.policy import RoutingPolicy
+from router.reloader import RouterStore, validate_config
+
+
+@pytest.fixture
+def store(config_dir, tmp_path):
+    for name in ("models.yml", "routing.yml"):
+        shutil.copy(config_dir / name, tmp_path / name)
+    return RouterStore(portfolio_path=str(tmp_path / "models.yml"), routing_path=str(tmp_path / "routing.yml"))
+
+
+def test_shipped_config_is_valid(config_dir):
+    registry = ModelRegistry(portfolio_path=str(config_dir / "models.yml"))
+    policy = RoutingPolicy(routing_path=str(config_dir / "routing.yml"))
+    assert validate_config(registry, policy) == []
+
+
+def test_reload_without_changes_keeps_snapshot(store):
+    before = store.current()
+    res = asyncio.run(store.reload())
+    assert res["changed"] is False
+    assert store.current() is before
+
+
+def test_reload_swaps_snapshot_and_notifies(store, tmp_path):
+    seen = []
+    store.add_listener(seen.append)
+    before = store.current()
+    routing = tmp_path / "routing.yml"
+    routing.write_text(routing.read_text().replace("choose: vision.claude-sonnet-3-7", "choose: vision.local-vl", 1))
+
+    res = asyncio.run(store.reload())
+
+    assert res["changed"] is True
+    assert res["previous_version"] == before.version
+    assert store.current().generation == before.generation + 1
+    assert seen == [store.current()]
+    # A request holding the old snapshot keeps its routing
+    rule = next(r for r in before.policy.rules if r["name"] == "heavy-tables-high-accuracy")
+    assert rule["choose"] == "vision.claude-sonnet-3-7"
+
+
+def test_invalid_config_is_rejected_and_old_snapshot_serves(store, tmp_path):
+    before = store.current()
+    routing = tmp_path / "routing.yml"
+    routing.write_text(routing.read_text().replace("choose: vision.local-vl", "choose: vision.missing", 1))
+
+    with pytest.raises(ValueError, match="unknown model 'vision.missing'"):
+        asyncio.run(store.reload())
+    assert store.current() is before
+
+
+def test_follow_reloads_published_version(store, tmp_path):
+    routing = tmp_path / "routing.yml"
+    routing.write_text(routing.read_text() + "\n# edited on another worker\n")
+    published = RouterStore(portfolio_path=store.portfolio_path, routing_path=store.routing_path).current().version
+
+    async def published_version():
+        return published
+
+    async def run():
+        task = asyncio.create_task(store.follow(published_version, 0.01))
+        for _ in range(100):
+            if store.current().version == published:
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(run())
+    assert store.current().version == published
@@ -0,0 +1,124 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from router.adapters.openai_compat import TruncatedOutput
+from schemas import (
+    DOCUMENT_TASK, HEADER_MAX_TOKENS, HEADER_TASK, LINE_ITEMS_TASK, OUTPUT_STATS, SchemaViolation,
+    max_tokens_for, response_format, schema_for, validate,
+)
+
+
+def _strict(schema):
+    """Every object lists all properties as required and forbids extras."""
+    if "properties" in schema:
+        assert schema["required"] == list(schema["properties"])
+        assert schema["additionalProperties"] is False
+        for sub in schema["properties"].values():
+            _strict(sub)
+    if "items" in schema:
+        _strict(schema["items"])
+
+
+@pytest.mark.parametrize("task", [HEADER_TASK, LINE_ITEMS_TASK, DOCUMENT_TASK])
+@pytest.mark.parametrize("doc_type", ["invoice", "packing_list", "certificate"])
+def test_schemas_are_strict_mode_compatible(task, doc_type):
+    fmt = response_format(task, doc_type)
+    assert fmt["json_schema"]["strict"] is True
+    _strict(fmt["json_schema"]["schema"])
+
+
+def test_unknown_doc_type_uses_invoice_schema_and_unknown_task_fails():
+    assert schema_for(LINE_ITEMS_TASK, "receipt") == schema_for(LINE_ITEMS_TASK, "invoice")
+    with pytest.raises(ValueError):
+        schema_for("summary")
+
+
+def test_validate_reports_wrong_types_and_missing_keys():
+    schema = schema_for(LINE_ITEMS_TASK)
+    row = {"model_code": "A", "goods_description": "Valve", "quantity": "1,000", "unit_price": 2.5, "amount": None}
+    assert validate({"line_items": [row]}, schema) == []
+    bad = {"line_items": [{**row, "quantity": "ten", "amount": True}]}
+    assert validate(bad, schema) == [
+        "$.line_items[0].quantity: expected number/null, got str",
+        "$.line_items[0].amount: expected number/null, got bool",
+    ]
+    assert validate({"line_items": {}}, schema) == ["$.line_items: expected array, got dict"]
+    partial = {"invoice_number": "A-1"}
+    assert "$.total_amount: missing" in validate(partial, schema_for(HEADER_TASK))
+    assert validate(partial, schema_for(HEADER_TASK), allow_missing=True) == []
+
+
+def test_schema_violation_message_is_bounded():
+    err = SchemaViolation(HEADER_TASK, [f"$.f{i}: missing" for i in range(5)])
+    assert str(err).endswith("(+2 more)") and len(err.errors) == 5
+
+
+def test_max_tokens_grows_with_rows_and_respects_the_cap():
+    assert max_tokens_for(HEADER_TASK, 500) == HEADER_MAX_TOKENS
+    few, many = max_tokens_for(LINE_ITEMS_TASK, 2), max_tokens_for(LINE_ITEMS_TASK, 40)
+    assert few == max_tokens_for(LINE_ITEMS_TASK, None)  # MIN_ROWS floor
+    assert many > few
+    assert max_tokens_for(DOCUMENT_TASK, 40) > many
+    assert max_tokens_for(LINE_ITEMS_TASK, 1000, cap=4000) == 4000
+
+
+def _processor(monkeypatch, cap, limit):
+    """OpenRouterProcessor against a fake API that truncates replies above ``limit`` tokens."""
+    main = pytest.importorskip("main")
+    budgets = []
+    reply = {"line_items": [{"model_code": "A", "goods_description": "x", "quantity": 1, "unit_price": 1, "amount": 1}]}
+
+    def handler(request):
+        budget = json.loads(request.content)["max_tokens"]
+        budgets.append(budget)
+        full = json.dumps(reply)
+        if budget < limit:
+            return httpx.Response(200, json={"choices": [{"message": {"content": full[:20]}, "finish_reason": "length"}],
+                                             "usage": {"completion_tokens": budget}})
+        return httpx.Response(200, json={"choices": [{"message": {"content": full}, "finish_reason": "stop"}]})
+
+    monkeypatch.setattr(main, "_max_output_tokens", lambda name, provider="openrouter": cap)
+    processor = main.OpenRouterProcessor("test-key", "test/model")
+    processor.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return processor, budgets
+
+
+def test_processor_retries_a_truncated_reply_with_a_doubled_budget(monkeypatch):
+    processor, budgets = _processor(monkeypatch, cap=4000, limit=max_tokens_for(LINE_ITEMS_TASK, 5) + 1)
+    res = asyncio.run(processor.process_with_prompt(b"img", "a.pdf", "rows", LINE_ITEMS_TASK, "invoice", 5))
+    assert len(res["extracted_fields"]["line_items"]) == 1
+    assert budgets == [max_tokens_for(LINE_ITEMS_TASK, 5), 2 * max_tokens_for(LINE_ITEMS_TASK, 5)]
+    stats = OUTPUT_STATS.describe()["processor:test/model"]
+    assert stats["truncated"] >= 1 and stats["calls"] > stats["truncated"]
+
+
+def test_processor_does_not_retry_past_the_model_cap(monkeypatch):
+    first = max_tokens_for(LINE_ITEMS_TASK, 5)
+    processor, budgets = _processor(monkeypatch, cap=first, limit=10 ** 6)
+    with pytest.raises(TruncatedOutput):
+        asyncio.run(processor.process_with_prompt(b"img", "a.pdf", "rows", LINE_ITEMS_TASK, "invoice", 5))
+    assert budgets == [first]
+
+
+def test_processor_uses_the_doc_type_prompt_and_schema(monkeypatch):
+    main = pytest.importorskip("main")
+    sent = []
+
+    def handler(request):
+        sent.append(json.loads(request.content))
+        schema = schema_for(DOCUMENT_TASK, "certificate")
+        reply = {**dict.fromkeys(schema["properties"]), "certificate_number": "C-1", "line_items": []}
+        return httpx.Response(200, json={"choices": [{"message": {"content": json.dumps(reply)}, "finish_reason": "stop"}]})
+
+    monkeypatch.setattr(main, "_supports_structured_output", lambda name, provider="openrouter": True)
+    processor = main.OpenRouterProcessor("test-key", "test/model")
+    processor.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    res = asyncio.run(processor.process_document(b"img", "coo.pdf", doc_type="certificate"))
+
+    body = sent[0]
+    assert "trade certificate" in body["messages"][0]["content"][-1]["text"]
+    assert body["response_format"] == response_format(DOCUMENT_TASK, "certificate")
+    assert res["extracted_fields"]["certificate_number"] == "C-1"
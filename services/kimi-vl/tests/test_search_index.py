@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from search_index import DocumentIndex
+
+
+def _result(number, seller, buyer="Beyan Ltd", total=100.0, date="2024-09-30", items=()):
+    return {
+        "confidence": 0.9,
+        "extracted_fields": {
+            "invoice_number": number,
+            "invoice_date": date,
+            "seller": {"name": seller},
+            "buyer": {"name": buyer},
+            "total_amount": total,
+            "total_currency": "USD",
+            "line_items": [{"model_code": code, "goods_description": desc} for code, desc in items],
+        },
+    }
+
+
+@pytest.fixture
+def index(tmp_path):
+    idx = DocumentIndex(str(tmp_path / "index.sqlite3"))
+    idx.index_result("a", "a.pdf", _result("INV-1", "Xin Trading", total=50.0, items=[("V-10", "brass valve")]),
+                     saved_at="2024-10-01T00:00:00")
+    idx.index_result("b", "b.pdf", _result("INV-2", "100% Cotton_Mills", total=500.0, date="2024-08-01"),
+                     saved_at="2024-10-02T00:00:00")
+    idx.index_result("c", "c.pdf", _result("INV-3", "100X Cotton Mills", total=900.0), saved_at="2024-10-03T00:00:00")
+    yield idx
+    idx.close()
+
+
+def _numbers(page):
+    return [item["invoice_number"] for item in page["items"]]
+
+
+def test_exact_and_range_filters(index):
+    assert _numbers(index.search(invoice_number="INV-2")) == ["INV-2"]
+    assert _numbers(index.search(total_min=100, total_max=600)) == ["INV-2"]
+    assert _numbers(index.search(date_to="2024-08-31")) == ["INV-2"]
+
+
+def test_dates_are_normalised_for_range_filters(tmp_path):
+    idx = DocumentIndex(str(tmp_path / "dates.sqlite3"))
+    try:
+        for n, date in enumerate(["2024-03-05", "05.03.2024", "2024/03/05", "March 5, 2024", "soon", "2024-04-02"]):
+            idx.index_result(str(n), f"{n}.pdf", _result(f"INV-{n}", "Xin Trading", date=date))
+        march = idx.search(date_from="2024-03-01", date_to="2024-03-31")
+        assert sorted(_numbers(march)) == ["INV-0", "INV-1", "INV-2", "INV-3"]
+        assert {item["invoice_date"] for item in march["items"]} == {"2024-03-05"}
+        assert idx.search(invoice_number="INV-4")["items"][0]["invoice_date"] is None
+    finally:
+        idx.close()
+
+
+def test_seller_prefix_matches_wildcards_literally(index):
+    assert _numbers(index.search(seller="100% Cotton_")) == ["INV-2"]
+    assert _numbers(index.search(seller="100")) == ["INV-3", "INV-2"]
+    assert index.search(seller="%")["items"] == []
+
+
+def test_full_text_query_finds_line_item_words(index):
+    assert _numbers(index.search(q="brass")) == ["INV-1"]
+    assert _numbers(index.search(q="valv")) == ["INV-1"]
+
+
+def test_query_without_tokens_matches_nothing(index):
+    page = index.search(q="*** ")
+    assert page["items"] == [] and page["has_more"] is False
+
+
+def test_pagination_is_newest_first(index):
+    first = index.search(limit=2)
+    assert _numbers(first) == ["INV-3", "INV-2"] and first["next_offset"] == 2
+    second = index.search(limit=2, offset=first["next_offset"])
+    assert _numbers(second) == ["INV-1"] and second["has_more"] is False
+
+
+def test_reindexing_an_artifact_updates_it(index):
+    index.index_result("a", "a.pdf", _result("INV-1", "Renamed Supplier"), saved_at="2024-10-01T00:00:00")
+    assert index.count() == 3
+    assert _numbers(index.search(seller="Renamed")) == ["INV-1"]
+    assert index.search(q="brass")["items"] == []
+
+
+def test_rebuild_skips_json_that_is_not_a_result(tmp_path):
+    root = tmp_path / "processed"
+    (root / "2024__inv.pdf").mkdir(parents=True)
+    (root / "2024__inv.pdf" / "output.json").write_text(json.dumps(_result("INV-9", "Xin Trading")))
+    (root / "templates.json").write_text(json.dumps({"templates": {}}))
+    (root / "flat.json").write_text(json.dumps(_result("INV-8", "Flat Seller")))
+
+    idx = DocumentIndex(str(tmp_path / "rebuilt.sqlite3"))
+    try:
+        assert idx.rebuild(str(root)) == 2
+        assert sorted(_numbers(idx.search())) == ["INV-8", "INV-9"]
+        assert idx.search(invoice_number="INV-9")["items"][0]["filename"] == "inv.pdf"
+    finally:
+        idx.close()
@@ -0,0 +1,78 @@
+import asyncio
+
+from shared_state import MemoryBackend, SharedState, RECENT_WINDOW
+
+
+class BrokenBackend:
+    name = "broken"
+
+    def __getattr__(self, attr):
+        async def fail(*args, **kwargs):
+            raise ConnectionError("redis is down")
+        return fail
+
+
+def test_result_cache_round_trip_and_ttl_zero_disables():
+    async def run():
+        cached = SharedState(MemoryBackend(), cache_ttl=60)
+        await cached.put_result("k", {"invoice_number": "A-1", "line_items": []})
+        off = SharedState(MemoryBackend(), cache_ttl=0)
+        await off.put_result("k", {"x": 1})
+        return await cached.get_result("k"), await cached.get_result("other"), await off.get_result("k")
+
+    hit, miss, disabled = asyncio.run(run())
+    assert hit == {"invoice_number": "A-1", "line_items": []}
+    assert miss is None and disabled is None
+
+
+def test_rate_limit_counts_per_client_window():
+    async def run():
+        state = SharedState(MemoryBackend())
+        results = [await state.check_rate_limit("client-a", 2) for _ in range(3)]
+        return results, await state.check_rate_limit("client-b", 2)
+
+    results, other = asyncio.run(run())
+    assert [allowed for allowed, _ in results] == [True, True, False]
+    assert results[-1][1] >= 1
+    assert other == (True, 0)
+
+
+def test_model_stats_report_recent_outage():
+    async def run():
+        state = SharedState(MemoryBackend())
+        for _ in range(50):
+            await state.record_model_call("vision.gpt-4o-mini", 100.0, True)
+        for _ in range(RECENT_WINDOW):
+            await state.record_model_call("vision.gpt-4o-mini", 5000.0, False)
+        return (await state.model_stats())["vision.gpt-4o-mini"]
+
+    st = asyncio.run(run())
+    assert st["calls"] == 50 + RECENT_WINDOW
+    assert st["recent_error_rate"] == 1.0
+    assert st["recent_avg_latency_ms"] == 5000.0
+    assert 0 < st["error_rate"] < 1
+
+
+def test_published_config_version_is_shared():
+    async def run():
+        backend = MemoryBackend()
+        await SharedState(backend).publish_config_version("router", "abc123")
+        return await SharedState(backend).config_version("router"), await SharedState(backend).config_version("other")
+
+    assert asyncio.run(run()) == ("abc123", None)
+
+
+def test_backend_failures_never_fail_the_request():
+    async def run():
+        state = SharedState(BrokenBackend(), cache_ttl=60)
+        await state.put_result("k", {"x": 1})
+        await state.record_model_call("m", 1.0, True)
+        await state.publish_config_version("router", "v")
+        return (
+            await state.get_result("k"),
+            await state.model_stats(),
+            await state.check_rate_limit("c", 1),
+            await state.config_version("router"),
+        )
+
+    assert asyncio.run(run()) == (None, {}, (True, 0), None)
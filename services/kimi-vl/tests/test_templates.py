@@ -0,0 +1,109 @@
+import json
+
+import fitz  # PyMuPDF
+
+from templates import TemplateStore, _lines, apply_template, learn_template, page_words, parse_number, validate
+
+
+def _invoice(number, buyer, rows, date="12.03.2024"):
+    """One-page supplier invoice; every call has the same layout."""
+    total = round(sum(q * p for _, _, q, p in rows), 2)
+    doc = fitz.open()
+    page = doc.new_page(width=595, height=842)
+    text = [
+        (40, 50, "ACME INDUSTRIAL SUPPLY COMPANY"),
+        (40, 68, "Harbour Road Warehouse District"),
+        (40, 86, "Telephone Facsimile Registration"),
+        (360, 110, "COMMERCIAL INVOICE"),
+        (360, 140, f"Invoice No: {number}"),
+        (360, 156, f"Invoice Date: {date}"),
+        (40, 140, "Bill To:"),
+        (40, 156, buyer),
+        (40, 172, "Payment Terms Delivery Incoterms"),
+        (40, 230, "Code"), (110, 230, "Description"), (330, 230, "Quantity"), (410, 230, "Price"), (490, 230, "Amount"),
+    ]
+    y = 254
+    for code, desc, qty, price in rows:
+        text += [(40, y, code), (110, y, desc), (330, y, f"{qty}"), (410, y, f"{price:,.2f}"), (490, y, f"{qty * price:,.2f}")]
+        y += 18
+    text += [(410, y + 20, "TOTAL"), (450, y + 20, "USD"), (490, y + 20, f"{total:,.2f}")]
+    for x, yy, s in text:
+        page.insert_text((x, yy), s, fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    fields = {
+        "invoice_number": number,
+        "invoice_date": "2024-03-12",
+        "buyer": {"name": buyer},
+        "seller": {"name": "ACME INDUSTRIAL SUPPLY COMPANY"},
+        "total_amount": total,
+        "total_currency": "USD",
+        "line_items": [
+            {"model_code": c, "goods_description": d, "quantity": q, "unit_price": p, "amount": round(q * p, 2)}
+            for c, d, q, p in rows
+        ],
+    }
+    return data, fields
+
+
+FIRST = _invoice("INV-1001", "Beyan Ltd", [("V-10", "Brass valve", 10, 12.5), ("P-20", "Steel pipe", 4, 1250.0)])
+SECOND = _invoice("INV-1002", "Other Buyer GmbH", [
+    ("V-10", "Brass valve", 2, 12.5), ("F-30", "Flange", 7, 30.0), ("P-20", "Steel pipe", 1, 1250.0),
+])
+
+
+def test_parse_number_handles_both_decimal_styles():
+    assert parse_number("1,234.50") == 1234.5
+    assert parse_number("1.234,50", ",") == 1234.5
+    assert parse_number("$99.00") == 99.0
+    assert parse_number("Total") is None
+
+
+def test_learned_template_extracts_another_invoice_of_the_layout():
+    data, fields = FIRST
+    template, reason = learn_template(page_words(data), fields)
+    assert reason == "ok"
+    assert "total_amount" in template["fields"] and "amount" in template["table"]["columns"]
+
+    other, truth = SECOND
+    got = apply_template(template, [_lines(p) for p in page_words(other)])
+    assert validate(got) is None
+    assert got["invoice_number"] == "INV-1002"
+    assert got["total_amount"] == truth["total_amount"]
+    assert [r["amount"] for r in got["line_items"]] == [r["amount"] for r in truth["line_items"]]
+
+
+def test_learning_needs_line_items_that_reproduce():
+    data, fields = FIRST
+    template, reason = learn_template(page_words(data), {**fields, "line_items": []})
+    assert template is None and reason == "no line items to learn columns from"
+    wrong = [{**r, "amount": r["amount"] + 1000} for r in fields["line_items"]]
+    template, _ = learn_template(page_words(data), {**fields, "line_items": wrong})
+    assert template is None
+
+
+def test_store_learns_then_hits_and_keeps_other_workers_templates(tmp_path):
+    path = str(tmp_path / "templates.json")
+    store = TemplateStore(path, save_interval=0)
+    assert store.extract(SECOND[0])["status"] == "miss"
+    assert store.learn(*FIRST)["learned"] is True
+
+    report = store.extract(SECOND[0])
+    assert report["status"] == "hit"
+    assert report["fields"]["invoice_number"] == "INV-1002"
+
+    # Another worker sharing the file counts its own hit; neither save loses the other's
+    other = TemplateStore(path, save_interval=0)
+    assert other.extract(SECOND[0])["status"] == "hit"
+    store.save(force=True)
+    saved = json.loads(open(path).read())["templates"]
+    assert [t["stats"]["hits"] for t in saved] == [2]
+
+
+def test_scans_without_text_layer_are_skipped(tmp_path, sample_doc):
+    store = TemplateStore(str(tmp_path / "templates.json"))
+    doc = fitz.open()
+    doc.new_page()
+    assert store.extract(doc.tobytes())["status"] == "no_text_layer"
+    assert page_words(sample_doc("photo")) is None
+
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from tracing import JsonlExporter, Tracer, build_exporters, span
+
+
+class ListExporter:
+    name = "list"
+
+    def __init__(self, fail=False):
+        self.traces = []
+        self.fail = fail
+
+    def export(self, traces):
+        if self.fail:
+            raise ConnectionError("collector unreachable")
+        self.traces.extend(traces)
+
+
+def test_span_outside_a_trace_is_a_noop():
+    with span("decode", pages=2) as sp:
+        sp.set(mime="application/pdf")
+
+
+def test_spans_nest_across_tasks_and_export_in_batches(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    memory = ListExporter()
+    tracer = Tracer([memory, JsonlExporter(str(path))], sample_rate=1.0, flush_ms=10)
+
+    async def page(n):
+        with span("extract_page", page=n):
+            await asyncio.sleep(0)
+
+    async def run():
+        await tracer.start()
+        async with tracer.trace("orchestrate", filename="a.pdf"):
+            with span("pipeline"):
+                await asyncio.gather(page(1), page(2))
+        await tracer.close()
+
+    asyncio.run(run())
+    (trace,) = memory.traces
+    by_name = {s.name: s for s in trace.spans}
+    assert trace.kept_reason == "head"
+    assert by_name["pipeline"].parent_id == trace.root.span_id
+    pages = [s for s in trace.spans if s.name == "extract_page"]
+    assert [s.parent_id for s in pages] == [by_name["pipeline"].span_id] * 2
+    exported = json.loads(path.read_text())
+    assert exported["name"] == "orchestrate" and len(exported["spans"]) == 4
+
+
+def test_unsampled_traces_are_kept_only_when_failed_or_slow():
+    memory = ListExporter()
+    tracer = Tracer([memory], sample_rate=0.0, slow_ms=20, flush_ms=10)
+
+    async def run():
+        await tracer.start()
+        async with tracer.trace("process"):
+            pass
+        with pytest.raises(ValueError):
+            async with tracer.trace("process"):
+                with span("extract"):
+                    raise ValueError("bad reply")
+        active = tracer.begin("process")
+        time.sleep(0.03)
+        tracer.end(active)
+        await tracer.close()
+
+    asyncio.run(run())
+    assert [t.kept_reason for t in memory.traces] == ["error", "slow"]
+    assert tracer.counters["discarded"] == 1
+    assert memory.traces[0].spans[1].error == "ValueError: bad reply"
+
+
+def test_export_failure_and_full_queue_never_reach_the_request():
+    tracer = Tracer([ListExporter(fail=True)], sample_rate=1.0, queue_size=1, flush_ms=10)
+
+    async def run():
+        for _ in range(3):  # exporter not started yet: the queue holds one
+            async with tracer.trace("process"):
+                pass
+        await tracer.start()
+        await tracer.close()
+
+    asyncio.run(run())
+    assert tracer.counters["dropped_queue_full"] == 2
+    assert tracer.counters["export_errors"] == 1
+
+
+def test_unknown_exporters_are_ignored(tmp_path):
+    exporters = build_exporters("jsonl, nope", "beyan", str(tmp_path / "t.jsonl"))
+    assert [e.name for e in exporters] == ["jsonl"]
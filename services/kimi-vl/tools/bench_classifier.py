@@ -0,0 +1,149 @@
+"""
+Accuracy and latency of the local doc-type classifier.
+
+    python tools/bench_classifier.py --samples ../../sample_docs --synthetic 50
+
+Scores the labelled sample documents plus synthetic invoices, packing lists
+and certificates of origin rendered with PyMuPDF. The synthetic documents
+reuse each other's body vocabulary (weights on invoices, invoice numbers on
+packing lists) so the title has to carry the decision. Documents without a
+text layer (photos, scans) are listed separately; they are not counted in
+accuracy.
+"""
+
+import argparse
+import glob
+import os
+import random
+import statistics
+import sys
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # noqa: E402
+
+from classifier import DOC_TYPES, OTHER, classify_document  # noqa: E402
+
+# Ground truth for sample_docs; files not listed are labelled by filename
+SAMPLE_LABELS = {
+    "2640316788_Commercial Invoice_1.pdf": "invoice",
+    "2640316788_Packing List_1.pdf": "packing_list",
+    "XIN_F2_2100504266.pdf": "invoice",
+    "WhatsApp Image 2024-09-30 at 14.56.01.jpeg": OTHER,  # customs declaration screenshot
+}
+
+TITLES = {
+    "invoice": ["COMMERCIAL INVOICE", "Sales Invoice", "INVOICE", "TAX INVOICE", "Proforma Invoice"],
+    "packing_list": ["PACKING LIST", "Packing Slip", "PACKING LIST / CEKI LISTESI"],
+    "certificate": ["CERTIFICATE OF ORIGIN", "Certificate of Analysis", "MOVEMENT CERTIFICATE EUR.1"],
+}
+SHARED_BODY = [
+    "Seller: ACME Manufacturing Co. Ltd.", "Consignee: Beyan Trading A.S., Istanbul",
+    "Invoice No. & Date: {num} 25.SEP.2024", "Country of origin: Made in Indonesia",
+    "Delivery and Payment Term: FCA", "Gross weight {w} KG", "Net weight {n} KG", "{c} cartons",
+    "Vessel/Flight: SV817", "Marks and numbers: N/M",
+]
+TYPE_BODY = {
+    "invoice": ["Unit Price", "Amount", "Total Amount USD {t}", "IBAN TR00 0000 0000", "VAT 20%", "Due date 30 days"],
+    "packing_list": ["Package No.", "Measurement CBM {m}", "G.W / N.W per carton", "Pallet 1 of 2", "CTNS"],
+    "certificate": [
+        "The undersigned hereby certify that the goods described above originate in Indonesia",
+        "Issuing authority: Chamber of Commerce and Industry", "Certified by", "Declaration by the exporter",
+    ],
+}
+
+
+def synthetic_pdf(doc_type: str, rng: random.Random) -> bytes:
+    doc = fitz.open()
+    page = doc.new_page()
+    y = 60
+    page.insert_text((72, y), rng.choice(TITLES[doc_type]), fontsize=16)
+    lines = rng.sample(SHARED_BODY, k=rng.randint(5, len(SHARED_BODY))) + rng.sample(
+        TYPE_BODY[doc_type], k=rng.randint(2, len(TYPE_BODY[doc_type]))
+    )
+    rng.shuffle(lines)
+    # A table the size of a real document, with no type vocabulary at all
+    lines += [f"{i + 1}  MODEL-{rng.randint(1000, 9999)}  Spare part {i}  {rng.randint(1, 50)}  {rng.randint(1, 999)}.00"
+              for i in range(rng.randint(5, 30))]
+    for line in lines:
+        y += 16
+        if y > 800:
+            page = doc.new_page()
+            y = 60
+        page.insert_text((72, y), line.format(
+            num=rng.randint(10 ** 9, 10 ** 10 - 1), w=rng.randint(10, 900), n=rng.randint(5, 800),
+            c=rng.randint(1, 90), t=rng.randint(100, 99999), m=round(rng.uniform(0.1, 9), 2),
+        ), fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def run(docs: List[Tuple[str, str, bytes]], repeat: int) -> None:
+    confusion: Dict[Tuple[str, str], int] = {}
+    latencies: List[float] = []
+    correct = scored = 0
+    no_text: List[str] = []
+    low_conf = 0
+    for name, label, data in docs:
+        res = classify_document(data)
+        for _ in range(repeat - 1):
+            res = classify_document(data)
+        latencies.append(res["ms"])
+        if res["method"] == "no_text_layer":
+            no_text.append(name)
+            continue
+        scored += 1
+        correct += res["doc_type"] == label
+        low_conf += res["confidence"] < 0.5
+        confusion[(label, res["doc_type"])] = confusion.get((label, res["doc_type"]), 0) + 1
+        if res["doc_type"] != label:
+            print(f"  miss: {name} expected {label}, got {res['doc_type']} ({res['confidence']}) {res['scores']}")
+
+    labels = list(DOC_TYPES) + [OTHER]
+    print(f"accuracy {correct}/{scored} = {correct / max(1, scored):.1%}, {low_conf} below 0.5 confidence")
+    print("confusion (rows = truth):")
+    print(" " * 14 + "".join(f"{lab:>14}" for lab in labels))
+    for truth in labels:
+        print(f"{truth:<14}" + "".join(f"{confusion.get((truth, pred), 0):>14}" for pred in labels))
+    latencies.sort()
+    print(f"latency per document: mean {statistics.mean(latencies):.2f} ms, "
+          f"p50 {latencies[len(latencies) // 2]:.2f} ms, max {latencies[-1]:.2f} ms")
+    if no_text:
+        print(f"no text layer (not scored): {', '.join(no_text)}")
+
+
+def load_samples(folder: Optional[str]) -> List[Tuple[str, str, bytes]]:
+    docs = []
+    for path in sorted(glob.glob(os.path.join(folder, "*"))) if folder else []:
+        name = os.path.basename(path)
+        lowered = name.lower()
+        label = SAMPLE_LABELS.get(name) or (
+            "packing_list" if "packing" in lowered else "certificate" if "certificate" in lowered
+            else "invoice" if "invoice" in lowered else None
+        )
+        if label is None:
+            continue
+        with open(path, "rb") as f:
+            docs.append((name, label, f.read()))
+    return docs
+
+
+if __name__ == "__main__":
+    default_samples = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "sample_docs")
+    parser = argparse.ArgumentParser(description="Benchmark the local document classifier.")
+    parser.add_argument("--samples", default=default_samples)
+    parser.add_argument("--synthetic", type=int, default=50, help="synthetic documents per type")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per document; the last one is timed")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples if os.path.isdir(args.samples) else None)
+    if samples:
+        print(f"== sample documents ({len(samples)})")
+        run(samples, args.repeat)
+    rng = random.Random(args.seed)
+    synthetic = [(f"synthetic-{t}-{i}", t, synthetic_pdf(t, rng)) for t in DOC_TYPES for i in range(args.synthetic)]
+    print(f"== synthetic documents ({len(synthetic)})")
+    run(synthetic, args.repeat)
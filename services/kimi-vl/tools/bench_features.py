@@ -0,0 +1,108 @@
+"""
+Accuracy and cost of the routing feature extraction (features.py).
+
+    python tools/bench_features.py --docs 40 --scan-dpi 150
+
+Synthetic invoices with a known number of line items (some with wrapped
+descriptions, some spread over several pages) are scored twice: as PDFs
+with a text layer, and rasterized to PNG to exercise the thumbnail path
+used for scans. Reports the error of ``expected_line_items`` and the cost
+per page for each path; scan timings include decoding the PNG.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # noqa: E402
+
+from features import extract_features  # noqa: E402
+
+ROWS_PER_PAGE = 40
+
+
+def synthetic_invoice(items: int, rng: random.Random) -> bytes:
+    doc = fitz.open()
+    page = doc.new_page()
+    y = 60
+    page.insert_text((72, y), "COMMERCIAL INVOICE", fontsize=16)
+    for line in ("Seller: ACME Manufacturing Co. Ltd.", "Buyer: Beyan Trading A.S., Istanbul",
+                 f"Invoice No. {rng.randint(10 ** 6, 10 ** 7)}  Date 25.09.2024", "Terms: FCA Jakarta"):
+        y += 16
+        page.insert_text((72, y), line, fontsize=9)
+    y += 30
+    columns = (40, 110, 330, 390, 460)
+    for x, head in zip(columns, ("Code", "Description", "Qty", "Unit price", "Amount")):
+        page.insert_text((x, y), head, fontsize=9)
+    total = 0.0
+    for i in range(items):
+        y += 14
+        if y > 790:
+            page = doc.new_page()
+            y = 50
+        qty, price = rng.randint(1, 300), round(rng.uniform(1, 99), 2)
+        total += qty * price
+        cells = (f"M-{rng.randint(1000, 9999)}", f"Spare part {i}", str(qty), f"{price:.2f}", f"{qty * price:,.2f}")
+        for x, text in zip(columns, cells):
+            page.insert_text((x, y), text, fontsize=9)
+        if rng.random() < 0.25:  # wrapped description
+            y += 12
+            page.insert_text((110, y), "for washing machine, OEM", fontsize=9)
+    y += 20
+    page.insert_text((330, y), "TOTAL", fontsize=9)
+    page.insert_text((460, y), f"{total:,.2f}", fontsize=9)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def rasterize(pdf: bytes, dpi: int) -> List[bytes]:
+    with fitz.open(stream=pdf, filetype="pdf") as doc:
+        return [page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY).tobytes("png") for page in doc]
+
+
+def report(label: str, results: List[Tuple[int, int, int, float]]) -> None:
+    errors = [abs(est - truth) for truth, est, _, _ in results]
+    rel = [abs(est - truth) / max(1, truth) for truth, est, _, _ in results]
+    pages = sum(p for _, _, p, _ in results)
+    ms = sum(t for _, _, _, t in results)
+    high = sum(1 for truth, est, _, _ in results if est > truth)
+    print(f"  {label:<11} exact {sum(e == 0 for e in errors)}/{len(errors)}   MAE {statistics.mean(errors):5.1f} rows   "
+          f"within 20% {sum(r <= 0.2 for r in rel)}/{len(rel)}   over-estimates {high}   "
+          f"{ms / pages:6.2f} ms/page")
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    text: List[Tuple[int, int, int, float]] = []
+    scan: List[Tuple[int, int, int, float]] = []
+    for _ in range(args.docs):
+        items = rng.randint(1, args.max_items)
+        pdf = synthetic_invoice(items, rng)
+        res = extract_features(pdf)
+        text.append((items, res["expected_line_items"], res["analysed_pages"], res["ms"]))
+        # A scan arrives as one image per page; sum the per-image estimates
+        estimate, ms, pages = 0, 0.0, 0
+        for png in rasterize(pdf, args.scan_dpi):
+            page_res = extract_features(png)
+            estimate += page_res["expected_line_items"]
+            ms += page_res["ms"]
+            pages += 1
+        scan.append((items, estimate, pages, ms))
+    print(f"{args.docs} synthetic invoices, 1-{args.max_items} line items, ~{ROWS_PER_PAGE} rows per page")
+    report("text layer", text)
+    report(f"scan {args.scan_dpi}dpi", scan)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark routing feature extraction.")
+    parser.add_argument("--docs", type=int, default=40)
+    parser.add_argument("--max-items", type=int, default=120)
+    parser.add_argument("--scan-dpi", type=int, default=150)
+    parser.add_argument("--seed", type=int, default=7)
+    main(parser.parse_args())
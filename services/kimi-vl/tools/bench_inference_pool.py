@@ -0,0 +1,164 @@
+"""
+API responsiveness and throughput with the local model in-process vs. in an
+InferencePool of worker processes.
+
+    python tools/bench_inference_pool.py --docs 40 --pages 4 --concurrency 8 --workers 2
+
+Both modes feed the same MicroBatcher that LocalProcessor uses. The stub
+model spends ``--gil-ms`` per page in pure Python (holding the GIL, like
+pre/post-processing) and ``--sleep-ms`` per batch with the GIL released
+(like GPU kernels), after checksumming the page bytes it was handed.
+
+"loop lag" is how late a 5 ms timer fires on the API event loop while the
+load runs: every other request (health checks, uploads, routed calls) waits
+that long before it is even looked at. Pages are ``--page-kb`` of random
+bytes, the size of a full-resolution page PNG.
+
+With one CPU core the pool cannot add throughput, only responsiveness;
+run with --workers up to the core (or GPU) count for the throughput side.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import zlib
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import MicroBatcher, PageRequest  # noqa: E402
+from inference_pool import InferencePool  # noqa: E402
+
+
+def busy(iterations: int) -> int:
+    n = 0
+    for i in range(iterations):
+        n += i & 7
+    return n
+
+
+def iterations_per_ms() -> int:
+    started = time.perf_counter()
+    busy(200_000)
+    return int(200_000 / ((time.perf_counter() - started) * 1000))
+
+
+class StubModel:
+    """CPU- and GIL-bound stand-in. The work is a fixed iteration count
+    (calibrated once in the parent), so processes sharing a core slow each
+    other down as a real model would. Settings come from the environment so
+    worker processes pick them up."""
+
+    def __init__(self, model_path: str):
+        self.iterations = int(float(os.getenv("STUB_GIL_MS", "20")) * int(os.getenv("STUB_ITERS_PER_MS") or iterations_per_ms()))
+        self.sleep_s = float(os.getenv("STUB_SLEEP_MS", "10")) / 1000.0
+
+    def predict_batch(self, pages: List[PageRequest]) -> List[Dict[str, Any]]:
+        out = []
+        for page in pages:
+            checksum = zlib.crc32(page.image)
+            busy(self.iterations)
+            out.append({"filename": page.filename, "crc32": checksum, "bytes": len(page.image)})
+        time.sleep(self.sleep_s)
+        return out
+
+
+def stub_model(model_path: str) -> StubModel:
+    return StubModel(model_path)
+
+
+async def loop_lag(stop: asyncio.Event, samples: List[float]) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        samples.append((time.perf_counter() - started - 0.005) * 1000)
+
+
+async def run(batcher: MicroBatcher, args: argparse.Namespace, pages: List[bytes]) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    checks: List[bool] = []
+
+    async def document(d: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            results = await asyncio.gather(*[
+                batcher.submit(img, f"doc{d}#p{i}") for i, img in enumerate(pages, start=1)
+            ])
+            latencies.append((time.perf_counter() - started) * 1000)
+            checks.extend(r["crc32"] == zlib.crc32(img) for r, img in zip(results, pages))
+
+    stop = asyncio.Event()
+    lag: List[float] = []
+    probe = asyncio.create_task(loop_lag(stop, lag))
+    await asyncio.sleep(0.2)
+    idle_lag = list(lag)
+    started = time.perf_counter()
+    await asyncio.gather(*[document(d) for d in range(args.docs)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    lag = lag[len(idle_lag):]
+    latencies.sort()
+    lag.sort()
+    return {
+        "pages_per_s": args.docs * len(pages) / elapsed,
+        "doc_p50": latencies[len(latencies) // 2],
+        "doc_p95": latencies[int(len(latencies) * 0.95) - 1],
+        "lag_p50": lag[len(lag) // 2],
+        "lag_p99": lag[int(len(lag) * 0.99) - 1],
+        "lag_max": lag[-1],
+        "intact": all(checks),
+        "batching": batcher.stats(),
+    }
+
+
+def report(label: str, res: Dict[str, Any]) -> None:
+    print(f"  {label:<14} {res['pages_per_s']:7.1f} pages/s   doc p50 {res['doc_p50']:7.0f} ms  p95 {res['doc_p95']:7.0f} ms   "
+          f"loop lag p50 {res['lag_p50']:5.1f} ms  p99 {res['lag_p99']:6.1f} ms  max {res['lag_max']:6.1f} ms   "
+          f"avg batch {res['batching']['avg_batch_size']}   pages intact {res['intact']}")
+
+
+async def main(args: argparse.Namespace) -> None:
+    os.environ["STUB_GIL_MS"] = str(args.gil_ms)
+    os.environ["STUB_SLEEP_MS"] = str(args.sleep_ms)
+    os.environ["STUB_ITERS_PER_MS"] = str(max(iterations_per_ms() for _ in range(3)))
+    pages = [os.urandom(args.page_kb * 1024) for _ in range(args.pages)]
+    print(f"{args.docs} docs x {args.pages} pages of {args.page_kb} KiB, {args.concurrency} concurrent; "
+          f"stub {args.gil_ms} ms GIL-bound per page + {args.sleep_ms} ms released per batch; cpus {os.cpu_count()}")
+
+    batcher = MicroBatcher(StubModel("stub"), max_batch_size=args.batch_size, max_wait_ms=args.wait_ms)
+    report("in-process", await run(batcher, args, pages))
+    await batcher.close()
+
+    pool = InferencePool(
+        "bench_inference_pool:stub_model", "stub", workers=args.workers,
+        slots=args.batch_size * 2, slot_bytes=max(1, args.page_kb * 1024),
+    )
+    await asyncio.to_thread(pool.start)
+    try:
+        batcher = MicroBatcher(pool, max_batch_size=args.batch_size, max_wait_ms=args.wait_ms, max_inflight=args.workers)
+        report(f"pool x{args.workers}", await run(batcher, args, pages))
+        await batcher.close()
+        stats = pool.stats()
+        print(f"  pool: restarts {stats['restarts']}, oversize pages {stats['oversize_pages']}, "
+              f"{stats['shm_bytes_written'] / (1 << 20):.0f} MiB written to shared memory, "
+              f"pages per worker {[w['pages'] for w in stats['workers']]}")
+    finally:
+        await asyncio.to_thread(pool.close)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark in-process vs. out-of-process local inference.")
+    parser.add_argument("--docs", type=int, default=40)
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--wait-ms", type=float, default=20.0)
+    parser.add_argument("--page-kb", type=int, default=1500)
+    parser.add_argument("--gil-ms", type=float, default=20.0)
+    parser.add_argument("--sleep-ms", type=float, default=10.0)
+    asyncio.run(main(parser.parse_args()))
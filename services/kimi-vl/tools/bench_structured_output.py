@@ -0,0 +1,137 @@
+"""
+Output tokens and latency with and without schema-constrained output.
+
+    python tools/bench_structured_output.py --calls 20 --rows 25 --ms-per-token 8
+    python tools/bench_structured_output.py --base-url http://localhost:8080/v1 --model local-vl --pdf invoice.pdf
+
+"before" is the old request: prose schema in the prompt, no response_format,
+no max_tokens. "after" adds the task's strict json_schema and a max_tokens
+derived from the expected row count (schemas.max_tokens_for). Each reply is
+parsed and validated against the task schema.
+
+Without --base-url an in-process stub server is started
+(tools/stub_openai_server.py). It models the usual difference between the
+two modes: fenced pretty-printed JSON plus prose versus compact bare JSON,
+with decode time proportional to output tokens. Its numbers show the
+mechanics; point --base-url at a real server (llama.cpp, vLLM, OpenRouter
+with --api-key) for real ones.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn  # noqa: E402
+
+from decoding import document_page_source  # noqa: E402
+from router.adapters.openai_compat import OpenAICompatAdapter, TruncatedOutput  # noqa: E402
+from schemas import HEADER_TASK, LINE_ITEMS_TASK, max_tokens_for, response_format, schema_for, validate  # noqa: E402
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_openai_server import build_app  # noqa: E402
+
+# Same prose prompts /orchestrate sends for invoices
+PROMPTS = {
+    HEADER_TASK: (
+        "Extract ONLY top-level header/footer fields for a commercial invoice and return valid JSON. "
+        "Schema: {\n  \"invoice_number\": \"string\",\n  \"invoice_date\": \"YYYY-MM-DD\",\n"
+        "  \"buyer\": {\"name\": \"string\", \"address\": \"string\"},\n  \"seller\": {\"name\": \"string\", \"address\": \"string\"},\n"
+        "  \"total_amount\": \"number\",\n  \"total_currency\": \"string\"\n}"
+    ),
+    LINE_ITEMS_TASK: (
+        "Extract ONLY line items from the page and return valid JSON with key 'line_items' as an array of rows. "
+        "Row Schema: {\n  \"model_code\": \"string\",\n  \"goods_description\": \"string\",\n  \"quantity\": \"number\",\n"
+        "  \"unit_price\": \"number\",\n  \"amount\": \"number\"\n}"
+    ),
+}
+
+
+def start_stub(rows: int, ms_per_token: float) -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    config = uvicorn.Config(build_app(0.0, 0.0, "local-vl", rows, ms_per_token), host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+def page_image(pdf: Optional[str]) -> bytes:
+    if pdf:
+        with open(pdf, "rb") as f:
+            _, _, render, encode, close = document_page_source(f.read(), max_side=2048, dpi=200)
+        try:
+            return encode(render(0))
+        finally:
+            close()
+    # 1x1 PNG; enough for servers that ignore the image
+    return bytes.fromhex(
+        "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+        "0000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+    )
+
+
+async def one(adapter: OpenAICompatAdapter, model: str, task: str, img: bytes, constrained: bool, rows: float) -> Dict[str, Any]:
+    kwargs: Dict[str, Any] = {}
+    if constrained:
+        kwargs = {"response_format": response_format(task), "max_tokens": max_tokens_for(task, rows)}
+    started = time.perf_counter()
+    out: Dict[str, Any] = {"tokens": None, "outcome": "ok"}
+    try:
+        res = await adapter.extract_json(PROMPTS[task], [img], model, **kwargs)
+        out["tokens"] = (res.get("usage") or {}).get("completion_tokens")
+        if validate(res["extracted_fields"], schema_for(task), allow_missing=not constrained):
+            out["outcome"] = "schema_invalid"
+    except TruncatedOutput as e:
+        out.update(tokens=e.usage.get("completion_tokens"), outcome="truncated")
+    except ValueError:
+        out["outcome"] = "parse_error"
+    out["ms"] = (time.perf_counter() - started) * 1000
+    return out
+
+
+def report(label: str, results: List[Dict[str, Any]]) -> Dict[str, float]:
+    tokens = [r["tokens"] for r in results if r["tokens"] is not None]
+    ms = sorted(r["ms"] for r in results)
+    failures = {k: sum(1 for r in results if r["outcome"] == k) for k in ("parse_error", "schema_invalid", "truncated")}
+    avg_tokens = statistics.mean(tokens) if tokens else float("nan")
+    print(f"  {label:<7} out tokens {avg_tokens:8.1f}   p50 {ms[len(ms) // 2]:8.1f} ms   "
+          f"mean {statistics.mean(ms):8.1f} ms   failures {failures}")
+    return {"tokens": avg_tokens, "p50": ms[len(ms) // 2]}
+
+
+async def main(args: argparse.Namespace) -> None:
+    base_url = args.base_url or start_stub(args.rows, args.ms_per_token)
+    adapter = OpenAICompatAdapter(base_url, api_key=args.api_key)
+    img = page_image(args.pdf)
+    for task in (HEADER_TASK, LINE_ITEMS_TASK):
+        print(f"{task} ({args.calls} calls per mode, expected rows {args.rows})")
+        results: Dict[str, List[Dict[str, Any]]] = {"before": [], "after": []}
+        for _ in range(args.calls):  # interleaved so drift hits both modes
+            for label, constrained in (("before", False), ("after", True)):
+                results[label].append(await one(adapter, args.model, task, img, constrained, args.rows))
+        before, after = report("before", results["before"]), report("after", results["after"])
+        print(f"  change  out tokens {after['tokens'] / before['tokens'] - 1:+.0%}   p50 {after['p50'] / before['p50'] - 1:+.0%}")
+    await adapter.client.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare output tokens/latency with and without structured output.")
+    parser.add_argument("--base-url", help="OpenAI-compatible endpoint; default: in-process stub")
+    parser.add_argument("--api-key")
+    parser.add_argument("--model", default="local-vl")
+    parser.add_argument("--pdf", help="send page 1 of this PDF instead of a blank image")
+    parser.add_argument("--calls", type=int, default=20)
+    parser.add_argument("--rows", type=int, default=25, help="line items per page (stub reply size and max_tokens sizing)")
+    parser.add_argument("--ms-per-token", type=float, default=8.0, help="stub decode time")
+    asyncio.run(main(parser.parse_args()))
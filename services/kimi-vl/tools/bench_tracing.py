@@ -0,0 +1,118 @@
+"""
+Measure what tracing adds to request latency.
+
+    python tools/bench_tracing.py --requests 2000 --pages 8 --export-delay-ms 200
+
+Each simulated request runs a real DocumentPipeline (render/encode/extract
+spans per page plus header and model_call spans) with instant model calls, so
+the numbers isolate tracing cost. The exporter sleeps ``--export-delay-ms``
+per batch to stand in for a slow LangSmith; with background export that delay
+must not show up in request latency.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline import DocumentPipeline  # noqa: E402
+from tracing import Trace, Tracer, span  # noqa: E402
+
+
+class SlowExporter:
+    name = "slow"
+
+    def __init__(self, delay_ms: float):
+        self.delay = delay_ms / 1000.0
+        self.traces = 0
+
+    def export(self, traces: List[Trace]) -> None:
+        time.sleep(self.delay)
+        self.traces += len(traces)
+
+
+async def one_request(tracer: Optional[Tracer], pages: int) -> float:
+    async def model(*_):
+        with span("model_call", model="bench"):
+            await asyncio.sleep(0)
+        return {}
+
+    async def page_fn(idx, img):
+        await model()
+        return [{"amount": 1.0}]
+
+    started = time.perf_counter()
+    active = tracer.begin("orchestrate", filename="bench.pdf") if tracer is not None else None
+    pipe = DocumentPipeline(pages, lambda i: b"x", lambda r: r, model, page_fn, queue_size=2, extract_concurrency=4)
+    with span("pipeline", pages=pages):
+        await pipe.run()
+    if active is not None:
+        tracer.end(active)
+    return time.perf_counter() - started
+
+
+def summary(label: str, samples: List[float]) -> None:
+    samples = sorted(samples)
+    p50, p99 = samples[len(samples) // 2], samples[int(len(samples) * 0.99)]
+    print(f"{label:<28} mean {statistics.mean(samples) * 1e3:7.3f} ms  p50 {p50 * 1e3:7.3f} ms  p99 {p99 * 1e3:7.3f} ms")
+
+
+def span_cost(n: int = 200_000) -> float:
+    t = Trace("bench", True, {})
+    from tracing import _current_trace, _current_span
+    tt, st = _current_trace.set(t), _current_span.set(t.root)
+    started = time.perf_counter()
+    for i in range(n):
+        with span("s", page=i):
+            pass
+    elapsed = time.perf_counter() - started
+    _current_span.reset(st)
+    _current_trace.reset(tt)
+    return elapsed / n
+
+
+async def main(args: argparse.Namespace) -> None:
+    print(f"span open/close: {span_cost() * 1e6:.2f} us")
+    configs = {"tracing off": None}
+    for rate in (1.0, 0.1):
+        configs[f"tracing on, sample {rate}"] = Tracer(
+            [SlowExporter(args.export_delay_ms)], sample_rate=rate, slow_ms=1e9,
+            queue_size=args.requests, batch_size=50, flush_ms=100,
+        )
+    samples = {label: [] for label in configs}
+    for tracer in configs.values():
+        if tracer is not None:
+            await tracer.start()
+    for _ in range(50):  # warm up the thread pool
+        await one_request(None, args.pages)
+    # Interleave configurations in short rounds so drift hits all of them equally.
+    per_round = max(1, args.requests // args.rounds)
+    for _ in range(args.rounds):
+        for label, tracer in configs.items():
+            samples[label].extend([await one_request(tracer, args.pages) for _ in range(per_round)])
+
+    for label, tracer in configs.items():
+        summary(label, samples[label])
+        if tracer is not None:
+            await tracer.close()
+            d = tracer.describe()
+            print(f"{'':<28} kept head/error/slow {d['kept_head']}/{d['kept_error']}/{d['kept_slow']}, "
+                  f"exported {d['exported']}, dropped {d['dropped_queue_full']}, avg batch {d['avg_export_batch_ms']} ms")
+    base = statistics.median(samples["tracing off"])
+    for label in list(configs)[1:]:
+        overhead = statistics.median(samples[label]) - base
+        print(f"p50 overhead, {label}: {overhead * 1e6:+.1f} us/request ({overhead / base:+.1%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark tracing overhead on a simulated /orchestrate request.")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--pages", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--export-delay-ms", type=float, default=200.0)
+    asyncio.run(main(parser.parse_args()))
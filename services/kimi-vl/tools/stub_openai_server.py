@@ -0,0 +1,108 @@
+"""
+Stand-in for a local OpenAI-compatible server (llama.cpp / vLLM) so the
+"local" provider and offline routing can be exercised without a GPU.
+
+    python tools/stub_openai_server.py --port 8080 --delay-ms 200
+    LOCAL_LLM_BASE_URL=http://localhost:8080/v1 OFFLINE_MODE=true python main.py
+
+/v1/chat/completions answers header prompts with a fixed invoice header and
+line-item prompts with ``--rows`` consistent rows. Like real models, it
+replies with pretty-printed JSON in a ```json fence plus a sentence of prose,
+unless the request carries a json_schema ``response_format``; then it returns
+compact bare JSON. ``max_tokens`` truncates the reply (finish_reason
+"length"), usage counts ~4 characters per token, and ``--ms-per-token`` adds
+decode time. ``--fail-rate`` makes a share of calls return 503 to test
+fallbacks.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import time
+from typing import Any, Dict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn  # noqa: E402
+from fastapi import FastAPI, HTTPException, Request  # noqa: E402
+
+HEADER = {
+    "invoice_number": "STUB-0001",
+    "invoice_date": "2026-01-15",
+    "buyer": {"name": "Stub Buyer LLC", "address": "1 Main St"},
+    "seller": {"name": "Stub Seller GmbH", "address": "2 Hauptstr."},
+    "total_amount": 150.0,
+    "total_currency": "USD",
+}
+
+
+def line_items(rows: int) -> Dict[str, Any]:
+    return {"line_items": [
+        {"model_code": f"W-{i:04d}", "goods_description": f"Widget model {i}, spare part for washing machine",
+         "quantity": i % 7 + 1, "unit_price": 25.0, "amount": 25.0 * (i % 7 + 1)}
+        for i in range(rows)
+    ]}
+
+
+def build_app(delay_ms: float, fail_rate: float, model: str, rows: int = 2, ms_per_token: float = 0.0) -> FastAPI:
+    app = FastAPI(title="Stub OpenAI-compatible server")
+    stats = {"requests": 0, "failed": 0}
+
+    @app.get("/v1/models")
+    async def models() -> Dict[str, Any]:
+        return {"object": "list", "data": [{"id": model, "object": "model", "owned_by": "stub"}]}
+
+    @app.get("/stats")
+    async def get_stats() -> Dict[str, Any]:
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request) -> Dict[str, Any]:
+        body = await request.json()
+        stats["requests"] += 1
+        if delay_ms:
+            await asyncio.sleep(delay_ms / 1000.0)
+        if random.random() < fail_rate:
+            stats["failed"] += 1
+            raise HTTPException(status_code=503, detail="stub overloaded")
+        parts = body["messages"][-1]["content"]
+        prompt = " ".join(p.get("text", "") for p in parts if p.get("type") == "text") if isinstance(parts, list) else str(parts)
+        payload = HEADER if "invoice_number" in prompt else line_items(rows)
+        if (body.get("response_format") or {}).get("type") == "json_schema":
+            content = json.dumps(payload, separators=(",", ":"))
+        else:
+            content = "Here is the extracted data:\n```json\n" + json.dumps(payload, indent=2) + "\n```"
+        finish_reason = "stop"
+        if body.get("max_tokens") and len(content) > body["max_tokens"] * 4:
+            content, finish_reason = content[: body["max_tokens"] * 4], "length"
+        tokens = math.ceil(len(content) / 4)
+        if ms_per_token:
+            await asyncio.sleep(tokens * ms_per_token / 1000.0)
+        return {
+            "id": f"chatcmpl-stub-{stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", model),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": tokens, "total_tokens": tokens},
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stub OpenAI-compatible chat-completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--model", default="local-vl")
+    parser.add_argument("--rows", type=int, default=2, help="line items per reply")
+    parser.add_argument("--ms-per-token", type=float, default=0.0)
+    args = parser.parse_args()
+    app = build_app(args.delay_ms, args.fail_rate, args.model, args.rows, args.ms_per_token)
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,354 @@
+"""
+In-process tracing with sampled, batched, background export.
+
+Spans are recorded in memory on the request path (a few microseconds each)
+and the finished trace is handed to a bounded queue. A background task
+exports batches through pluggable exporters, so LangSmith latency or outages
+never reach the request.
+
+    tracer = Tracer([JsonlExporter("/processed/traces.jsonl")], sample_rate=0.1, slow_ms=10000)
+    await tracer.start()
+    active = tracer.begin("orchestrate", filename=name)
+    with span("pipeline"):
+        ...
+    tracer.end(active, error=None)     # or: async with tracer.trace(...)
+
+Sampling: a head decision (``sample_rate``) is made when the trace starts,
+but spans are always recorded, so the tail decision can still keep every
+failed or slow request.
+
+``span()`` reads the current trace from a contextvar. Tasks created inside
+the request inherit it, and outside a trace it is a no-op.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Protocol
+
+logger = logging.getLogger(__name__)
+
+try:
+    from langsmith.run_trees import RunTree  # type: ignore
+except Exception:  # pragma: no cover - optional dep
+    RunTree = None  # type: ignore
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attributes", "error")
+
+    def __init__(self, name: str, span_id: int, parent_id: Optional[int], attributes: Dict[str, Any]):
+        self.name = name
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "span_id": f"{self.span_id:016x}",
+            "parent_id": f"{self.parent_id:016x}" if self.parent_id is not None else None,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round(((self.end or self.start) - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+        }
+
+
+class Trace:
+    __slots__ = ("trace_id", "root", "spans", "sampled", "_next_id", "kept_reason")
+
+    def __init__(self, name: str, sampled: bool, attributes: Dict[str, Any]):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.sampled = sampled
+        self._next_id = random.getrandbits(48) << 16
+        self.root = Span(name, self._id(), None, attributes)
+        self.spans: List[Span] = [self.root]
+        self.kept_reason: Optional[str] = None
+
+    def _id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def new_span(self, name: str, parent: Span, attributes: Dict[str, Any]) -> Span:
+        s = Span(name, self._id(), parent.span_id, attributes)
+        self.spans.append(s)
+        return s
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.root.end or time.time()) - self.root.start) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "kept": self.kept_reason,
+            "duration_ms": round(self.duration_ms, 3),
+            "error": self.root.error,
+            "spans": [s.to_dict() for s in self.spans],
+        }
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("span", default=None)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Any]:
+    """Child span of the current span; a no-op outside a trace."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NOOP
+        return
+    parent = _current_span.get() or trace.root
+    s = trace.new_span(name, parent, attributes)
+    token = _current_span.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.end = time.time()
+        _current_span.reset(token)
+
+
+def current_span() -> Any:
+    return _current_span.get() or _NOOP
+
+
+# --- Exporters --------------------------------------------------------------
+
+class Exporter(Protocol):
+    name: str
+
+    def export(self, traces: List[Trace]) -> None:
+        """Blocking; runs in a worker thread."""
+        ...  # pragma: no cover
+
+
+class JsonlExporter:
+    """One JSON line per trace. A local stand-in for an OTLP collector."""
+
+    name = "jsonl"
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def export(self, traces: List[Trace]) -> None:
+        payload = "".join(json.dumps(t.to_dict(), ensure_ascii=False, default=str) + "\n" for t in traces)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(payload)
+
+
+class LangSmithExporter:
+    """Posts each trace as a LangSmith run tree (spans become child runs)."""
+
+    name = "langsmith"
+
+    def __init__(self, project: str):
+        if RunTree is None:
+            raise RuntimeError("langsmith is not installed")
+        self.project = project
+
+    @staticmethod
+    def _ts(t: Optional[float]) -> Optional[datetime]:
+        return datetime.fromtimestamp(t, tz=timezone.utc) if t is not None else None
+
+    def export(self, traces: List[Trace]) -> None:
+        for trace in traces:
+            runs: Dict[int, Any] = {}
+            for s in trace.spans:  # parents are always recorded before children
+                kwargs = dict(name=s.name, run_type="chain", inputs=dict(s.attributes), start_time=self._ts(s.start))
+                if s.parent_id is None:
+                    run = RunTree(project_name=self.project, **kwargs)
+                else:
+                    run = runs[s.parent_id].create_child(**kwargs)
+                run.end(outputs={"duration_ms": round(((s.end or s.start) - s.start) * 1000, 3)},
+                        error=s.error, end_time=self._ts(s.end))
+                runs[s.span_id] = run
+            runs[trace.root.span_id].post(exclude_child_runs=False)
+
+
+def build_exporters(names: str, project: str, file_path: str) -> List[Exporter]:
+    exporters: List[Exporter] = []
+    for name in filter(None, (n.strip().lower() for n in names.split(","))):
+        try:
+            if name == "langsmith":
+                exporters.append(LangSmithExporter(project))
+            elif name == "jsonl":
+                exporters.append(JsonlExporter(file_path))
+            else:
+                logger.warning(f"Unknown trace exporter '{name}' ignored")
+        except Exception as e:
+            logger.warning(f"Trace exporter '{name}' disabled: {e}")
+    return exporters
+
+
+# --- Tracer -----------------------------------------------------------------
+
+class ActiveTrace:
+    __slots__ = ("trace", "trace_token", "span_token")
+
+    def __init__(self, trace: Trace, trace_token: Any, span_token: Any):
+        self.trace = trace
+        self.trace_token = trace_token
+        self.span_token = span_token
+
+
+class Tracer:
+    """Records traces on the request path and exports them off it."""
+
+    def __init__(
+        self,
+        exporters: List[Exporter],
+        sample_rate: float = 0.1,
+        slow_ms: float = 10000.0,
+        queue_size: int = 1000,
+        batch_size: int = 50,
+        flush_ms: float = 1000.0,
+    ):
+        self.exporters = exporters
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.slow_ms = slow_ms
+        self.batch_size = max(1, batch_size)
+        self.flush_s = max(0.01, flush_ms / 1000.0)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self._task: Optional[asyncio.Task] = None
+        self.counters = {
+            "started": 0, "kept_head": 0, "kept_error": 0, "kept_slow": 0,
+            "discarded": 0, "dropped_queue_full": 0, "exported": 0, "export_errors": 0,
+        }
+        self.export_seconds = 0.0
+        self.batches = 0
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._export_loop())
+
+    def begin(self, name: str, **attributes: Any) -> "ActiveTrace":
+        """Open the root span for one request; pair with ``end()`` in the same task."""
+        self.counters["started"] += 1
+        t = Trace(name, random.random() < self.sample_rate, attributes)
+        return ActiveTrace(t, _current_trace.set(t), _current_span.set(t.root))
+
+    def end(self, active: "ActiveTrace", error: Optional[str] = None, **attributes: Any) -> None:
+        """Close the root span and queue the trace if sampling keeps it. Never blocks."""
+        t = active.trace
+        if t.root.end is not None:
+            return
+        t.root.end = time.time()
+        t.root.attributes.update(attributes)
+        t.root.error = error or t.root.error
+        _current_span.reset(active.span_token)
+        _current_trace.reset(active.trace_token)
+        self._finish(t)
+
+    @asynccontextmanager
+    async def trace(self, name: str, **attributes: Any) -> AsyncIterator[Trace]:
+        active = self.begin(name, **attributes)
+        error = None
+        try:
+            yield active.trace
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.end(active, error=error)
+
+    def _finish(self, t: Trace) -> None:
+        if t.root.error or any(s.error for s in t.spans):
+            t.kept_reason = "error"
+        elif t.duration_ms >= self.slow_ms:
+            t.kept_reason = "slow"
+        elif t.sampled:
+            t.kept_reason = "head"
+        else:
+            self.counters["discarded"] += 1
+            return
+        self.counters[f"kept_{t.kept_reason}"] += 1
+        try:
+            self._queue.put_nowait(t)
+        except asyncio.QueueFull:
+            self.counters["dropped_queue_full"] += 1
+
+    async def _export_loop(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            deadline = asyncio.get_running_loop().time() + self.flush_s
+            while len(batch) < self.batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._export(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _export(self, batch: List[Trace]) -> None:
+        started = time.perf_counter()
+        for exporter in self.exporters:
+            try:
+                await asyncio.to_thread(exporter.export, batch)
+            except Exception as e:
+                self.counters["export_errors"] += 1
+                logger.warning(f"Trace export via {exporter.name} failed ({len(batch)} traces): {e}")
+        self.counters["exported"] += len(batch)
+        self.export_seconds += time.perf_counter() - started
+        self.batches += 1
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Let the exporter drain the queue (bounded by ``timeout``), then stop it."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Trace exporter did not drain in {timeout}s; {self._queue.qsize()} traces dropped")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "exporters": [e.name for e in self.exporters],
+            "sample_rate": self.sample_rate,
+            "slow_ms": self.slow_ms,
+            "queued": self._queue.qsize(),
+            **self.counters,
+            "avg_export_batch_ms": round(self.export_seconds / self.batches * 1000, 2) if self.batches else 0.0,
+        }